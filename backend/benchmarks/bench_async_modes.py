@@ -0,0 +1,104 @@
+"""
+Concurrency benchmark for the Socket.IO async modes served by serve.py.
+
+For each async mode, starts `serve.py --async-mode MODE` on a fresh SQLite
+database, then:
+  1. logs in C users and opens C WebSocket connections to /chat, each user
+     joining the room it shares with its partner (users are paired up);
+  2. has every user send M messages to its partner at the same time, and
+     waits until every room member has received every broadcast.
+
+Reports how many connections were accepted, the connect rate, and messages
+per second for both sends (stored + acknowledged) and deliveries (broadcasts
+received by clients).
+
+Modes whose package is not installed in --python are skipped.
+
+Usage (from the backend folder):
+    python benchmarks/bench_async_modes.py
+    python benchmarks/bench_async_modes.py --clients 1000 --messages 20
+    python benchmarks/bench_async_modes.py --python venv/bin/python --modes gevent eventlet
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from chat_load import ChatClient, mode_available, partner, setup_database, start_server, TIMEOUT
+
+
+def run(port, rooms, messages, concurrency):
+    """ Returns (clients connected, connect seconds, delivery seconds, messages delivered) """
+    clients = [ChatClient(f'http://127.0.0.1:{port}', f'bench{i}') for i in range(len(rooms))]
+
+    def connect(pair):
+        client, room = pair
+        try:
+            client.connect(room)
+            return client
+        except Exception:
+            return None
+
+    began = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        connected = [c for c in pool.map(connect, zip(clients, rooms)) if c is not None]
+    connect_time = time.perf_counter() - began
+
+    # Each client sees its own messages and its partner's
+    for client in connected:
+        client.expected = 2 * messages
+    began = time.perf_counter()
+    for i in range(messages):
+        for client in connected:
+            client.emit('message', [{'recipient_user_name': partner(client.username),
+                                     'message': f'message {i}'}])
+    for client in connected:
+        client.done.wait(TIMEOUT)
+    delivery_time = time.perf_counter() - began
+
+    delivered = sum(min(client.received, client.expected) for client in connected)
+    for client in connected:
+        client.close()
+    return len(connected), connect_time, delivery_time, delivered
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--clients', type=int, default=200, help='even number of users')
+    parser.add_argument('--messages', type=int, default=10, help='messages sent per user')
+    parser.add_argument('--modes', nargs='+', default=['threading', 'gevent', 'eventlet'])
+    parser.add_argument('--python', default=sys.executable, help='interpreter running serve.py')
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--concurrency', type=int, default=50, help='parallel connects')
+    args = parser.parse_args()
+
+    print(f'{args.clients} clients x {args.messages} messages')
+    print(f"{'mode':<10} {'connected':>10} {'conn/s':>8} {'sent/s':>8} {'delivered/s':>12} {'lost':>6}")
+    for mode in args.modes:
+        if not mode_available(args.python, mode):
+            print(f'{mode:<10} not installed')
+            continue
+        db_fd, db_path = tempfile.mkstemp(suffix='.db')
+        database_uri = f'sqlite:///{db_path}'
+        server = None
+        try:
+            rooms = setup_database(database_uri, args.clients)
+            server = start_server(args.python, mode, database_uri, args.port)
+            connected, connect_time, delivery_time, delivered = \
+                run(args.port, rooms, args.messages, args.concurrency)
+            sent = connected * args.messages
+            print(f'{mode:<10} {connected:>10} {connected / connect_time:>8.0f} '
+                  f'{sent / delivery_time:>8.0f} {delivered / delivery_time:>12.0f} '
+                  f'{2 * sent - delivered:>6}')
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+            os.close(db_fd)
+            os.unlink(db_path)
+
+
+if __name__ == '__main__':
+    main()
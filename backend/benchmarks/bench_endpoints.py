@@ -0,0 +1,246 @@
+"""
+Endpoint benchmarks at production data sizes.
+
+Builds (once, then reuses until the schema changes) a SQLite database per
+size with seed-demo's scale mode, logs in as the user with the most contacts and times the read
+endpoints through the Flask test client:
+
+    chat            GET /chat/<room_id>                 their busiest conversation
+    chat_before     GET /chat/<room_id>?before=<id>     a page from the middle of it
+    contacts        GET /contacts
+    chat_304        GET /chat/<room_id> with the ETag of the last response
+    contacts_304    GET /contacts with the ETag of the last response
+    search_prefix   GET /users/search?username=<2 letters>
+    search_infix    GET /users/search?username=<4 letters inside names>
+
+For each endpoint it records the first (cold cache) request, the median and
+p95 of --repeat warm requests, the SQL statements run (from the
+Server-Timing header) and the response size, then compares them with the
+stored baseline. A case regresses when its median is more than --threshold
+slower (and at least --min-delta-ms), or when it runs more queries. The
+exit status is 1 if anything regressed.
+
+Usage (from the backend folder):
+    python benchmarks/bench_endpoints.py                          # 1k, 100k and 10m
+    python benchmarks/bench_endpoints.py --sizes 1k,100k --threshold 0.5
+    python benchmarks/bench_endpoints.py --save-baseline          # accept the current numbers
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from message_app import create_app, db_
+from message_app.data_classes import Contact, Conversation, Message, User
+from message_app.db import init_db
+from message_app.seed_demo import SCALE_PASSWORD, seed_scale
+
+SIZES = {
+    '1k': {'users': 100, 'contacts_per_user': 10, 'messages': 1_000},
+    '100k': {'users': 2_000, 'contacts_per_user': 20, 'messages': 100_000},
+    '10m': {'users': 50_000, 'contacts_per_user': 20, 'messages': 10_000_000},
+}
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_endpoints_baseline.json')
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+def make_app(path):
+    return create_app(test_config={'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}',
+                                   'LOG_LEVEL': 'WARNING', 'SLOW_QUERY_THRESHOLD_MS': None})
+
+
+def schema_digest():
+    """ Returns a short hash of the tables and indexes, so cached databases are rebuilt when they change """
+    dialect = sqlite.dialect()
+    ddl = []
+    for table in db_.metadata.sorted_tables:
+        ddl.append(str(CreateTable(table).compile(dialect=dialect)))
+        ddl += sorted(str(CreateIndex(index).compile(dialect=dialect)) for index in table.indexes)
+    return hashlib.sha1('\n'.join(ddl).encode()).hexdigest()[:8]
+
+
+def database(data_dir, size, seed, rebuild):
+    """ Returns the path of the database for size, building it if needed """
+    path = os.path.join(data_dir, f'endpoints-{size}-seed{seed}-{schema_digest()}.db')
+    if os.path.exists(path) and not rebuild:
+        return path
+    partial = path + '.partial'
+    if os.path.exists(partial):
+        os.unlink(partial)
+    app = make_app(partial)
+    print(f'Building {size} database in {path}...')
+    started = time.perf_counter()
+    with app.app_context():
+        init_db()
+        seed_scale(seed=seed, **SIZES[size])
+        db_.engine.dispose()
+    os.replace(partial, path)
+    print(f'Built in {time.perf_counter() - started:.1f}s')
+    return path
+
+
+def requests_for(app):
+    """ Returns (user name, {case: url}) for the user with the most contacts """
+    with app.app_context():
+        user_id = db_.session.scalar(
+            select(Contact.user).group_by(Contact.user)
+            .order_by(func.count().desc(), Contact.user).limit(1))
+        user_name = db_.session.scalar(select(User.user_name).where(User.id == user_id))
+        room_id, count = db_.session.execute(
+            select(Conversation.id, func.count(Message.id))
+            .join(Message, Message.conversation_id == Conversation.id)
+            .where(or_(Conversation.low_user == user_id, Conversation.high_user == user_id))
+            .group_by(Conversation.id).order_by(func.count(Message.id).desc(), Conversation.id)
+            .limit(1)).one()
+        middle = db_.session.scalar(
+            select(Message.id).where(Message.conversation_id == room_id)
+            .order_by(Message.id).offset(count // 2).limit(1))
+    # Scale-mode names are first_last<id>
+    first, last = user_name.rstrip('0123456789').split('_', 1)
+    return user_name, {
+        'chat': f'/chat/{room_id}',
+        'chat_before': f'/chat/{room_id}?before={middle}',
+        'contacts': '/contacts',
+        'chat_304': f'/chat/{room_id}',
+        'contacts_304': '/contacts',
+        'search_prefix': f'/users/search?username={first[:2]}',
+        'search_infix': f'/users/search?username={last[1:5]}',
+    }
+
+
+def measure(client, url, repeat, revalidate=False):
+    """
+        Returns the timings, queries and size of GET url. With revalidate,
+        every request sends the ETag of a previous response and must get 304.
+    """
+    headers = {'If-None-Match': client.get(url).headers['ETag']} if revalidate else {}
+    expected = 304 if revalidate else 200
+    timings = []
+    for _ in range(repeat + 1):
+        started = time.perf_counter()
+        response = client.get(url, headers=headers)
+        timings.append((time.perf_counter() - started) * 1000)
+        if response.status_code != expected:
+            raise RuntimeError(f'GET {url} returned {response.status_code}')
+    queries = SERVER_TIMING_QUERIES.search(response.headers['Server-Timing'])
+    warm = sorted(timings[1:])
+    return {
+        'url': url,
+        'first_ms': round(timings[0], 2),
+        'median_ms': round(statistics.median(warm), 2),
+        'p95_ms': round(warm[min(len(warm) - 1, round(0.95 * len(warm)) - 1)], 2),
+        'queries': int(queries.group(1)),
+        'bytes': len(response.data),
+    }
+
+
+def run_size(path, repeat):
+    app = make_app(path)
+    user_name, urls = requests_for(app)
+    client = app.test_client()
+    response = client.post('/auth/login', json={'username': user_name, 'password': SCALE_PASSWORD})
+    if response.status_code != 200:
+        raise RuntimeError(f'could not log in as {user_name}')
+    results = {case: measure(client, url, repeat, revalidate=case.endswith('_304'))
+               for case, url in urls.items()}
+    with app.app_context():
+        db_.engine.dispose()
+    return results
+
+
+def compare(results, baseline, threshold, min_delta_ms):
+    """ Returns list of regression descriptions """
+    regressions = []
+    for size, cases in results.items():
+        for case, current in cases.items():
+            previous = baseline.get(size, {}).get(case)
+            if previous is None:
+                continue
+            slower = current['median_ms'] - previous['median_ms']
+            if slower > min_delta_ms and current['median_ms'] > previous['median_ms'] * (1 + threshold):
+                regressions.append(f'{size} {case}: median {current["median_ms"]} ms, '
+                                   f'baseline {previous["median_ms"]} ms')
+            if current['queries'] > previous['queries']:
+                regressions.append(f'{size} {case}: {current["queries"]} queries, '
+                                   f'baseline {previous["queries"]}')
+    return regressions
+
+
+def print_table(size, cases, baseline):
+    print(f'\n{size} messages')
+    print(f"{'case':<14} {'first ms':>9} {'median ms':>10} {'p95 ms':>8} {'baseline':>9} "
+          f"{'queries':>8} {'bytes':>8}")
+    for case, result in cases.items():
+        previous = baseline.get(size, {}).get(case, {}).get('median_ms', '-')
+        print(f"{case:<14} {result['first_ms']:>9} {result['median_ms']:>10} {result['p95_ms']:>8} "
+              f"{previous:>9} {result['queries']:>8} {result['bytes']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default=','.join(SIZES),
+                        help=f'comma-separated, from {", ".join(SIZES)}')
+    parser.add_argument('--repeat', type=int, default=20, help='warm requests per case')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'message_app_bench'),
+                        help='where the generated databases are kept between runs')
+    parser.add_argument('--rebuild', action='store_true', help='regenerate the databases')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed slowdown of the median, as a fraction')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                        help='ignore slowdowns smaller than this')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='write the results to --baseline instead of comparing')
+    parser.add_argument('--output', help='also write the results as JSON to this file')
+    args = parser.parse_args()
+
+    sizes = args.sizes.split(',')
+    unknown = set(sizes) - set(SIZES)
+    if unknown:
+        parser.error(f'unknown sizes: {", ".join(sorted(unknown))}')
+    os.makedirs(args.data_dir, exist_ok=True)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = {}
+    for size in sizes:
+        path = database(args.data_dir, size, args.seed, args.rebuild)
+        results[size] = run_size(path, args.repeat)
+        print_table(size, results[size], baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({**baseline, **results}, f, indent=2)
+            f.write('\n')
+        print(f'\nSaved baseline to {args.baseline}')
+        return
+
+    regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+    if regressions:
+        print('\nRegressions:')
+        for line in regressions:
+            print(f'  {line}')
+        sys.exit(1)
+    print('\nNo regressions' if baseline else '\nNo baseline to compare with; run with --save-baseline')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Throughput benchmark for the chat message write path.
+
+Runs S concurrent sender threads that each write M messages, first with one
+transaction per message (the default path in chat.on_message) and then
+through a GroupCommitWriter, and reports messages per second and failed
+writes (e.g. "database is locked") for each mode.
+
+Usage (from the backend folder):
+    python benchmarks/bench_group_commit.py
+    python benchmarks/bench_group_commit.py --senders 32 --messages 200 --window-ms 2
+    DATABASE_URL=postgresql://... python benchmarks/bench_group_commit.py
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+
+from message_app import create_app, db_
+from message_app.data_classes import User
+from message_app.db import init_db, insert_messages, get_conversation
+from message_app.group_commit import GroupCommitWriter
+
+
+def write_direct(row):
+    insert_messages([row])
+    db_.session.commit()
+
+
+def run(app, write, senders, messages, conversation_ids):
+    """ Returns (elapsed seconds, number of failed writes) """
+    failures = []
+    start = threading.Barrier(senders + 1)
+
+    def sender(n):
+        with app.app_context():
+            start.wait()
+            for i in range(messages):
+                row = {'conversation_id': conversation_ids[n], 'user_from': 2 * n + 1,
+                       'user_to': 2 * n + 2, 'text': f'message {i} from sender {n}'}
+                try:
+                    write(row)
+                except Exception as e:
+                    db_.session.rollback()
+                    failures.append(e)
+
+    threads = [threading.Thread(target=sender, args=(n,)) for n in range(senders)]
+    for t in threads:
+        t.start()
+    start.wait()
+    began = time.perf_counter()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - began, len(failures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--senders', type=int, default=16)
+    parser.add_argument('--messages', type=int, default=100)
+    parser.add_argument('--window-ms', type=float, default=5)
+    parser.add_argument('--max-batch', type=int, default=100)
+    args = parser.parse_args()
+
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    database_url = os.environ.get('DATABASE_URL', f'sqlite:///{db_path}')
+    app = create_app(test_config={'SQLALCHEMY_DATABASE_URI': database_url,
+                                  'LOG_LEVEL': 'WARNING',
+                                  'SQLALCHEMY_ENGINE_OPTIONS': {'pool_size': args.senders + 1}})
+    try:
+        with app.app_context():
+            init_db()
+            password = generate_password_hash('bench')
+            db_.session.execute(insert(User), [{'user_name': f'user{i}', 'user_pwd': password}
+                                               for i in range(2 * args.senders)])
+            users = db_.session.scalars(db_.select(User).order_by(User.id)).all()
+            conversation_ids = [get_conversation(users[2 * n], users[2 * n + 1], create=True).id
+                                for n in range(args.senders)]
+            db_.session.commit()
+
+        writer = GroupCommitWriter(window=args.window_ms / 1000, max_size=args.max_batch)
+        total = args.senders * args.messages
+        print(f'{args.senders} senders x {args.messages} messages ({database_url.split(":")[0]})')
+        print(f"{'mode':<14} {'msgs/s':>10} {'failed':>8}")
+        for mode, write in (('per-message', write_direct), ('group-commit', writer.submit)):
+            elapsed, failed = run(app, write, args.senders, args.messages, conversation_ids)
+            print(f'{mode:<14} {(total - failed) / elapsed:>10.0f} {failed:>8}')
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Throughput benchmark for the message_batch Socket.IO event.
+
+Sends M messages from one user to another through the Socket.IO test client,
+first as one 'message' event each (chat.on_message) and then as
+'message_batch' events of each --batch-sizes size (chat.on_message_batch),
+and reports messages per second. Both users' sockets are in the room, so every
+send includes its broadcast. Handlers run in-process, so the numbers are the
+server's cost per message without the network.
+
+Usage (from the backend folder):
+    python benchmarks/bench_message_batch.py
+    python benchmarks/bench_message_batch.py --messages 5000 --batch-sizes 10,100
+    DATABASE_URL=postgresql://... python benchmarks/bench_message_batch.py
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+
+from message_app import create_app, db_
+from message_app.data_classes import Contact, User
+from message_app.db import init_db
+
+
+def setup(app):
+    """ Returns the Socket.IO clients of two users who have each other as contacts, both in their room """
+    with app.app_context():
+        init_db()
+        password = generate_password_hash('bench', method='pbkdf2:sha256:1000')
+        db_.session.execute(insert(User), [{'user_name': name, 'user_pwd': password}
+                                           for name in ('sender', 'receiver')])
+        db_.session.execute(insert(Contact), [{'user': 1, 'contact': 2}, {'user': 2, 'contact': 1}])
+        db_.session.commit()
+    sockets = []
+    for name in ('sender', 'receiver'):
+        client = app.test_client()
+        client.post('/auth/login', json={'username': name, 'password': 'bench'})
+        socket = app.extensions['socketio'].test_client(app, namespace='/chat',
+                                                        flask_test_client=client)
+        socket.emit('join', {'room': '1'}, namespace='/chat')
+        sockets.append(socket)
+    return sockets
+
+
+def run(sockets, messages, batch_size):
+    """ Returns elapsed seconds; batch_size None sends single 'message' events """
+    sender = sockets[0]
+    began = time.perf_counter()
+    if batch_size is None:
+        for i in range(messages):
+            sender.emit('message', [{'recipient_user_name': 'receiver', 'message': f'message {i}'}],
+                        namespace='/chat')
+    else:
+        for start in range(0, messages, batch_size):
+            texts = [f'message {i}' for i in range(start, min(start + batch_size, messages))]
+            ack = sender.emit('message_batch', {'recipient_user_name': 'receiver', 'messages': texts},
+                              namespace='/chat', callback=True)
+            assert all(result['ok'] for result in ack['results'])
+    elapsed = time.perf_counter() - began
+    for socket in sockets:
+        socket.get_received(namespace='/chat')
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--batch-sizes', default='10,50,100')
+    args = parser.parse_args()
+    batch_sizes = [int(size) for size in args.batch_sizes.split(',')]
+
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    database_url = os.environ.get('DATABASE_URL', f'sqlite:///{db_path}')
+    app = create_app(test_config={'SQLALCHEMY_DATABASE_URI': database_url,
+                                  'LOG_LEVEL': 'WARNING', 'REQUEST_LOG_LEVEL': 'DEBUG',
+                                  'SLOW_QUERY_THRESHOLD_MS': None,
+                                  'MESSAGE_BATCH_EVENT_MAX_SIZE': max(batch_sizes)})
+    try:
+        sockets = setup(app)
+        print(f'{args.messages} messages ({database_url.split(":")[0]})')
+        print(f"{'mode':<16} {'msgs/s':>8} {'speedup':>8}")
+        single = None
+        for batch_size in [None] + batch_sizes:
+            elapsed = run(sockets, args.messages, batch_size)
+            rate = args.messages / elapsed
+            single = single or rate
+            mode = 'message' if batch_size is None else f'batch of {batch_size}'
+            print(f'{mode:<16} {rate:>8.0f} {rate / single:>7.1f}x')
+        for socket in sockets:
+            socket.disconnect(namespace='/chat')
+        with app.app_context():
+            db_.engine.dispose()
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+
+
+if __name__ == '__main__':
+    main()
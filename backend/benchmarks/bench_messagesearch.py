@@ -0,0 +1,93 @@
+"""
+Benchmark for GET /messages/search.
+
+Builds a throwaway SQLite database with N messages spread over many
+conversations and times search.search_messages for one user, for common
+and rare words.
+
+Usage (from the backend folder):
+    python benchmarks/bench_messagesearch.py                    # 1,000,000 messages
+    python benchmarks/bench_messagesearch.py --messages 10000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+
+from message_app import create_app, db_
+from message_app.data_classes import Conversation, Message, User
+from message_app.db import init_db
+from message_app.search import search_messages
+
+WORDS = ['hello', 'coffee', 'meeting', 'tomorrow', 'thanks', 'project', 'weekend', 'dinner',
+         'call', 'later', 'sounds', 'good', 'review', 'deploy', 'bug', 'game', 'trip', 'see',
+         'you', 'soon', 'ok', 'sure', 'what', 'time', 'lunch', 'today', 'maybe', 'great']
+TERMS = ['hello', 'coffee meeting', 'deploy bug tomorrow', 'xylophone']
+BATCH_SIZE = 20_000
+
+
+def populate(user_count, message_count, seed):
+    """ Bulk-inserts users, one conversation per neighbouring pair, and messages """
+    rng = random.Random(seed)
+    password = generate_password_hash('bench')
+    db_.session.execute(insert(User), [{'user_name': f'user{i}', 'user_pwd': password}
+                                       for i in range(user_count)])
+    pairs = [(i, i % user_count + 1) for i in range(1, user_count + 1)]
+    db_.session.execute(insert(Conversation), [{'low_user': min(a, b), 'high_user': max(a, b)}
+                                               for a, b in pairs])
+    for start in range(0, message_count, BATCH_SIZE):
+        rows = []
+        for _ in range(min(BATCH_SIZE, message_count - start)):
+            conversation_id = rng.randrange(len(pairs))
+            user_from, user_to = pairs[conversation_id]
+            if rng.random() < 0.5:
+                user_from, user_to = user_to, user_from
+            rows.append({'conversation_id': conversation_id + 1, 'user_from': user_from,
+                         'user_to': user_to,
+                         'text': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))})
+        db_.session.execute(insert(Message), rows)
+    db_.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    app = create_app(test_config={'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+                                  'LOG_LEVEL': 'WARNING'})
+    try:
+        with app.app_context():
+            init_db()
+            start = time.perf_counter()
+            populate(args.users, args.messages, args.seed)
+            print(f'Inserted {args.messages:,} messages in {time.perf_counter() - start:.1f}s')
+
+            user = db_.session.get(User, 1)
+            print(f"{'term':<22} {'first page ms':>14} {'rows':>6}")
+            for term in TERMS:
+                best = float('inf')
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    page, _ = search_messages(user, term, limit=args.limit)
+                    best = min(best, time.perf_counter() - start)
+                print(f'{term:<22} {best * 1000:>14.1f} {len(page):>6}')
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Write-concurrency benchmark for the SQLite connection profiles.
+
+For each SQLITE_PROFILE ('default' then 'performance') builds a fresh SQLite
+file, then runs W writer threads that each store messages one transaction at
+a time (the path chat.on_message takes) next to R reader threads that page
+through conversation history, for --seconds. Reports committed writes and
+reads per second, write latency percentiles and failed writes (e.g.
+"database is locked").
+
+Usage (from the backend folder):
+    python benchmarks/bench_sqlite_profile.py
+    python benchmarks/bench_sqlite_profile.py --writers 16 --readers 8 --seconds 10
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert, select
+from werkzeug.security import generate_password_hash
+
+from message_app import create_app, db_
+from message_app.chat import get_message_page
+from message_app.data_classes import User
+from message_app.db import init_db, insert_messages, get_conversation
+
+
+def percentile(ordered, p):
+    if not ordered:
+        return float('nan')
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+
+def setup(app, writers):
+    """ Returns the conversation id of each writer's pair of users """
+    with app.app_context():
+        init_db()
+        password = generate_password_hash('bench', method='pbkdf2:sha256:1000')
+        db_.session.execute(insert(User), [{'user_name': f'user{i}', 'user_pwd': password}
+                                           for i in range(2 * writers)])
+        users = db_.session.scalars(select(User).order_by(User.id)).all()
+        conversation_ids = [get_conversation(users[2 * n], users[2 * n + 1], create=True).id
+                            for n in range(writers)]
+        db_.session.commit()
+    return conversation_ids
+
+
+def run(app, conversation_ids, readers, seconds):
+    """ Returns dict with writes, reads, failures and sorted write latencies (ms) """
+    latencies, failures, reads = [], [], [0] * readers
+    stop = threading.Event()
+    start = threading.Barrier(len(conversation_ids) + readers + 1)
+
+    def writer(n):
+        with app.app_context():
+            start.wait()
+            i = 0
+            while not stop.is_set():
+                row = {'conversation_id': conversation_ids[n], 'user_from': 2 * n + 1,
+                       'user_to': 2 * n + 2, 'text': f'message {i} from writer {n}'}
+                began = time.perf_counter()
+                try:
+                    insert_messages([row])
+                    db_.session.commit()
+                    latencies.append((time.perf_counter() - began) * 1000)
+                except Exception as e:
+                    db_.session.rollback()
+                    failures.append(e)
+                i += 1
+
+    def reader(n):
+        with app.app_context():
+            start.wait()
+            while not stop.is_set():
+                get_message_page(conversation_ids[n % len(conversation_ids)])
+                db_.session.rollback()
+                reads[n] += 1
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(len(conversation_ids))]
+    threads += [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+    for t in threads:
+        t.start()
+    start.wait()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    return {'writes': len(latencies), 'reads': sum(reads), 'failed': len(failures),
+            'latencies': sorted(latencies)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    print(f'{args.writers} writers, {args.readers} readers, {args.seconds:g}s per profile')
+    print(f"{'profile':<12} {'writes/s':>9} {'reads/s':>8} {'p50 ms':>7} {'p99 ms':>7} "
+          f"{'max ms':>8} {'failed':>7}")
+    for profile in ('default', 'performance'):
+        db_fd, db_path = tempfile.mkstemp(suffix='.db')
+        app = create_app(test_config={
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}', 'LOG_LEVEL': 'WARNING',
+            'SLOW_QUERY_THRESHOLD_MS': None, 'SQLITE_PROFILE': profile,
+            'SQLALCHEMY_ENGINE_OPTIONS': {'pool_size': args.writers + args.readers + 1}})
+        try:
+            conversation_ids = setup(app, args.writers)
+            result = run(app, conversation_ids, args.readers, args.seconds)
+            latencies = result['latencies']
+            print(f"{profile:<12} {result['writes'] / args.seconds:>9.0f} "
+                  f"{result['reads'] / args.seconds:>8.0f} {percentile(latencies, 50):>7.1f} "
+                  f"{percentile(latencies, 99):>7.1f} {latencies[-1] if latencies else 0:>8.1f} "
+                  f"{result['failed']:>7}")
+            with app.app_context():
+                db_.engine.dispose()
+        finally:
+            os.close(db_fd)
+            os.unlink(db_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Benchmark for GET /users/search backends.
+
+Builds a throwaway SQLite database with N users and times the legacy
+unbounded ILIKE '%term%' query against search.search_users for a set of
+typical search-box terms.
+
+Usage (from the backend folder):
+    python benchmarks/bench_usersearch.py                 # 1,000,000 users
+    python benchmarks/bench_usersearch.py --users 100000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert, select
+from werkzeug.security import generate_password_hash
+
+from message_app import create_app, db_
+from message_app.data_classes import User
+from message_app.db import init_db
+from message_app.search import search_users
+
+SYLLABLES = ['al', 'be', 'ca', 'do', 'el', 'fi', 'ga', 'ha', 'is', 'jo', 'ka', 'li',
+             'ma', 'no', 'os', 'pe', 'qu', 'ra', 'si', 'to', 'ul', 've', 'wi', 'xa',
+             'yo', 'ze']
+TERMS = ['a', 'ma', 'mar', 'xaze', 'lima', 'zzz']
+BATCH_SIZE = 10_000
+
+
+def populate(user_count, seed):
+    """ Bulk-inserts user_count users with deterministic names """
+    rng = random.Random(seed)
+    password = generate_password_hash('bench')
+    for start in range(0, user_count, BATCH_SIZE):
+        rows = []
+        for i in range(start, min(start + BATCH_SIZE, user_count)):
+            name = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+            rows.append({'user_name': f'{name}{i}', 'user_pwd': password})
+        db_.session.execute(insert(User), rows)
+    db_.session.commit()
+
+
+def timed(fn, repeat):
+    """ Returns (best wall time in ms, result of the last call) """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    app = create_app(test_config={'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+                                  'LOG_LEVEL': 'WARNING'})
+    try:
+        with app.app_context():
+            init_db()
+            start = time.perf_counter()
+            populate(args.users, args.seed)
+            print(f'Inserted {args.users:,} users in {time.perf_counter() - start:.1f}s')
+
+            print(f"{'term':<8} {'ilike ms':>10} {'rows':>8} {'search ms':>10} {'rows':>6}")
+            for term in TERMS:
+                legacy_ms, legacy_rows = timed(lambda: db_.session.scalars(
+                    select(User).where(User.user_name.ilike(f'%{term}%'))).all(), args.repeat)
+                search_ms, (page, _) = timed(lambda: search_users(term, args.limit), args.repeat)
+                print(f'{term:<8} {legacy_ms:>10.1f} {len(legacy_rows):>8} {search_ms:>10.1f} {len(page):>6}')
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""
+Shared pieces of the Socket.IO benchmarks: a WebSocket /chat client, the
+database seeding and the serve.py process that the clients talk to.
+
+Not a benchmark itself; imported by bench_async_modes.py and loadgen.py.
+"""
+import http.cookiejar
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+import simple_websocket
+from sqlalchemy import insert, select
+from werkzeug.security import generate_password_hash
+
+from message_app import create_app, db_
+from message_app.data_classes import Contact, User
+from message_app.db import init_db, get_conversation
+
+TIMEOUT = 60
+PASSWORD = 'bench'
+
+
+class ChatClient:
+    """
+        One logged-in user speaking Socket.IO over a WebSocket to /chat.
+
+        Counts the 'message' broadcasts it receives; set expected to have
+        done signalled once that many arrived, and on_message to see each
+        payload (called on the client's listener thread).
+    """
+    def __init__(self, base_url, username):
+        self.base_url = base_url
+        self.username = username
+        self.received = 0
+        self.done = threading.Event()
+        self.expected = None
+        self.on_message = None
+        self.ws = None
+        self._send_lock = threading.Lock()
+
+    def login(self):
+        jar = http.cookiejar.CookieJar()
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+        request = urllib.request.Request(
+            f'{self.base_url}/auth/login',
+            data=json.dumps({'username': self.username, 'password': PASSWORD}).encode(),
+            headers={'Content-Type': 'application/json'})
+        opener.open(request, timeout=TIMEOUT).close()
+        return '; '.join(f'{cookie.name}={cookie.value}' for cookie in jar)
+
+    def connect(self, room):
+        cookie = self.login()
+        ws_url = self.base_url.replace('http', 'ws', 1)
+        self.ws = simple_websocket.Client.connect(
+            f'{ws_url}/socket.io/?EIO=4&transport=websocket', headers={'Cookie': cookie})
+        self.ws.receive(TIMEOUT)              # Engine.IO open packet
+        self._send('40/chat,')
+        if not self.ws.receive(TIMEOUT).startswith('40/chat,'):
+            raise ConnectionError(f'{self.username}: /chat connect refused')
+        self.emit('join', {'room': room})
+        while not self._next_event().startswith('42/chat,["room_joined"'):
+            pass
+        threading.Thread(target=self._listen, daemon=True).start()
+
+    def emit(self, event, data):
+        self._send('42/chat,' + json.dumps([event, data]))
+
+    def _send(self, packet):
+        with self._send_lock:
+            self.ws.send(packet)
+
+    def _next_event(self):
+        """ Returns the next non-ping packet, answering pings on the way """
+        while True:
+            packet = self.ws.receive(TIMEOUT)
+            if packet == '2':
+                self._send('3')
+            elif packet is not None:
+                return packet
+
+    def _listen(self):
+        try:
+            while True:
+                packet = self._next_event()
+                if packet.startswith('42/chat,["message"'):
+                    self.received += 1
+                    if self.on_message is not None:
+                        self.on_message(json.loads(packet[len('42/chat,'):])[1])
+                    if self.received == self.expected:
+                        self.done.set()
+        except Exception:
+            pass
+
+    def close(self):
+        if self.ws is not None:
+            self.ws.close()
+
+
+def setup_database(database_uri, users):
+    """
+        Creates users bench0 .. bench<users-1> in pairs (bench0 with bench1,
+        ...) that have added each other and share a conversation.
+
+    Returns list: the room id of each user, by index
+    """
+    app = create_app(test_config={'SQLALCHEMY_DATABASE_URI': database_uri, 'LOG_LEVEL': 'WARNING'})
+    with app.app_context():
+        init_db()
+        # A cheap hash keeps logins from dominating the connect phase
+        password = generate_password_hash(PASSWORD, method='pbkdf2:sha256:1000')
+        db_.session.execute(insert(User), [{'user_name': f'bench{i}', 'user_pwd': password}
+                                           for i in range(users)])
+        rows = db_.session.scalars(select(User).order_by(User.id)).all()
+        pairs = list(zip(rows[0::2], rows[1::2]))
+        db_.session.execute(insert(Contact), [{'user': a.id, 'contact': b.id} for a, b in pairs] +
+                                             [{'user': b.id, 'contact': a.id} for a, b in pairs])
+        rooms = []
+        for a, b in pairs:
+            room = get_conversation(a, b, create=True).room_id
+            rooms += [room, room]
+        db_.session.commit()
+    return rooms
+
+
+def partner(username):
+    """ Returns the name of the user paired with username by setup_database """
+    return f'bench{int(username[len("bench"):]) ^ 1}'
+
+
+def mode_available(python, mode):
+    if mode == 'threading':
+        return True
+    return subprocess.run([python, '-c', f'import {mode}'], capture_output=True).returncode == 0
+
+
+def start_server(python, mode, database_uri, port, env=None):
+    """ Starts serve.py and waits until it accepts connections; returns the Popen """
+    env = dict(os.environ, DATABASE_URL=database_uri, LOG_LEVEL='WARNING',
+               REQUEST_LOG_LEVEL='DEBUG', **(env or {}))
+    server = subprocess.Popen([python, os.path.join(BACKEND, 'serve.py'), '--async-mode', mode,
+                               '--host', '127.0.0.1', '--port', str(port), '--config', 'testing'],
+                              cwd=BACKEND, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise TimeoutError(f'{mode} server did not start')
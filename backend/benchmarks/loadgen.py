@@ -0,0 +1,222 @@
+"""
+Socket.IO load generator with end-to-end latency measurement.
+
+Seeds --users users in pairs that share a conversation, starts serve.py
+(or uses a running server with --url), opens --clients concurrent WebSocket
+clients on /chat, joins each to its pair's room, then sends messages at
+--rate messages per second (spread across the clients, open loop) for
+--duration seconds. Every message carries its send time; the partner
+records the delay until the broadcast reaches it.
+
+Prints one JSON document (also written to --output):
+    {"config": {...}, "connected": 200, "sent": 3000, "delivered": 3000,
+     "lost": 0, "messages_per_second": 99.8, "send_rate": 100.0,
+     "latency_ms": {"p50": 4.1, "p95": 9.7, "p99": 15.2, "max": 31.0, "mean": 4.9},
+     "server": {"cpu_seconds": 12.3, "cpu_percent": 41.0, "rss_mb": 92.4, "peak_rss_mb": 95.1}}
+
+Server CPU and RSS are read from /proc (Linux) for the server started here,
+or for --server-pid when using --url.
+
+Usage (from the backend folder):
+    python benchmarks/loadgen.py --users 200 --rate 100 --duration 30
+    python benchmarks/loadgen.py --async-mode gevent --python venv/bin/python --output gevent.json
+    python benchmarks/loadgen.py --server-env MESSAGE_GROUP_COMMIT=true
+    python benchmarks/loadgen.py --url http://127.0.0.1:5000 --server-pid 1234 --no-seed
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from chat_load import ChatClient, partner, setup_database, start_server
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def process_stats(pid):
+    """ Returns (cpu seconds, rss MB, peak rss MB) of pid, or None off Linux """
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # fields after the command name, which may contain spaces
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{pid}/status') as f:
+            status = dict(line.split(':', 1) for line in f if ':' in line)
+    except OSError:
+        return None
+    cpu = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    rss_mb = lambda key: int(status[key].split()[0]) / 1024 if key in status else None
+    return cpu, rss_mb('VmRSS'), rss_mb('VmHWM')
+
+
+def percentile(ordered, p):
+    """ Nearest-rank percentile of an ascending list """
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+
+def connect_clients(base_url, rooms, count, concurrency):
+    """ Returns (connected clients, seconds taken) """
+    clients = [ChatClient(base_url, f'bench{i}') for i in range(count)]
+
+    def connect(client):
+        try:
+            client.connect(rooms[int(client.username[len('bench'):])])
+            return client
+        except Exception as e:
+            print(f'{client.username}: {e}', file=sys.stderr)
+            return None
+
+    began = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        connected = [c for c in pool.map(connect, clients) if c is not None]
+    return connected, time.perf_counter() - began
+
+
+def send_load(clients, rate, duration, drain):
+    """
+        Sends rate messages per second for duration seconds, round-robin
+        over clients, then waits up to drain seconds for deliveries.
+
+    Returns dict with sent, delivered, send seconds, total seconds and the
+    sorted latencies in ms
+    """
+    latencies = []
+    lock = threading.Lock()
+
+    def make_handler(client):
+        def on_message(data):
+            # Only the partner's copy counts; the sender also gets an echo
+            if data['sender']['username'] != client.username:
+                sent_at = int(data['text'].rsplit(' ', 1)[1])
+                with lock:
+                    latencies.append((time.perf_counter_ns() - sent_at) / 1e6)
+        return on_message
+
+    for client in clients:
+        client.on_message = make_handler(client)
+
+    total = int(rate * duration)
+    began = time.perf_counter()
+    for k in range(total):
+        delay = began + k / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        client = clients[k % len(clients)]
+        client.emit('message', [{'recipient_user_name': partner(client.username),
+                                 'message': f'load {k} {time.perf_counter_ns()}'}])
+    send_seconds = time.perf_counter() - began
+
+    deadline = time.perf_counter() + drain
+    while time.perf_counter() < deadline:
+        with lock:
+            if len(latencies) >= total:
+                break
+        time.sleep(0.05)
+    with lock:
+        delivered = sorted(latencies)
+    return {'sent': total, 'delivered': len(delivered), 'send_seconds': send_seconds,
+            'seconds': time.perf_counter() - began, 'latencies': delivered}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=200, help='users to seed (even)')
+    parser.add_argument('--clients', type=int, help='concurrent clients, default --users')
+    parser.add_argument('--rate', type=float, default=100, help='messages per second, in total')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of sending')
+    parser.add_argument('--drain', type=float, default=10, help='seconds to wait for deliveries')
+    parser.add_argument('--concurrency', type=int, default=50, help='parallel connects')
+    parser.add_argument('--async-mode', default='threading', choices=('threading', 'gevent', 'eventlet'))
+    parser.add_argument('--python', default=sys.executable, help='interpreter running serve.py')
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--database-url', help='database for the server (reset!); default a temporary SQLite file')
+    parser.add_argument('--server-env', action='append', default=[], metavar='KEY=VALUE',
+                        help='extra environment for serve.py, e.g. MESSAGE_GROUP_COMMIT=true')
+    parser.add_argument('--url', help='use a running server instead of starting serve.py')
+    parser.add_argument('--server-pid', type=int, help='pid of the --url server, for CPU and RSS')
+    parser.add_argument('--no-seed', action='store_true', help='users already exist (with --url)')
+    parser.add_argument('--output', help='also write the JSON result to this file')
+    args = parser.parse_args()
+    clients = args.clients or args.users
+
+    db_path = None
+    database_url = args.database_url
+    if database_url is None:
+        db_fd, db_path = tempfile.mkstemp(suffix='.db')
+        os.close(db_fd)
+        database_url = f'sqlite:///{db_path}'
+
+    server = None
+    try:
+        if args.no_seed:
+            # Room ids of the pairs as setup_database numbers them
+            rooms = [str(i // 2 + 1) for i in range(args.users)]
+        else:
+            rooms = setup_database(database_url, args.users)
+        if args.url:
+            base_url, server_pid = args.url.rstrip('/'), args.server_pid
+        else:
+            env = dict(item.split('=', 1) for item in args.server_env)
+            server = start_server(args.python, args.async_mode, database_url, args.port, env)
+            base_url, server_pid = f'http://127.0.0.1:{args.port}', server.pid
+
+        connected, connect_seconds = connect_clients(base_url, rooms, clients, args.concurrency)
+        if not connected:
+            sys.exit('no client could connect')
+        before = process_stats(server_pid) if server_pid else None
+        load = send_load(connected, args.rate, args.duration, args.drain)
+        after = process_stats(server_pid) if server_pid else None
+        for client in connected:
+            client.close()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if db_path is not None:
+            os.unlink(db_path)
+
+    latencies = load['latencies']
+    result = {
+        'config': {
+            'users': args.users, 'clients': clients, 'rate': args.rate,
+            'duration': args.duration, 'async_mode': None if args.url else args.async_mode,
+            'database': database_url.split(':', 1)[0], 'server_env': args.server_env,
+            'url': args.url,
+        },
+        'connected': len(connected),
+        'connect_seconds': round(connect_seconds, 3),
+        'sent': load['sent'],
+        'delivered': load['delivered'],
+        'lost': load['sent'] - load['delivered'],
+        'send_rate': round(load['sent'] / load['send_seconds'], 1),
+        'messages_per_second': round(load['delivered'] / load['seconds'], 1),
+        'latency_ms': {
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': latencies[-1] if latencies else None,
+            'mean': sum(latencies) / len(latencies) if latencies else None,
+        },
+        'server': None,
+    }
+    result['latency_ms'] = {k: v if v is None else round(v, 2) for k, v in result['latency_ms'].items()}
+    if before and after:
+        cpu = after[0] - before[0]
+        result['server'] = {'cpu_seconds': round(cpu, 2),
+                            'cpu_percent': round(100 * cpu / load['seconds'], 1),
+                            'rss_mb': round(after[1], 1), 'peak_rss_mb': round(after[2], 1)}
+
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
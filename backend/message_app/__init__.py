@@ -6,10 +6,10 @@ from flask_cors import CORS
 from flask_login import LoginManager
 from flask_socketio import SocketIO
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import select
 
 from .config import config, DevelopmentConfig
 from .logger import setup_logging, get_logger
+from .replica import RoutingSession, replica_binds
 
 # Module-level logger (available before app context)
 logger = get_logger(__name__)
@@ -18,7 +18,8 @@ logger = get_logger(__name__)
 # server attribute is None b/c there is no app to serve
 # Note: cors_allowed_origins will be updated in create_app based on config
 socketio = SocketIO()
-db_ = SQLAlchemy()
+# The session sends reads of @replica_read views to a replica (see replica.py)
+db_ = SQLAlchemy(session_options={'class_': RoutingSession})
 
 def create_app(test_config=None, config_name=None):
     # create and configure the app
@@ -48,20 +49,50 @@ def create_app(test_config=None, config_name=None):
     setup_logging(app)
     app.logger.debug(f"Flask app created with config: {config_name or 'testing'}")
 
-    # Set database URL
-    app.config['SQLALCHEMY_DATABASE_URI'] = app_config.get_database_url(app.instance_path)
+    # Set database URL unless the test or instance config already chose one
+    if 'SQLALCHEMY_DATABASE_URI' not in app.config:
+        app.config['SQLALCHEMY_DATABASE_URI'] = app_config.get_database_url(app.instance_path)
+    # Pool settings (see pool.py) unless the config already chose engine options
+    if 'SQLALCHEMY_ENGINE_OPTIONS' not in app.config:
+        from .pool import engine_options
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+    # Each read replica is a bind of its own
+    if app.config.get('SQLALCHEMY_REPLICA_URLS'):
+        app.config['SQLALCHEMY_BINDS'] = {**(app.config.get('SQLALCHEMY_BINDS') or {}),
+                                          **replica_binds(app.config['SQLALCHEMY_REPLICA_URLS'])}
 
     db_.init_app(app)
     app.logger.debug("SQLAlchemy initialized")
 
-    # Initialize SocketIO with config values
+    # Initialize SocketIO with config values. A message queue (or an explicit
+    # client manager) lets rooms and broadcasts span worker processes.
+    # Options are passed every time because the module-level SocketIO keeps
+    # them between init_app calls.
+    # The chat module is imported first so its event handlers are queued on
+    # socketio and re-registered on the server every init_app creates.
+    from . import chat
+    message_queue = app.config.get('SOCKETIO_MESSAGE_QUEUE')
+    scale_out_options = {'message_queue': message_queue}
+    if message_queue and app.config.get('SOCKETIO_CLIENT_MANAGER') is None:
+        scale_out_options['channel'] = app.config.get('SOCKETIO_CHANNEL', 'message_app')
+    else:
+        scale_out_options['client_manager'] = app.config.get('SOCKETIO_CLIENT_MANAGER')
     socketio.init_app(
         app,
+        async_mode=app.config.get('SOCKETIO_ASYNC_MODE'),
+        ping_interval=app.config.get('SOCKETIO_PING_INTERVAL', 25),
+        ping_timeout=app.config.get('SOCKETIO_PING_TIMEOUT', 20),
         logger=app.config.get('SOCKETIO_LOGGER', False),
         engineio_logger=app.config.get('ENGINEIO_LOGGER', False),
-        cors_allowed_origins=app.config.get('CORS_ORIGINS', ['http://localhost:5173'])
+        cors_allowed_origins=app.config.get('CORS_ORIGINS', ['http://localhost:5173']),
+        transports=app.config.get('SOCKETIO_TRANSPORTS'),
+        **scale_out_options
     )
-    app.logger.debug("SocketIO initialized")
+    if message_queue or app.config.get('SOCKETIO_CLIENT_MANAGER') is not None:
+        app.logger.info("SocketIO using a message queue for multi-process rooms")
+        if 'polling' in socketio.server.eio.transports:
+            app.logger.info("Long-polling is enabled: the load balancer must use sticky sessions")
+    app.logger.debug(f"SocketIO initialized in {socketio.async_mode} mode")
 
     # Allow requests from React
     CORS(app, supports_credentials=True, origins=app.config.get('CORS_ORIGINS', ['http://localhost:5173']))
@@ -75,29 +106,63 @@ def create_app(test_config=None, config_name=None):
     # User loader function
     @login_manager.user_loader
     def load_user(user_id):
-        from .data_classes import User
-        from . import db_
-        return db_.session.scalar(select(User).where(User.id == int(user_id)))
+        from .db import get_user
+        return get_user(int(user_id))
 
     # print("App config" + str(app.config))
 
     from . import db
     db.init_app(app)
 
+    from . import sqlite_tuning
+    sqlite_tuning.init_app(app)
+
+    from . import pool
+    pool.init_app(app)
+
+    from . import replica
+    replica.init_app(app)
+
+    from . import instrumentation
+    instrumentation.init_app(app)
+
+    from . import metrics
+    metrics.init_app(app)
+
+    from . import slow_query
+    slow_query.init_app(app)
+
+    from . import identity_cache
+    identity_cache.init_app(app)
+
+    from . import contact_graph
+    contact_graph.init_app(app)
+
     from . import seed_demo
     seed_demo.init_app(app)
 
+    from . import group_commit
+    group_commit.init_app(app)
+
+    from . import read_state
+    read_state.init_app(app)
+
     from . import auth
     app.register_blueprint(auth.bp)
 
     from . import contacts
     app.register_blueprint(contacts.bp)
 
-    from . import chat
     app.register_blueprint(chat.bp)
     
     from . import usersearch
     app.register_blueprint(usersearch.bp)
+
+    from . import messagesearch
+    app.register_blueprint(messagesearch.bp)
+
+    from . import sync
+    app.register_blueprint(sync.bp)
     
     return app
 
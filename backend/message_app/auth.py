@@ -7,6 +7,7 @@ from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError
 from werkzeug.security import check_password_hash, generate_password_hash
 from . import db_
+from .db import get_user
 
 logger = logging.getLogger(__name__)
 
@@ -92,7 +93,7 @@ def load_logged_in_usr():
 	if user_id is None:
 		g.user = None
 	else:
-		g.user = db_.session.query(User).filter_by(id=user_id).first()
+		g.user = get_user(int(user_id))
 
 @bp.route('/logout', methods=['GET'])
 def logout():
@@ -1,13 +1,24 @@
 import logging
+import time
 
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, request, abort, current_app
 from flask_login import login_required, current_user
 from message_app import db_
-from message_app.data_classes import User, Contact, Message
+from message_app.data_classes import Conversation, Message
 from message_app import socketio
-from sqlalchemy import insert, select, func, or_
+from sqlalchemy import select, or_, and_
 from flask_socketio import join_room, emit, send
-from .decorators import contact_required
+from .db import (get_conversation, get_user_by_name, has_contact, insert_messages,
+                 mark_conversation_read, get_messages_after, count_messages_after,
+                 get_inbox_entry)
+from .contact_graph import get_graph
+from .instrumentation import track_event
+from .metrics import observe_message_insert
+from .group_commit import get_writer
+from .read_state import get_watermarks
+from .decorators import contact_required, get_room_contact
+from .replica import replica_read
+from .conditional import make_etag, not_modified, with_etag
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +26,7 @@ bp = Blueprint('chat', __name__)
 
 @bp.route('/chat/<room_id>', methods=['GET'])
 @login_required
+@replica_read
 @contact_required
 def chat(room_id, contact):
     """
@@ -25,14 +37,60 @@ def chat(room_id, contact):
         function. 
         
         Returns message history between client and contact.
+        
+        Optional query parameters page through the history (see 
+        get_chat_messages): ?limit=N, ?before=<message id>, ?after=<message id>
+
+        The response has an ETag made from the conversation's latest message
+        id; a request that sends it back in If-None-Match gets 304 Not
+        Modified without the history being read (see conditional.py).
     """
-    resp = get_chat_messages(contact)
+    before, after, limit = parse_page_args(request.args)
+    entry = get_inbox_entry(current_user, contact)
+    conversation_id = entry.conversation_id if entry else None
+    etag = make_etag('chat', current_user.id, current_user.user_name, contact.user_name,
+                     conversation_id, entry.last_message_id if entry else None,
+                     get_graph(current_app).is_mutual(current_user.id, contact.id),
+                     before, after, limit)
+    resp = not_modified(etag)
+    if resp is None:
+        resp = with_etag(get_chat_messages(contact, before=before, after=after, limit=limit,
+                                           conversation_id=conversation_id), etag)
     return resp
 
-def get_chat_messages(contact):
+def parse_page_args(args):
+    """
+        Parses the pagination query parameters of the chat history endpoint.
+        'before' and 'after' are message ids; at most one may be given.
+        'limit' defaults to CHAT_PAGE_SIZE and is capped at CHAT_MAX_PAGE_SIZE.
+        Aborts with 400 on malformed values.
+    
+    Returns tuple: (before, after, limit)
     """
-        Retrieves message history between current_user and provided contact. 
-        The messages are in order of creation time (earliest first)
+    try:
+        before = int(args['before']) if 'before' in args else None
+        after = int(args['after']) if 'after' in args else None
+        limit = int(args.get('limit', current_app.config['CHAT_PAGE_SIZE']))
+    except ValueError:
+        abort(400)
+    if (before is not None and after is not None) or limit < 1:
+        abort(400)
+    return before, after, min(limit, current_app.config['CHAT_MAX_PAGE_SIZE'])
+
+def get_chat_messages(contact, before=None, after=None, limit=None, conversation_id=None):
+    """
+        Retrieves one page of message history between current_user and 
+        provided contact. The messages are in order of creation time (earliest 
+        first).
+        
+        Pagination is keyset-based on (created_at, id), so the cost of a page
+        does not depend on how long the conversation is:
+            - no cursor: the most recent `limit` messages
+            - before=X: the `limit` messages immediately older than message X
+            - after=X: the `limit` messages immediately newer than message X
+        Cursors are message ids; the position of the cursor message is looked
+        up in the database so timestamps never have to round-trip through JSON.
+        A cursor that is not a message of this conversation aborts with 400.
         
         Notes on JSON fields:
         The 'is_own_message' subfield of 'messages' indicates if the message 
@@ -40,8 +98,19 @@ def get_chat_messages(contact):
         The 'is_mutual' field is true when both the client and contact have
         the added other as a contact. 
     
+        The 'prev_cursor' field is the value to pass as ?before= to load older
+        messages, or null when the start of the conversation has been reached.
+        The 'next_cursor' field is the value to pass as ?after= to load newer
+        messages, or null when the page ends with the latest message.
+        The 'room_id' field is the conversation's short room id, or null if
+        the two users have not exchanged any messages yet.
+    
     Parameters
         contact: Contact object
+        before: message id, optional
+        after: message id, optional
+        limit: maximum number of messages, defaults to CHAT_PAGE_SIZE
+        conversation_id: the conversation's id if the caller already knows it
     Returns JSON object:
         {
          'messages':
@@ -61,57 +130,49 @@ def get_chat_messages(contact):
                 },
                 ...
             ]
-         'is_mutual': bool
+         'is_mutual': bool,
+         'prev_cursor': Message.id or None,
+         'next_cursor': Message.id or None,
+         'room_id': Conversation.room_id or None
         }
     """
-    messages = db_.session.execute(
-        select(
-            Message,
-            User.user_name.label('sender_name'),
-            User.uuid.label('sender_uuid')
-            )
-            .join(User, Message.user_from == User.id)
-            .where(
-                or_(
-                    (Message.user_from == current_user.id) & (Message.user_to == contact.id),
-                    (Message.user_from == contact.id) & (Message.user_to == current_user.id)
-                    )
-                )
-                .order_by(Message.created_at)
-    ).all()
+    if limit is None:
+        limit = current_app.config['CHAT_PAGE_SIZE']
+
+    # A conversation only has two participants, so sender and recipient are
+    # resolved from this map rather than joined or queried per message
+    participants = {current_user.id: current_user, contact.id: contact}
+
+    if conversation_id is None:
+        conversation = get_conversation(current_user, contact)
+        conversation_id = conversation.id if conversation else None
+    if conversation_id is None:
+        messages, has_more = [], False
+    else:
+        messages, has_more = get_message_page(conversation_id, before=before,
+                                              after=after, limit=limit)
+    # A page found through the cursor proves it valid; only an empty page
+    # needs the extra lookup, e.g. before the latest page is marked read
+    cursor = after if after is not None else before
+    if cursor is not None and not messages and not is_conversation_message(cursor, conversation_id):
+        abort(400)
+
+    if after is not None:
+        prev_cursor = messages[0].id if messages else None
+        next_cursor = messages[-1].id if has_more else None
+    else:
+        prev_cursor = messages[0].id if has_more else None
+        next_cursor = messages[-1].id if before is not None and messages else None
     
-    formatted_messages = []
-    for message, sender_name, sender_uuid in messages:
-        recipient = db_.session.scalar(select(User).where(User.id == message.user_to))
-        
-        formatted_messages.append({
-            "id": message.id,
-            "text": message.text,
-            "sender": {
-                "uuid": sender_uuid,
-                "username": sender_name
-            },
-            "recipient": {
-                "uuid": recipient.uuid,
-                "username": recipient.user_name
-            },
-            "timestamp": message.created_at.isoformat()
-        })
+    formatted_messages = [message_json(message, participants[message.user_from],
+                                       participants[message.user_to])
+                          for message in messages]
 
     # Check whether each has added the other
-    is_mutual = db_.session.execute(
-        select(func.count())
-        .select_from(Contact)
-        .where(
-            or_(
-                (Contact.user == current_user.id) & (Contact.contact == contact.id),
-                (Contact.user == contact.id) & (Contact.contact == current_user.id)
-            )
-        )
-    ).scalar() == 2
+    is_mutual = get_graph(current_app).is_mutual(current_user.id, contact.id)
 
     # If no message history, make sure to still send user info
-    if not messages:
+    if not messages and before is None and after is None:
         formatted_messages.append({
             "id": None,
             "text": None,
@@ -126,14 +187,96 @@ def get_chat_messages(contact):
             "timestamp": None
         })
 
-    return jsonify({'messages': formatted_messages, 'is_mutual': is_mutual})
+    room_id = Conversation.room_id_for(conversation_id) if conversation_id else None
+
+    # Seeing the latest message clears the client's unread count. Done last
+    # because the commit expires every loaded row.
+    if conversation_id is not None and next_cursor is None and before is None:
+        mark_conversation_read(current_user, conversation_id)
+        db_.session.commit()
+
+    return jsonify({'messages': formatted_messages, 'is_mutual': is_mutual,
+                    'prev_cursor': prev_cursor, 'next_cursor': next_cursor,
+                    'room_id': room_id})
+
+def message_json(message, sender, recipient):
+    """ Returns the JSON form of a message used by the history endpoints """
+    return {
+        "id": message.id,
+        "text": message.text,
+        "sender": {
+            "uuid": sender.uuid,
+            "username": sender.user_name
+        },
+        "recipient": {
+            "uuid": recipient.uuid,
+            "username": recipient.user_name
+        },
+        "timestamp": message.created_at.isoformat()
+    }
+
+def live_message_json(message, sender, recipient):
+    """
+        Returns the payload of a 'message' event: message_json plus the
+        legacy uuid-pair room id and the conversation id.
+    """
+    data = message_json(message, sender, recipient)
+    data['room_id'] = min(sender.uuid + recipient.uuid, recipient.uuid + sender.uuid)
+    data['conversation_id'] = message.conversation_id
+    return data
+
+def is_conversation_message(message_id, conversation_id):
+    """ Returns whether message_id is a message of conversation_id """
+    return conversation_id is not None and db_.session.scalar(
+        select(Message.conversation_id).where(Message.id == message_id)) == conversation_id
+
+def get_message_page(conversation_id, before=None, after=None, limit=50):
+    """
+        Keyset query for one page of a conversation, served by the
+        (conversation_id, created_at, id) index. See get_chat_messages for the
+        meaning of before/after. A cursor from another conversation, or one
+        that does not exist, gives an empty page.
+    
+    Returns tuple: (list of Message oldest first, whether more rows exist
+                    beyond the page in the direction of travel)
+    """
+    query = select(Message).where(Message.conversation_id == conversation_id)
+    if after is not None:
+        pivot = select(Message.created_at).where(
+            (Message.id == after) & (Message.conversation_id == conversation_id)).scalar_subquery()
+        query = query.where(
+            or_(
+                Message.created_at > pivot,
+                and_(Message.created_at == pivot, Message.id > after)
+                )
+            ).order_by(Message.created_at, Message.id)
+    else:
+        if before is not None:
+            pivot = select(Message.created_at).where(
+                (Message.id == before) & (Message.conversation_id == conversation_id)).scalar_subquery()
+            query = query.where(
+                or_(
+                    Message.created_at < pivot,
+                    and_(Message.created_at == pivot, Message.id < before)
+                    )
+                )
+        query = query.order_by(Message.created_at.desc(), Message.id.desc())
+
+    # Fetch one extra row to learn whether another page exists
+    messages = db_.session.scalars(query.limit(limit + 1)).all()
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if after is None:
+        messages.reverse()
+    return messages, has_more
 
 #------------------------------------------------------------------------------
 # Socket.IO handlers are defined in this section.
 # These functions handle events ('connect', 'join', 'json') received from React.
 #------------------------------------------------------------------------------
 @socketio.on('connect', namespace='/chat')
-def handle_chat_connect():
+@track_event('connect')
+def handle_chat_connect(auth=None):
     """
         Allow real-time connections for logged-in users only.
     """
@@ -144,25 +287,120 @@ def handle_chat_connect():
     return True
 
 @socketio.on('join', namespace='/chat')
+@track_event('join')
 def on_join(data):
     """
         data is expected to be a JSON:
-            {'room': room_name}
-        where room_name is calculated in the agreed way. 
+            {'room': room_name, 'last_seen': message id (optional)}
+        where room_name is calculated in the agreed way, or is the short room
+        id of the conversation (Conversation.room_id).
         
-        Puts user into the room.
+        Puts user into the conversation's room if they have added the contact
+        on the other side; otherwise an 'error' event is emitted.
         The user is obtained from the request context. 
         A confirmation message is emitted after room is joined. 
+
+        A reconnecting client passes the id of the last message it has. The
+        messages after it are then sent (see replay_missed_messages) before
+        the confirmation:
+            {'room': room_name, 'high_water_mark': last message id sent,
+             'resync': bool}
     """
-    # TO DO:
-    # - should authenticate that user has permission to access the room
     room = data['room']
-    join_room(room)
-    logger.info(f"User '{current_user.user_name}' joined room {room}")
-    emit('room_joined', {'room': room})
+    last_seen = data.get('last_seen')
+    if last_seen is not None and (isinstance(last_seen, bool) or not isinstance(last_seen, int)
+                                  or last_seen < 0):
+        emit('error', {'message': 'last_seen must be a message id.'})
+        return
+    contact = get_room_contact(room)
+    if contact is None:
+        emit('error', {'message': 'Room not found.'})
+        return
+    # Same rule as the chat page (see contact_required)
+    if not has_contact(current_user, contact):
+        logger.warning(f"User '{current_user.user_name}' denied joining room {room}")
+        emit('error', {'message': 'Not allowed to join this room.'})
+        return
+
+    # Clients may join with either form of room id; both map onto the
+    # conversation's short room so broadcasts reach everyone
+    conversation = get_conversation(current_user, contact, create=True)
+    conversation_id, conversation_room = conversation.id, conversation.room_id
+    db_.session.commit()
+    if last_seen is None:
+        join_room(conversation_room)
+        logger.info(f"User '{current_user.user_name}' joined room {conversation_room}")
+        emit('room_joined', {'room': room})
+        return
+
+    high_water_mark, resync = replay_missed_messages(conversation_id, conversation_room, room,
+                                                      contact, last_seen)
+    logger.info(f"User '{current_user.user_name}' joined room {conversation_room} "
+                f"after message {last_seen}" + (' (resync)' if resync else ''))
+    emit('room_joined', {'room': room, 'high_water_mark': high_water_mark, 'resync': resync})
+
+def replay_missed_messages(conversation_id, conversation_room, room, contact, last_seen):
+    """
+        Joins conversation_room and emits the messages after last_seen
+        as 'missed_messages' events, {'room': room, 'messages': [...]}, in
+        chunks of at most SYNC_PAGE_SIZE. Each message has the payload of a
+        live 'message' event.
+
+        The backlog is paged out before the socket enters the room, so live
+        traffic cannot get ahead of it. After join_room the messages after
+        last_seen are read once more, skipping the ids already sent, so
+        nothing committed in between falls in the gap. Ids are not handed out
+        in commit order on PostgreSQL, so that read starts again from
+        last_seen rather than from the largest id sent: a message with a
+        smaller id may have committed after the backlog was read. A message
+        committed around the join may also arrive live: clients drop live
+        messages whose id came in a 'missed_messages' event.
+
+        More than SYNC_MAX_BEHIND missed messages are not replayed; the
+        client reloads the history over HTTP instead.
+
+    Returns tuple: (largest id sent, or last_seen; whether the client must
+                    resync)
+    """
+    chunk_size = current_app.config['SYNC_PAGE_SIZE']
+    max_behind = current_app.config['SYNC_MAX_BEHIND']
+    participants = {current_user.id: current_user, contact.id: contact}
+    conversation_ids = [conversation_id]
+    sent = set()
+
+    def send_chunk(messages):
+        emit('missed_messages', {'room': room, 'messages': [
+            live_message_json(message, participants[message.user_from], participants[message.user_to])
+            for message in messages]})
+        sent.update(message.id for message in messages)
+        return messages[-1].id
+
+    messages, has_more = get_messages_after(conversation_ids, last_seen, chunk_size)
+    if has_more and count_messages_after(conversation_ids, last_seen, max_behind) > max_behind:
+        join_room(conversation_room)
+        return last_seen, True
+
+    while messages:
+        after = send_chunk(messages)
+        if not has_more:
+            break
+        messages, has_more = get_messages_after(conversation_ids, after, chunk_size)
+    join_room(conversation_room)
+    # Messages committed while the backlog was sent. A new transaction, in
+    # case the isolation level keeps reads on the snapshot they started with
+    db_.session.rollback()
+    after = last_seen
+    while True:
+        messages, has_more = get_messages_after(conversation_ids, after, chunk_size, exclude=sent)
+        if messages:
+            after = send_chunk(messages)
+        if not has_more:
+            break
+    return max(sent, default=last_seen), False
 
 # Handler for send events
 @socketio.on('message', namespace='/chat')
+@track_event('message')
 def on_message(json):
     """
         Handler for receiving messages in JSON form.
@@ -186,9 +424,15 @@ def on_message(json):
                     'username': User.user_name
                 },
                 'timestamp': Message.created_at.isoformat(),
+                'room_id': legacy uuid-pair room id,
+                'conversation_id': Conversation.id
             }
             
+        The same JSON is returned as the acknowledgement of the event.
         An error message is emitted if the db write fails. 
+        
+        With MESSAGE_GROUP_COMMIT enabled the insert is batched with other
+        concurrent sends (see group_commit.py); the payload is the same.
     """
     # TO DO: Validate message content (non-empty, length limits)
     json = json[0]
@@ -196,37 +440,138 @@ def on_message(json):
     recipient_user_name = json['recipient_user_name']
     
     try:
-        recipient = db_.session.scalar(select(User).where(User.user_name==recipient_user_name))
-        msg = db_.session.scalar(insert(Message)
-                         .returning(Message)
-                         .values(user_from=current_user.id,
-                                 user_to=recipient.id,
-                                 text=msg)
-        )
-        db_.session.commit()
-        room_id = min(current_user.uuid+recipient.uuid, recipient.uuid+current_user.uuid)
-        data = {
-            'id': msg.id,
-            'text': msg.text,
-            'sender': {
-                    'uuid': current_user.uuid,
-                    'username': current_user.user_name
-                },
-            'recipient': {
-                'uuid': recipient.uuid,
-                'username': recipient.user_name
-            },
-            'timestamp': msg.created_at.isoformat(),
-            'room_id': room_id
-        }
-        send(data, broadcast=True, to=room_id)
+        recipient = get_user_by_name(recipient_user_name)
+        conversation = get_conversation(current_user, recipient, create=True)
+        # Read everything the payload needs before committing, since the
+        # commit expires the loaded rows
+        conversation_id, conversation_room = conversation.id, conversation.room_id
+        row = {'conversation_id': conversation_id,
+               'user_from': current_user.id,
+               'user_to': recipient.id,
+               'text': msg}
+
+        writer = get_writer(current_app)
+        started = time.perf_counter()
+        if writer is not None:
+            # Make a newly created conversation visible to the batch writer
+            db_.session.commit()
+            msg = writer.submit(row)
+        else:
+            msg = insert_messages([row])[0]
+            db_.session.commit()
+        observe_message_insert(time.perf_counter() - started)
+        data = live_message_json(msg, current_user, recipient)
+        send(data, broadcast=True, to=conversation_room)
+        # Acknowledges the send to the client's callback, if it passed one
+        return data
         
     except Exception as e:
         logger.error(f"Database error when saving message: {e}")
         db_.session.rollback()
         emit('error', {'message': 'Failed to send message. Please try again.'}, broadcast=False)
         
+@socketio.on('message_batch', namespace='/chat')
+@track_event('message_batch')
+def on_message_batch(json):
+    """
+        Handler for a burst of messages to one recipient, e.g. a client
+        flushing its offline outbox:
+            {
+             'recipient_user_name': ...,
+             'messages': [text, ...]
+            }
+
+        The valid messages are stored with one INSERT in one transaction and
+        broadcast to the room as a single 'message_batch' event: a list of
+        payloads as in on_message, in the order they were given.
+
+        The acknowledgement has one result per item, in the same order:
+            {'results': [{'ok': True, 'id': Message.id}
+                         or {'ok': False, 'error': reason}, ...]}
+        Items that are not non-empty strings fail on their own. Everything
+        fails when the batch has more than MESSAGE_BATCH_EVENT_MAX_SIZE items,
+        the recipient does not exist or the write fails; the last two also
+        emit an 'error' event, as on_message does. A payload of any other
+        shape only emits an 'error' event.
+    """
+    if (not isinstance(json, dict) or not isinstance(json.get('messages'), list)
+            or not isinstance(json.get('recipient_user_name'), str)):
+        emit('error', {'message': 'Expected {recipient_user_name: string, messages: list}.'})
+        return
+    texts = json['messages']
+    if len(texts) > current_app.config['MESSAGE_BATCH_EVENT_MAX_SIZE']:
+        error = f"at most {current_app.config['MESSAGE_BATCH_EVENT_MAX_SIZE']} messages per batch"
+        return {'results': [{'ok': False, 'error': error} for _ in texts]}
+    results = [{'ok': True} if isinstance(text, str) and text.strip()
+               else {'ok': False, 'error': 'message must be a non-empty string'}
+               for text in texts]
+    valid = [i for i, result in enumerate(results) if result['ok']]
+    if not valid:
+        return {'results': results}
+
+    recipient = get_user_by_name(json['recipient_user_name'])
+    if recipient is None:
+        emit('error', {'message': 'Recipient not found.'})
+        return {'results': [{'ok': False, 'error': 'recipient not found'} for _ in texts]}
+
+    try:
+        conversation = get_conversation(current_user, recipient, create=True)
+        conversation_id, conversation_room = conversation.id, conversation.room_id
+        rows = [{'conversation_id': conversation_id,
+                 'user_from': current_user.id,
+                 'user_to': recipient.id,
+                 'text': texts[i]} for i in valid]
+        started = time.perf_counter()
+        inserted = insert_messages(rows)
+        db_.session.commit()
+        observe_message_insert(time.perf_counter() - started)
+    except Exception as e:
+        logger.error(f"Database error when saving message batch: {e}")
+        db_.session.rollback()
+        emit('error', {'message': 'Failed to send messages. Please try again.'}, broadcast=False)
+        return {'results': [result if not result['ok'] else {'ok': False, 'error': 'database error'}
+                            for result in results]}
+
+    for i, message in zip(valid, inserted):
+        results[i]['id'] = message.id
+    emit('message_batch', [live_message_json(message, current_user, recipient) for message in inserted],
+         to=conversation_room)
+    return {'results': results}
+
+@socketio.on('read', namespace='/chat')
+@track_event('read')
+def on_read(data):
+    """
+        The client has read a conversation up to a message:
+            {'room': room_name, 'up_to': message id}
+        room_name is either form accepted by on_join.
+
+        Raises the user's read watermark, which takes the messages up to it
+        off their unread count. Reports are coalesced and written every
+        READ_WATERMARK_FLUSH_MS (see read_state.py), so a client may send one
+        per message scrolled past. The other participant gets a 'read' event
+        once the watermark is written.
+    """
+    up_to = data.get('up_to')
+    if isinstance(up_to, bool) or not isinstance(up_to, int) or up_to < 0:
+        emit('error', {'message': 'up_to must be a message id.'})
+        return
+    room = str(data.get('room', ''))
+    if room.isdigit():
+        # The watermark lives on the user's own inbox row, so a room they are
+        # not part of matches nothing when it is written; no lookup needed
+        conversation_id = int(room)
+    else:
+        contact = get_room_contact(room)
+        conversation = get_conversation(current_user, contact) if contact else None
+        if conversation is None:
+            emit('error', {'message': 'Room not found.'})
+            return
+        conversation_id = conversation.id
+    get_watermarks(current_app).advance(current_user, conversation_id, up_to)
+
 @socketio.on('disconnect', namespace='/chat')
+@track_event('disconnect')
 def handle_disconnect():
     """
         When a user navigates away, closes the tab, or loses internet connection,
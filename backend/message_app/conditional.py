@@ -0,0 +1,37 @@
+"""
+Conditional GET for the endpoints that open tabs poll.
+
+A view builds a strong ETag from a cheap version lookup before doing its real
+work: the conversation's latest message id for GET /chat/<room_id>, the
+user's contacts state (db.get_contacts_state) for GET /contacts. If the
+request's If-None-Match already holds that ETag, the view answers 304 Not
+Modified with no body and skips the history or contacts queries and the
+JSON. Responses carry Cache-Control: private, no-cache, so browsers keep
+them but revalidate on every poll.
+"""
+import hashlib
+
+from flask import make_response, request
+
+CACHE_CONTROL = 'private, no-cache'
+
+
+def make_etag(*parts):
+    """ Returns a strong ETag for parts, which must determine the response body byte for byte """
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def not_modified(etag):
+    """ Returns a 304 response if the request's If-None-Match matches etag, else None """
+    if etag not in request.if_none_match:
+        return None
+    response = make_response('', 304)
+    return with_etag(response, etag)
+
+
+def with_etag(response, etag):
+    """ Returns response (anything a view may return) with etag and the Cache-Control header """
+    response = make_response(response)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    return response
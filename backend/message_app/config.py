@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 
 class Config:
@@ -12,16 +13,129 @@ class Config:
     # Database
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # SQLite connection profile (see sqlite_tuning.py): 'performance' turns on
+    # WAL, synchronous=NORMAL, a busy timeout and larger caches; 'default'
+    # keeps SQLite's stock settings. The maintenance task checkpoints the WAL
+    # every SQLITE_MAINTENANCE_INTERVAL seconds (0 turns it off)
+    SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'performance')
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 65536))
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    SQLITE_MAINTENANCE_INTERVAL = float(os.environ.get('SQLITE_MAINTENANCE_INTERVAL', 300))
+
+    # Connection pool for server databases (see pool.py for sizing per async
+    # mode). Timeout and recycle are seconds; the statement timeout is
+    # milliseconds (0 turns it off). SQLite ignores these
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 30000))
+
+    # Read replicas (see replica.py): comma-separated database URLs. Chat
+    # history, contacts and user search read from them, except for a user who
+    # wrote something in the last READ_YOUR_WRITES_WINDOW seconds
+    SQLALCHEMY_REPLICA_URLS = os.environ['SQLALCHEMY_REPLICA_URLS'].split(',') \
+        if os.environ.get('SQLALCHEMY_REPLICA_URLS') else []
+    READ_YOUR_WRITES_WINDOW = float(os.environ.get('READ_YOUR_WRITES_WINDOW', 5))
+
     # CORS - comma-separated origins in env var
     CORS_ORIGINS = os.environ.get('CORS_ORIGINS', 'http://localhost:5173').split(',')
 
+    # Chat history pagination: default page size and hard cap for ?limit=
+    CHAT_PAGE_SIZE = int(os.environ.get('CHAT_PAGE_SIZE', 50))
+    CHAT_MAX_PAGE_SIZE = int(os.environ.get('CHAT_MAX_PAGE_SIZE', 200))
+
+    # /contacts inbox pagination: default page size and hard cap for ?limit=
+    INBOX_PAGE_SIZE = int(os.environ.get('INBOX_PAGE_SIZE', 50))
+    INBOX_MAX_PAGE_SIZE = int(os.environ.get('INBOX_MAX_PAGE_SIZE', 200))
+
+    # Delta sync (GET /sync): default page size, hard cap for ?limit=, and
+    # how many missed messages a client may catch up on before it is told to
+    # resync from the history endpoint instead
+    SYNC_PAGE_SIZE = int(os.environ.get('SYNC_PAGE_SIZE', 100))
+    SYNC_MAX_PAGE_SIZE = int(os.environ.get('SYNC_MAX_PAGE_SIZE', 500))
+    SYNC_MAX_BEHIND = int(os.environ.get('SYNC_MAX_BEHIND', 1000))
+
+    # User search: default page size and hard cap for ?limit=
+    USER_SEARCH_PAGE_SIZE = int(os.environ.get('USER_SEARCH_PAGE_SIZE', 20))
+    USER_SEARCH_MAX_PAGE_SIZE = int(os.environ.get('USER_SEARCH_MAX_PAGE_SIZE', 50))
+
+    # Message search: default page size and hard cap for ?limit=
+    MESSAGE_SEARCH_PAGE_SIZE = int(os.environ.get('MESSAGE_SEARCH_PAGE_SIZE', 20))
+    MESSAGE_SEARCH_MAX_PAGE_SIZE = int(os.environ.get('MESSAGE_SEARCH_MAX_PAGE_SIZE', 50))
+
+    # Group commit for chat messages: collect concurrent sends for up to
+    # MESSAGE_BATCH_WINDOW_MS and write them in one transaction
+    MESSAGE_GROUP_COMMIT = os.environ.get('MESSAGE_GROUP_COMMIT', 'false').lower() == 'true'
+    MESSAGE_BATCH_WINDOW_MS = float(os.environ.get('MESSAGE_BATCH_WINDOW_MS', 5))
+    MESSAGE_BATCH_MAX_SIZE = int(os.environ.get('MESSAGE_BATCH_MAX_SIZE', 100))
+
+    # Most messages a client may send in one 'message_batch' event
+    MESSAGE_BATCH_EVENT_MAX_SIZE = int(os.environ.get('MESSAGE_BATCH_EVENT_MAX_SIZE', 100))
+
+    # Read watermarks reported by clients are held for this long and then
+    # written together (see read_state.py); 0 writes each one straight away
+    READ_WATERMARK_FLUSH_MS = float(os.environ.get('READ_WATERMARK_FLUSH_MS', 1000))
+
+    # Identity cache (user id/username/uuid -> UserRecord): LRU size and
+    # seconds before a record is re-read, which bounds staleness across workers
+    IDENTITY_CACHE_SIZE = int(os.environ.get('IDENTITY_CACHE_SIZE', 10000))
+    IDENTITY_CACHE_TTL = float(os.environ.get('IDENTITY_CACHE_TTL', 300))
+
+    # Contact graph index used for authorization checks: number of users
+    # whose contact sets are kept, and seconds before a set is reloaded
+    CONTACT_GRAPH_SIZE = int(os.environ.get('CONTACT_GRAPH_SIZE', 10000))
+    CONTACT_GRAPH_TTL = float(os.environ.get('CONTACT_GRAPH_TTL', 300))
+
     # SocketIO logging
     SOCKETIO_LOGGER = False
     ENGINEIO_LOGGER = False
 
+    # SocketIO server. SOCKETIO_ASYNC_MODE is 'threading', 'gevent' or
+    # 'eventlet'; gevent and eventlet need the standard library monkey-patched
+    # before the app is imported, which serve.py does. Pings (seconds) detect
+    # dead clients: a client is dropped after interval + timeout of silence.
+    SOCKETIO_ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE', 'threading')
+    SOCKETIO_PING_INTERVAL = int(os.environ.get('SOCKETIO_PING_INTERVAL', 25))
+    SOCKETIO_PING_TIMEOUT = int(os.environ.get('SOCKETIO_PING_TIMEOUT', 20))
+
+    # SocketIO scale-out. With a message queue URL (redis://, rediss://,
+    # kafka://, zmq+tcp:// or any Kombu URL) broadcasts reach clients on every
+    # worker process. Long-polling clients need sticky sessions at the load
+    # balancer; setting SOCKETIO_TRANSPORTS=websocket removes that need.
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+    SOCKETIO_CHANNEL = os.environ.get('SOCKETIO_CHANNEL', 'message_app')
+    SOCKETIO_TRANSPORTS = os.environ['SOCKETIO_TRANSPORTS'].split(',') \
+        if os.environ.get('SOCKETIO_TRANSPORTS') else None
+    # A socketio.PubSubManager instance, used instead of SOCKETIO_MESSAGE_QUEUE
+    SOCKETIO_CLIENT_MANAGER = None
+
     # Logging
     LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
     LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    # Folder of app.log and slow_queries.log; defaults to logs/ next to the
+    # instance folder
+    LOG_DIR = os.environ.get('LOG_DIR')
+    # Level of the per-request/per-event query stats line (see instrumentation.py)
+    REQUEST_LOG_LEVEL = os.environ.get('REQUEST_LOG_LEVEL', 'INFO')
+
+    # Prometheus metrics at GET /metrics (see metrics.py), off by default.
+    # With METRICS_TOKEN set, scrapers must send it as a bearer token;
+    # without it, restrict access to the endpoint at the load balancer
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'false').lower() == 'true'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+    # Slow-query log (see slow_query.py). Statements slower than the threshold
+    # go to SLOW_QUERY_LOG_FILE (default slow_queries.log in LOG_DIR) with
+    # their plan; SLOW_QUERY_THRESHOLD_MS=off (None in a config mapping) turns
+    # the log off
+    SLOW_QUERY_THRESHOLD_MS = None if os.environ.get('SLOW_QUERY_THRESHOLD_MS', '').lower() == 'off' \
+        else float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 100))
+    SLOW_QUERY_EXPLAIN = os.environ.get('SLOW_QUERY_EXPLAIN', 'true').lower() == 'true'
+    SLOW_QUERY_PARAM_LENGTH = int(os.environ.get('SLOW_QUERY_PARAM_LENGTH', 40))
+    SLOW_QUERY_LOG_FILE = os.environ.get('SLOW_QUERY_LOG_FILE')
 
     @staticmethod
     def get_database_url(instance_path):
@@ -56,6 +170,8 @@ class TestingConfig(Config):
     SESSION_COOKIE_SECURE = False
     SOCKETIO_LOGGER = False
     ENGINEIO_LOGGER = False
+    # Keep test runs' logs out of the source tree
+    LOG_DIR = os.path.join(tempfile.gettempdir(), 'message_app_test_logs')
 
 
 config = {
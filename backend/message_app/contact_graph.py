@@ -0,0 +1,111 @@
+"""
+In-memory index of the contact graph, used for authorization checks.
+
+For each user it keeps two sets: the users they have added (outgoing) and
+the users who have added them (incoming). Both are loaded together, lazily,
+the first time the user is checked, so has_contact and is_mutual are set
+lookups. db.add_contact records new edges as it commits them.
+
+Contacts are never removed, so a cached "yes" stays true. A "no" from
+has_contact may only mean that another worker process added the contact
+since the sets were loaded, so it is confirmed by reloading that user's
+sets once. Entries are evicted least-recently-used beyond CONTACT_GRAPH_SIZE
+users and reloaded after CONTACT_GRAPH_TTL seconds.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import select, union_all, literal
+
+from . import db_
+from .data_classes import Contact
+
+
+class ContactGraph:
+    def __init__(self, max_size, ttl):
+        """
+        Parameters
+            max_size: number of users whose contact sets are kept
+            ttl: seconds a user's contact sets are trusted before reloading
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # user id -> (expiry time, outgoing set, incoming set)
+        self._entries = OrderedDict()
+
+    def has_contact(self, user_id, contact_id):
+        """ Returns True if user_id has added contact_id """
+        return self._check(user_id, lambda outgoing, incoming: contact_id in outgoing,
+                           confirm_negative=True)
+
+    def is_mutual(self, user_id, contact_id):
+        """
+            Returns True if user_id and contact_id have added each other. Only
+            informational, so a "no" is not confirmed and may be up to
+            CONTACT_GRAPH_TTL seconds stale.
+        """
+        return self._check(user_id, lambda outgoing, incoming:
+                           contact_id in outgoing and contact_id in incoming)
+
+    def add_contact(self, user_id, contact_id):
+        """ Records a committed Contact(user_id, contact_id) in loaded entries """
+        with self._lock:
+            if user_id in self._entries:
+                self._entries[user_id][1].add(contact_id)
+            if contact_id in self._entries:
+                self._entries[contact_id][2].add(user_id)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self):
+        """ Returns dict: {'hits': int, 'misses': int, 'size': int} """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+    def _check(self, user_id, test, confirm_negative=False):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(user_id)
+                result = test(entry[1], entry[2])
+                if result or not confirm_negative:
+                    self.hits += 1
+                    return result
+            self.misses += 1
+        outgoing, incoming = self._load(user_id)
+        return test(outgoing, incoming)
+
+    def _load(self, user_id):
+        """ Reads both contact sets of user_id in one query and caches them """
+        # Never cache what a lagging read replica returns (see replica.py)
+        query = union_all(
+            select(literal('out'), Contact.contact).where(Contact.user == user_id),
+            select(literal('in'), Contact.user).where(Contact.contact == user_id)
+        ).execution_options(read_from_primary=True)
+        outgoing, incoming = set(), set()
+        for direction, other in db_.session.execute(query):
+            (outgoing if direction == 'out' else incoming).add(other)
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._entries[user_id] = (time.monotonic() + self.ttl, outgoing, incoming)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return outgoing, incoming
+
+
+def get_graph(app):
+    """ Returns the app's ContactGraph """
+    return app.extensions.get('contact_graph')
+
+def init_app(app):
+    """ Creates the index from CONTACT_GRAPH_SIZE and CONTACT_GRAPH_TTL """
+    app.extensions['contact_graph'] = ContactGraph(
+        max_size=app.config['CONTACT_GRAPH_SIZE'],
+        ttl=app.config['CONTACT_GRAPH_TTL']
+    )
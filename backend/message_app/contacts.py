@@ -1,52 +1,90 @@
-from flask import Blueprint, jsonify, request
-from message_app.db import get_user_by_name, has_contact, add_contact
+from flask import Blueprint, jsonify, request, abort, current_app
+from message_app.db import get_user_by_name, has_contact, add_contact, get_contacts_state, inbox_query
 from message_app import db_
-from message_app.data_classes import User, Contact, Message
-from sqlalchemy import select, or_, and_
+from message_app.data_classes import User, Contact, Conversation, Message
+from sqlalchemy import select
 from flask_login import login_required, current_user
+from .replica import replica_read
+from .conditional import make_etag, not_modified, with_etag
 
 bp = Blueprint('contacts', __name__)
 
 @bp.route('/contacts', methods=['GET', 'POST'])
 @login_required
+@replica_read
 def contacts():
     # TO DO:
     # error handling
     # factor code blocks into functions and test
     if request.method == 'GET':
         user = current_user
-        
-        # Retrieve all contacts
-        # TO DO: make this a db.py function then import and call
-        # Furthermore, should just return the User object for each contact
-        contacts_data = []
-        query = select(Contact, User).join(User, Contact.contact == User.id).where(Contact.user == user.id)
-        results = db_.session.execute(query).all()
-        for contact_row, user_row in results:
-            contacts_data.append({
-                'contact_id': contact_row.contact,
+        try:
+            before = int(request.args['before']) if 'before' in request.args else None
+            limit = int(request.args.get('limit', current_app.config['INBOX_PAGE_SIZE']))
+        except ValueError:
+            abort(400)
+        if limit < 1:
+            abort(400)
+        limit = min(limit, current_app.config['INBOX_MAX_PAGE_SIZE'])
+
+        # Anything below changes only with the user's contacts state, so a
+        # client that already has this state gets 304 (see conditional.py)
+        etag = make_etag('contacts', user.id, get_contacts_state(user), before, limit)
+        not_modified_response = not_modified(etag)
+        if not_modified_response is not None:
+            return not_modified_response
+
+        # One page of the inbox, newest conversation first (see
+        # db.inbox_query). ?before=<room_id of the last entry> returns the
+        # next page, and only the inbox: the contact list and recent messages
+        # below come with the first page. At least three rows are read so the
+        # recent messages can be found from them, plus one to learn whether
+        # another page exists.
+        rows = db_.session.execute(inbox_query(user.id, before).limit(max(limit, 3) + 1)).all()
+        inbox = []
+        for summary_row, user_row in rows[:limit]:
+            inbox.append({
                 'contact_name': user_row.user_name,
-                'contact_uuid': user_row.uuid
+                'contact_uuid': user_row.uuid,
+                'room_id': Conversation.room_id_for(summary_row.conversation_id),
+                'last_message': {
+                    'id': summary_row.last_message_id,
+                    'text': summary_row.last_message_preview,
+                    'timestamp': summary_row.last_message_at.isoformat()
+                } if summary_row.last_message_id is not None else None,
+                'unread_count': summary_row.unread_count,
+                'last_read_message_id': summary_row.last_read_message_id
             })
+        data = {'inbox': inbox, 'inbox_has_more': len(rows) > limit}
+        if before is not None:
+            return with_etag(jsonify(data), etag)
 
-        # Retrieve three most recent messages
-        query = select(Contact, User, Message).join(
-            User, Contact.user == User.id
-        ).join(
-            Message, 
-            or_(
-                and_(Message.user_from == Contact.user, Message.user_to == Contact.contact),
-                and_(Message.user_from == Contact.contact, Message.user_to == Contact.user)
-            )
-        ).where(Contact.user == current_user.id).order_by(Message.created_at.desc()).limit(3)
-        results = db_.session.execute(query).all()
-        
-        # Add current_user to contacts_data to simplify for loop
-        contacts_data.append( {'contact_id': user.id, 'contact_name': user.user_name})
-        contact_lookup = {contact['contact_id']: contact['contact_name'] for contact in contacts_data}
+        # Retrieve all contacts on the (user, contact) index
+        # TO DO: make this a db.py function then import and call
+        query = select(Contact.contact, User.user_name, User.uuid).join(
+            User, Contact.contact == User.id
+        ).where(Contact.user == user.id).order_by(Contact.id)
+        contacts_data = [{'contact_id': contact_id, 'contact_name': name, 'contact_uuid': uuid}
+                         for contact_id, name, uuid in db_.session.execute(query)]
+
+        # Retrieve three most recent messages with the user's contacts (kept
+        # for existing clients; the inbox above supersedes it). They can only
+        # be in the three conversations whose latest message is newest, which
+        # are the first inbox rows, so only those are read instead of every
+        # message with every contact.
+        recent = rows[:3]
+        conversation_ids = [summary_row.conversation_id for summary_row, user_row in recent]
+        query = select(Message).where(
+            Message.conversation_id.in_(conversation_ids)
+        ).order_by(Message.created_at.desc()).limit(3)
+        results = db_.session.scalars(query).all() if conversation_ids else []
+
+        # The messages are between current_user and those three contacts
+        contact_lookup = {user_row.id: user_row.user_name for summary_row, user_row in recent}
+        contact_lookup[user.id] = user.user_name
 
         message_data = []
-        for contact_row, user_row, message_row in results:
+        for message_row in results:
             message_data.append(
                 {
                     'user_from_name': contact_lookup[message_row.user_from],
@@ -56,10 +94,8 @@ def contacts():
                 }
                 )
 
-        # remove current_user from contacts_data
-        contacts_data.pop()
-
-        return jsonify({'contacts_data': contacts_data, 'message_data': message_data}), 200
+        data.update({'contacts_data': contacts_data, 'message_data': message_data})
+        return with_etag(jsonify(data), etag)
     
     elif request.method == 'POST':
         data = {} # return container
@@ -14,15 +14,62 @@ class User(db_.Model, UserMixin):
     user_pwd = db_.Column(db_.String, nullable=False)
     created_at = db_.Column(db_.DateTime(timezone=True), default=func.now())
     modified_at = db_.Column(db_.DateTime(timezone=True), default=func.now())
+    # Bumped when the user adds a contact or the summaries are rebuilt; part
+    # of the GET /contacts ETag (see db.get_contacts_state)
+    contacts_version = db_.Column(db_.Integer, nullable=False, default=0)
     
     def to_dict(self):
         return {'id': self.id, 'uuid': self.uuid, 'user_name': self.user_name,
                 'user_pwd': self.user_pwd, 'created_at': self.created_at,
                 'modified_at': self.modified_at}
 
+# Case-insensitive prefix search is a range scan on this index
+db_.Index('ix_user_data_user_name_lower', func.lower(User.user_name))
+
+class Conversation(db_.Model):
+    """
+        One row per pair of users who have exchanged messages. The pair is
+        stored canonically (low_user < high_user) so both directions of the
+        chat share a single key.
+    """
+    __tablename__ = 'conversations'
+    __table_args__ = (db_.UniqueConstraint('low_user', 'high_user'),
+                      db_.Index('ix_conversations_high_user', 'high_user'))
+
+    id = db_.Column(db_.Integer, primary_key=True)
+    low_user = db_.Column(db_.ForeignKey('user_data.id', ondelete='CASCADE'), nullable=False)
+    high_user = db_.Column(db_.ForeignKey('user_data.id', ondelete='CASCADE'), nullable=False)
+    created_at = db_.Column(db_.DateTime(timezone=True), default=func.now())
+
+    @staticmethod
+    def key(user_id, contact_id):
+        """ Returns the canonical (low_user, high_user) pair for two user ids """
+        return min(user_id, contact_id), max(user_id, contact_id)
+
+    @property
+    def room_id(self):
+        """ Short Socket.IO room name / URL id for this conversation """
+        return Conversation.room_id_for(self.id)
+
+    @staticmethod
+    def room_id_for(conversation_id):
+        """ Returns the room_id of the conversation with conversation_id """
+        return str(conversation_id)
+
+    def other_user(self, user_id):
+        """ Returns the id of the participant that is not user_id """
+        return self.high_user if user_id == self.low_user else self.low_user
+
 class Message(db_.Model):
     __tablename__ = 'message_data'
+    # History reads are a single range scan on the first index, delta sync
+    # ("everything after message id X") on the second
+    __table_args__ = (db_.Index('ix_message_data_conversation_created',
+                                'conversation_id', 'created_at', 'id'),
+                      db_.Index('ix_message_data_conversation_id', 'conversation_id', 'id'))
+
     id = db_.Column(db_.Integer, primary_key=True)
+    conversation_id = db_.Column(db_.ForeignKey('conversations.id', ondelete='CASCADE'))
     user_from = db_.Column(db_.ForeignKey('user_data.id', ondelete='CASCADE'))
     user_to = db_.Column(db_.ForeignKey('user_data.id', ondelete='CASCADE'))
     text = db_.Column(db_.String, nullable=False)
@@ -34,4 +81,29 @@ class Contact(db_.Model):
     
     id = db_.Column(db_.Integer, primary_key=True)
     user = db_.Column(db_.ForeignKey('user_data.id', ondelete='CASCADE'))
-    contact = db_.Column(db_.ForeignKey('user_data.id', ondelete='CASCADE'))
\ No newline at end of file
+    contact = db_.Column(db_.ForeignKey('user_data.id', ondelete='CASCADE'))
+
+class ConversationSummary(db_.Model):
+    """
+        Materialized inbox entry: one row per side of each Conversation, kept
+        current by chat.on_message so /contacts never scans message_data.
+        last_read_message_id is user_id's read watermark: every message up to
+        it counts as read, and unread_count is the number received after it.
+    """
+    __tablename__ = 'conversation_summary'
+    __table_args__ = (db_.Index('ix_conversation_summary_conversation', 'conversation_id'),
+                      # The last two columns let db.get_contacts_state read only
+                      # the index; the send path rewrites this entry anyway
+                      db_.Index('ix_conversation_summary_inbox', 'user_id', 'last_message_at',
+                                'contact_id', 'last_message_id', 'last_read_message_id'))
+
+    PREVIEW_LENGTH = 100
+
+    user_id = db_.Column(db_.ForeignKey('user_data.id', ondelete='CASCADE'), primary_key=True)
+    contact_id = db_.Column(db_.ForeignKey('user_data.id', ondelete='CASCADE'), primary_key=True)
+    conversation_id = db_.Column(db_.ForeignKey('conversations.id', ondelete='CASCADE'), nullable=False)
+    last_message_id = db_.Column(db_.ForeignKey('message_data.id', ondelete='SET NULL'))
+    last_message_preview = db_.Column(db_.String)
+    last_message_at = db_.Column(db_.DateTime(timezone=True))
+    unread_count = db_.Column(db_.Integer, nullable=False, default=0)
+    last_read_message_id = db_.Column(db_.Integer, nullable=False, default=0)
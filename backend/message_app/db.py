@@ -1,9 +1,9 @@
 import logging
 
 from flask_sqlalchemy import SQLAlchemy
-from .data_classes import Contact, User
-from sqlalchemy import create_engine, select, exists
-from sqlalchemy.orm import sessionmaker
+from .data_classes import Contact, Conversation, ConversationSummary, Message, User
+from sqlalchemy import create_engine, select, insert, update, delete, case, func, literal_column, and_, or_
+from sqlalchemy.orm import sessionmaker, aliased
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 
 import click
@@ -11,9 +11,16 @@ from flask import g
 from flask import current_app
 
 from message_app import db_
+from .search import register_ddl
+from .identity_cache import get_cache
+from .contact_graph import get_graph
 
 logger = logging.getLogger(__name__)
 
+# Rows per INSERT statement in insert_messages on SQLite, which caps the
+# number of bound parameters in one statement
+SQLITE_ROWS_PER_INSERT = 500
+
 def get_db():
 	return db_
 
@@ -25,9 +32,10 @@ def get_db():
 # 		db.close()
 
 def init_db():
-	""" Create all tables"""
-	db_.drop_all()
-	db_.create_all()
+	""" Create all tables on the primary database (replicas get them by replication)"""
+	register_ddl()
+	db_.drop_all(bind_key=None)
+	db_.create_all(bind_key=None)
 
 
 from flask.cli import with_appcontext
@@ -39,39 +47,55 @@ def init_db_command():
 	init_db()
 	click.echo('Initialized the database.')
 
+@click.command('rebuild-summaries')
+@with_appcontext
+def rebuild_summaries_command():
+	"""Recompute every inbox summary from message_data."""
+	rebuild_conversation_summaries()
+	db_.session.commit()
+	click.echo('Rebuilt conversation summaries.')
+
 def init_app(app):
 	""" Register database commands with the Flask app."""
 	app.cli.add_command(init_db_command)
+	app.cli.add_command(rebuild_summaries_command)
 	
 def has_contact(user, contact):
-	""" Checks if user has added contact """
+	""" Checks if user has added contact (answered by the contact graph index) """
 	try:
-		return db_.session.scalar(
-				select(
-					exists().where(
-						(Contact.user == user.id) &
-						(Contact.contact == contact.id)
-					)
-				)
-		)
+		return get_graph(current_app).has_contact(user.id, contact.id)
 	except SQLAlchemyError as e:
 		logger.error(f"Database error in has_contact: {e}")
 		return False
 		
 
-def get_user_by_name(username):
-	""" Returns User object of username if exists, else None """
+def _lookup_user(column, value):
+	""" Reads a user through the identity cache; None if missing or on error """
 	try:
-		return db_.session.scalar(select(User).where(User.user_name == username))
+		return get_cache(current_app).get(column, value)
 	except SQLAlchemyError as e:
-		logger.error(f"Database error in get_user_by_name: {e}")
+		logger.error(f"Database error looking up user by {column}: {e}")
 		return None
 
+def get_user(user_id):
+	""" Returns UserRecord (see identity_cache.py) of user_id if exists, else None """
+	return _lookup_user('id', user_id)
+
+def get_user_by_name(username):
+	""" Returns UserRecord (see identity_cache.py) of username if exists, else None """
+	return _lookup_user('user_name', username)
+
+def get_user_by_uuid(uuid):
+	""" Returns UserRecord (see identity_cache.py) of uuid if exists, else None """
+	return _lookup_user('uuid', uuid)
+
 def add_contact(user, contact):
 	try:
 		new_contact = Contact(user=user.id, contact=contact.id)
 		db_.session.add(new_contact)
+		bump_contacts_versions([user.id])
 		db_.session.commit()
+		get_graph(current_app).add_contact(user.id, contact.id)
 		return {'success': True, 'message': 'Contact added successfully'}
 	except IntegrityError:
 		db_.session.rollback()
@@ -79,3 +103,275 @@ def add_contact(user, contact):
 	except SQLAlchemyError as e:
 		db_.session.rollback()
 		return {'success': False, 'message': f'Database error occurred: {e}'}
+
+
+def get_conversation(user, contact, create=False):
+	"""
+		Returns the Conversation between user and contact. If none exists it
+		is created when create=True (the caller commits), else None is returned.
+	"""
+	low_user, high_user = Conversation.key(user.id, contact.id)
+	query = select(Conversation).where(
+		(Conversation.low_user == low_user) & (Conversation.high_user == high_user)
+	)
+	conversation = db_.session.scalar(query)
+	if conversation is None and create:
+		try:
+			# Savepoint so losing a race with a concurrent writer only undoes this insert
+			with db_.session.begin_nested():
+				conversation = Conversation(low_user=low_user, high_user=high_user)
+				db_.session.add(conversation)
+				db_.session.flush()
+				# Each side gets an (empty) inbox entry
+				db_.session.add_all([
+					ConversationSummary(user_id=low_user, contact_id=high_user,
+										conversation_id=conversation.id),
+					ConversationSummary(user_id=high_user, contact_id=low_user,
+										conversation_id=conversation.id)
+				])
+		except IntegrityError:
+			conversation = db_.session.scalar(query)
+	return conversation
+
+def insert_messages(rows):
+	"""
+		Inserts messages in one statement and refreshes the inbox summaries;
+		the caller commits. rows are dicts with conversation_id, user_from,
+		user_to and text.
+	
+	Returns list of rows (id, conversation_id, user_from, user_to, text,
+	created_at) in the same order as the input. These are plain rows, not ORM
+	objects, so they stay readable after the commit and from other threads.
+	"""
+	columns = (Message.id, Message.conversation_id, Message.user_from, Message.user_to,
+			   Message.text, Message.created_at)
+	if db_.session.get_bind().dialect.name == 'sqlite':
+		# SQLAlchemy cannot match RETURNING rows to parameters on SQLite and
+		# would run one INSERT per row. A multi-row VALUES gets consecutive
+		# rowids in list order, so sorting by id restores the input order.
+		inserted = []
+		for start in range(0, len(rows), SQLITE_ROWS_PER_INSERT):
+			chunk = rows[start:start + SQLITE_ROWS_PER_INSERT]
+			inserted += sorted(db_.session.execute(
+				insert(Message).values(chunk).returning(*columns)
+			).all(), key=lambda row: row.id)
+	else:
+		inserted = db_.session.execute(
+			insert(Message).returning(*columns, sort_by_parameter_order=True),
+			rows
+		).all()
+	update_conversation_summaries(inserted)
+	return inserted
+
+def update_conversation_summary(message):
+	"""
+		Records message as the latest in its conversation for both sides and
+		bumps the recipient's unread count. One UPDATE touching two rows; the
+		caller commits.
+	"""
+	update_conversation_summaries([message])
+
+def update_conversation_summaries(messages):
+	"""
+		Applies a batch of new messages to the inbox summaries with one UPDATE
+		per conversation: the latest message wins and each side's unread count
+		grows by the number of messages it received.
+	"""
+	latest = {}
+	received = {}
+	for message in messages:
+		current = latest.get(message.conversation_id)
+		if current is None or (message.created_at, message.id) > (current.created_at, current.id):
+			latest[message.conversation_id] = message
+		key = (message.conversation_id, message.user_to)
+		received[key] = received.get(key, 0) + 1
+
+	for conversation_id, message in latest.items():
+		increments = [(ConversationSummary.user_id == user_id, ConversationSummary.unread_count + count)
+					  for (other_conversation_id, user_id), count in received.items()
+					  if other_conversation_id == conversation_id]
+		db_.session.execute(
+			update(ConversationSummary)
+			.where(ConversationSummary.conversation_id == conversation_id)
+			.values(
+				last_message_id=message.id,
+				last_message_preview=message.text[:ConversationSummary.PREVIEW_LENGTH],
+				last_message_at=message.created_at,
+				unread_count=case(*increments, else_=ConversationSummary.unread_count)
+			)
+		)
+
+def mark_conversation_read(user, conversation_id):
+	"""
+		Moves user's read watermark for conversation to its latest message and
+		clears the unread count; the caller commits
+	"""
+	latest = func.coalesce(ConversationSummary.last_message_id, 0)
+	db_.session.execute(
+		update(ConversationSummary)
+		.where(
+			(ConversationSummary.user_id == user.id) &
+			(ConversationSummary.conversation_id == conversation_id) &
+			((ConversationSummary.unread_count != 0) |
+			 (ConversationSummary.last_read_message_id < latest))
+		)
+		.values(unread_count=0, last_read_message_id=latest)
+	)
+
+def advance_read_watermark(user_id, conversation_id, message_id):
+	"""
+		Moves user_id's read watermark for conversation_id forward to
+		message_id (never past the conversation's latest message, never back)
+		and takes the messages it passes over off the unread count. Those are
+		counted on the (conversation_id, id) index between the old and the new
+		watermark, so the cost follows what was just read, not the length of
+		the conversation. The caller commits.
+
+	Returns whether the watermark moved
+	"""
+	latest = func.coalesce(ConversationSummary.last_message_id, 0)
+	watermark = case((latest < message_id, latest), else_=message_id)
+	# Both SET expressions see the row's old values
+	passed = select(func.count()).where(
+		(Message.conversation_id == ConversationSummary.conversation_id) &
+		(Message.user_to == ConversationSummary.user_id) &
+		(Message.id > ConversationSummary.last_read_message_id) &
+		(Message.id <= watermark)
+	).scalar_subquery()
+	result = db_.session.execute(
+		update(ConversationSummary)
+		.where(
+			(ConversationSummary.user_id == user_id) &
+			(ConversationSummary.conversation_id == conversation_id) &
+			(ConversationSummary.last_read_message_id < watermark)
+		)
+		.values(
+			unread_count=case((ConversationSummary.unread_count > passed,
+							   ConversationSummary.unread_count - passed), else_=0),
+			last_read_message_id=watermark
+		)
+	)
+	return result.rowcount > 0
+
+def bump_contacts_versions(user_ids):
+	""" Invalidates the /contacts ETag of user_ids (see get_contacts_state); the caller commits """
+	db_.session.execute(
+		update(User)
+		.where(User.id.in_(sorted(user_ids)))
+		.values(contacts_version=User.contacts_version + 1)
+		.execution_options(synchronize_session=False)
+	)
+
+def get_contacts_state(user):
+	"""
+		Returns a tuple that changes with everything GET /contacts shows user:
+		their contacts_version and totals over their inbox entries. A new
+		message changes its entry's last_message_id (and the recipient's
+		unread_count with it) and reading moves last_read_message_id, so the
+		send and read paths never have to write user_data. The totals are read
+		from ix_conversation_summary_inbox alone.
+	"""
+	contacts_version = select(User.contacts_version).where(User.id == user.id).scalar_subquery()
+	return tuple(db_.session.execute(
+		select(contacts_version, func.count(),
+			   func.coalesce(func.sum(ConversationSummary.last_message_id), 0),
+			   func.coalesce(func.sum(ConversationSummary.last_read_message_id), 0))
+		.where(ConversationSummary.user_id == user.id)
+	).one())
+
+def get_inbox_entry(user, contact):
+	""" Returns user's ConversationSummary for contact, or None if they have no conversation """
+	return db_.session.get(ConversationSummary, (user.id, contact.id))
+
+def inbox_query(user_id, before=None):
+	"""
+		Keyset query for user_id's inbox: their conversations with a contact
+		that have a message, newest first, walked in order on the
+		(user_id, last_message_at, contact_id) index so a page costs the same
+		however many contacts the user has. Contact is probed by its
+		(user, contact) key. before is the room_id of the last entry of the
+		previous page; the caller applies the limit.
+
+	Returns Select of (ConversationSummary, User) rows, User being the contact
+	"""
+	query = select(ConversationSummary, User).join(
+		User, ConversationSummary.contact_id == User.id
+	).join(
+		Contact,
+		and_(Contact.user == ConversationSummary.user_id,
+			 Contact.contact == ConversationSummary.contact_id)
+	).where(
+		(ConversationSummary.user_id == user_id) &
+		ConversationSummary.last_message_at.is_not(None)
+	)
+	if before is not None:
+		pivot = aliased(ConversationSummary)
+		is_pivot = (pivot.user_id == user_id) & (pivot.conversation_id == before)
+		pivot_at = select(pivot.last_message_at).where(is_pivot).scalar_subquery()
+		pivot_contact = select(pivot.contact_id).where(is_pivot).scalar_subquery()
+		query = query.where(
+			or_(
+				ConversationSummary.last_message_at < pivot_at,
+				and_(ConversationSummary.last_message_at == pivot_at,
+					 ConversationSummary.contact_id < pivot_contact)
+			)
+		)
+	return query.order_by(ConversationSummary.last_message_at.desc(),
+						  ConversationSummary.contact_id.desc())
+
+def get_messages_after(conversation_ids, after, limit, exclude=()):
+	"""
+		Range scans of the (conversation_id, id) index for the messages of
+		conversation_ids (a list or a subquery) with an id above after,
+		skipping the ids in exclude.
+
+	Returns tuple: (list of Message in id order, whether more rows exist)
+	"""
+	query = select(Message).where(
+		Message.conversation_id.in_(conversation_ids) & (Message.id > after)
+	).order_by(Message.id).limit(limit + 1)
+	if exclude:
+		query = query.where(Message.id.not_in(exclude))
+	messages = db_.session.scalars(query).all()
+	return messages[:limit], len(messages) > limit
+
+def count_messages_after(conversation_ids, after, cap):
+	""" Returns the number of messages get_messages_after would page through, counting at most cap + 1 """
+	pending = select(Message.id).where(
+		Message.conversation_id.in_(conversation_ids) & (Message.id > after)
+	).limit(cap + 1).subquery()
+	return db_.session.scalar(select(func.count()).select_from(pending))
+
+def rebuild_conversation_summaries():
+	"""
+		Recomputes conversation_summary from scratch with set-based statements.
+		Used after bulk loads that bypass chat.on_message; every conversation
+		is marked read up to its latest message and every contacts version
+		is bumped.
+	"""
+	latest = aliased(Message)
+	last_message_id = (
+		select(latest.id)
+		.where(latest.conversation_id == Conversation.id)
+		.order_by(latest.created_at.desc(), latest.id.desc())
+		.limit(1)
+		.correlate(Conversation)
+		.scalar_subquery()
+	)
+	db_.session.execute(delete(ConversationSummary))
+	for user_col, contact_col in ((Conversation.low_user, Conversation.high_user),
+								  (Conversation.high_user, Conversation.low_user)):
+		db_.session.execute(
+			insert(ConversationSummary).from_select(
+				['user_id', 'contact_id', 'conversation_id', 'last_message_id',
+				 'last_message_preview', 'last_message_at', 'unread_count',
+				 'last_read_message_id'],
+				select(
+					user_col, contact_col, Conversation.id, Message.id,
+					func.substr(Message.text, 1, ConversationSummary.PREVIEW_LENGTH),
+					Message.created_at, literal_column('0'), func.coalesce(Message.id, 0)
+				).select_from(Conversation)
+				.outerjoin(Message, Message.id == last_message_id)
+			)
+		)
+	db_.session.execute(update(User).values(contacts_version=User.contacts_version + 1))
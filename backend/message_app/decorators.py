@@ -1,10 +1,9 @@
 from functools import wraps
 from flask import abort
 from flask_login import current_user
-from .data_classes import User
+from .data_classes import Conversation
 from message_app import db_
-from .db import has_contact
-from sqlalchemy import select
+from .db import has_contact, get_user, get_user_by_uuid
 
 def parse_room_id(room_id):
     # print("room_id is:", room_id)
@@ -14,14 +13,27 @@ def parse_room_id(room_id):
     else:
         return current_user.uuid, room_id[:len(current_user.uuid)]
 
+def get_room_contact(room_id):
+    """
+        Returns the UserRecord on the other side of room_id from current_user, or
+        None if there is no such user. room_id is either a conversation's short
+        room id or the legacy concatenation of the two users' uuids.
+    """
+    if room_id.isdigit():
+        conversation = db_.session.get(Conversation, int(room_id))
+        if conversation is None or current_user.id not in (conversation.low_user, conversation.high_user):
+            return None
+        return get_user(conversation.other_user(current_user.id))
+
+    _, contact_uuid = parse_room_id(room_id)
+    return get_user_by_uuid(contact_uuid)
+
 def contact_required(f):
     @wraps(f)
     def decorated_function(room_id, *args, **kwargs):
 
-        _, contact_uuid = parse_room_id(room_id)
         # Check if contact exists
-        # TO DO: add get_contact_by_uuid to db.py then import and call
-        contact = db_.session.scalar(select(User).filter(User.uuid==contact_uuid))
+        contact = get_room_contact(room_id)
         if not contact:
             abort(404)
             
@@ -31,5 +43,5 @@ def contact_required(f):
         if not can_chat:
             abort(403) # or redirect to contact page
             
-        return f(contact_uuid, contact, *args, **kwargs)
-    return decorated_function
\ No newline at end of file
+        return f(contact.uuid, contact, *args, **kwargs)
+    return decorated_function
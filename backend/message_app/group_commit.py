@@ -0,0 +1,114 @@
+"""
+Group-commit write path for chat messages.
+
+With MESSAGE_GROUP_COMMIT enabled, chat.on_message hands each new message to
+a GroupCommitWriter instead of committing it on its own. The first handler to
+arrive becomes the leader: it waits up to MESSAGE_BATCH_WINDOW_MS (or until
+MESSAGE_BATCH_MAX_SIZE messages are queued), then writes up to
+MESSAGE_BATCH_MAX_SIZE queued messages in one INSERT and one transaction on
+behalf of the waiting handlers. The leader steps down as soon as its own
+message is committed, and a handler whose message is still queued takes
+over, so under steady traffic no handler keeps writing other handlers'
+batches while its own ack waits. Each handler blocks until its own message
+is written and gets back its real id and timestamp, so acks and broadcasts
+are unchanged.
+
+Messages are inserted in the order they were submitted, so a sender's
+messages keep their order.
+"""
+import logging
+import threading
+from concurrent.futures import Future
+
+from flask import current_app
+
+from . import db_
+from .db import insert_messages
+from .replica import note_writers
+
+logger = logging.getLogger(__name__)
+
+
+class GroupCommitWriter:
+    def __init__(self, window, max_size):
+        """
+        Parameters
+            window: seconds the leader waits for more messages to join a batch
+            max_size: largest number of messages written in one transaction
+        """
+        self.window = window
+        self.max_size = max_size
+        self._cond = threading.Condition()
+        self._pending = []
+        self._has_leader = False
+
+    def submit(self, row):
+        """
+            Queues one message (a dict accepted by db.insert_messages) and
+            blocks until it has been committed. Must be called inside an app
+            context, since the caller may end up writing the batch.
+
+        Returns the inserted row (see db.insert_messages); re-raises the
+        database error if the batch failed.
+        """
+        future = Future()
+        with self._cond:
+            self._pending.append((row, future))
+            if len(self._pending) >= self.max_size:
+                self._cond.notify_all()
+            # Wait for a leader to write this message, or lead once the
+            # previous leader has stepped down with it still queued
+            while self._has_leader and not future.done():
+                self._cond.wait()
+            lead = not future.done()
+            if lead:
+                self._has_leader = True
+        if lead:
+            self._lead(future)
+        return future.result()
+
+    def _lead(self, own):
+        """ Writes batches, oldest messages first, until future own is resolved """
+        try:
+            while not own.done():
+                with self._cond:
+                    self._cond.wait_for(lambda: len(self._pending) >= self.max_size,
+                                        timeout=self.window)
+                    batch = self._pending[:self.max_size]
+                    self._pending = self._pending[self.max_size:]
+                self._write(batch)
+                with self._cond:
+                    self._cond.notify_all()
+        finally:
+            with self._cond:
+                self._has_leader = False
+                self._cond.notify_all()
+
+    def _write(self, batch):
+        try:
+            rows = insert_messages([row for row, _ in batch])
+            db_.session.commit()
+        except Exception as e:
+            logger.error(f"Group commit of {len(batch)} messages failed: {e}")
+            db_.session.rollback()
+            for _, future in batch:
+                future.set_exception(e)
+        else:
+            logger.debug(f"Group commit wrote {len(batch)} messages")
+            # The commit ran in the leader's session, which notes only the leader
+            note_writers(current_app, {row['user_from'] for row, _ in batch})
+            for (_, future), row in zip(batch, rows):
+                future.set_result(row)
+
+
+def get_writer(app):
+    """ Returns the app's GroupCommitWriter, or None when group commit is off """
+    return app.extensions.get('group_commit')
+
+def init_app(app):
+    """ Creates the writer when MESSAGE_GROUP_COMMIT is enabled """
+    if app.config.get('MESSAGE_GROUP_COMMIT'):
+        app.extensions['group_commit'] = GroupCommitWriter(
+            window=app.config['MESSAGE_BATCH_WINDOW_MS'] / 1000,
+            max_size=app.config['MESSAGE_BATCH_MAX_SIZE']
+        )
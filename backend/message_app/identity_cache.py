@@ -0,0 +1,161 @@
+"""
+Process-local cache of user identities.
+
+Maps user id, username and uuid to a UserRecord, a small stand-in for User
+that carries only id, uuid and user_name (never the password hash). The
+Flask-Login user loader and db.get_user / get_user_by_name / get_user_by_uuid
+read through it, so steady-state requests and socket events do not touch
+user_data.
+
+Entries are evicted least-recently-used beyond IDENTITY_CACHE_SIZE and expire
+after IDENTITY_CACHE_TTL seconds; the TTL bounds how long another worker
+process can serve a record that changed. In this process, a User inserted
+(registration), updated (profile change) or deleted through the ORM is
+dropped from the cache when the transaction commits.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, has_app_context
+from flask_login import UserMixin
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, object_session
+
+from . import db_
+from .data_classes import User
+
+LOOKUP_COLUMNS = ('id', 'user_name', 'uuid')
+
+
+class UserRecord(UserMixin):
+    """ Read-only identity of a user; usable wherever current_user is """
+    def __init__(self, id, uuid, user_name):
+        self.id = id
+        self.uuid = uuid
+        self.user_name = user_name
+
+    def __repr__(self):
+        return f'<UserRecord {self.id} {self.user_name!r}>'
+
+
+class IdentityCache:
+    def __init__(self, max_size, ttl):
+        """
+        Parameters
+            max_size: number of users kept before the least recently used is evicted
+            ttl: seconds a record is served before it is read again
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # user id -> (expiry time, UserRecord), least recently used first
+        self._records = OrderedDict()
+        # ('user_name', value) or ('uuid', value) -> user id
+        self._ids = {}
+
+    def get(self, column, value):
+        """
+            Looks a user up by column ('id', 'user_name' or 'uuid'), reading
+            user_data on a miss. Unknown users are not cached.
+
+        Returns UserRecord, or None if there is no such user
+        """
+        if column not in LOOKUP_COLUMNS:
+            raise ValueError(f'cannot look users up by {column!r}')
+        with self._lock:
+            user_id = value if column == 'id' else self._ids.get((column, value))
+            entry = self._records.get(user_id)
+            if entry is not None and entry[0] > time.monotonic():
+                self._records.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # Never cache what a lagging read replica returns (see replica.py)
+        row = db_.session.execute(
+            select(User.id, User.uuid, User.user_name).where(getattr(User, column) == value)
+            .execution_options(read_from_primary=True)
+        ).first()
+        if row is None:
+            return None
+        record = UserRecord(*row)
+        self.put(record)
+        return record
+
+    def put(self, record):
+        with self._lock:
+            self._discard(record.id)
+            self._records[record.id] = (time.monotonic() + self.ttl, record)
+            self._ids[('user_name', record.user_name)] = record.id
+            self._ids[('uuid', record.uuid)] = record.id
+            while len(self._records) > self.max_size:
+                self._discard(next(iter(self._records)))
+
+    def invalidate(self, user_id=None, user_name=None, uuid=None):
+        """ Drops the records matching any of the given keys """
+        with self._lock:
+            for user_id in (user_id, self._ids.get(('user_name', user_name)),
+                            self._ids.get(('uuid', uuid))):
+                if user_id is not None:
+                    self._discard(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+            self._ids.clear()
+
+    def stats(self):
+        """ Returns dict: {'hits': int, 'misses': int, 'size': int} """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._records)}
+
+    def _discard(self, user_id):
+        """ Removes one record and the keys pointing at it; caller holds the lock """
+        entry = self._records.pop(user_id, None)
+        if entry is None:
+            return
+        record = entry[1]
+        for key in (('user_name', record.user_name), ('uuid', record.uuid)):
+            if self._ids.get(key) == user_id:
+                del self._ids[key]
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _mark_stale(mapper, connection, target):
+    """ Remembers changed users on the session until it commits """
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('stale_identities', []).append(
+            (target.id, target.user_name, target.uuid))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_stale(session):
+    stale = session.info.pop('stale_identities', None)
+    if stale and has_app_context():
+        cache = get_cache(current_app)
+        if cache is not None:
+            for user_id, user_name, uuid in stale:
+                cache.invalidate(user_id=user_id, user_name=user_name, uuid=uuid)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_stale(session):
+    session.info.pop('stale_identities', None)
+
+
+def get_cache(app):
+    """ Returns the app's IdentityCache """
+    return app.extensions.get('identity_cache')
+
+def init_app(app):
+    """ Creates the cache from IDENTITY_CACHE_SIZE and IDENTITY_CACHE_TTL """
+    app.extensions['identity_cache'] = IdentityCache(
+        max_size=app.config['IDENTITY_CACHE_SIZE'],
+        ttl=app.config['IDENTITY_CACHE_TTL']
+    )
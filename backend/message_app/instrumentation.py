@@ -0,0 +1,121 @@
+"""
+Per-request database instrumentation.
+
+SQLAlchemy engine events count the statements executed and the time spent
+in the database during each HTTP request and each Socket.IO event. HTTP
+responses report the totals in a Server-Timing header:
+
+    Server-Timing: db;dur=1.84;desc="4 queries", total;dur=6.10
+
+and every request and event is logged as one key=value line on the
+'message_app.instrumentation' logger, at REQUEST_LOG_LEVEL:
+
+    http method=GET path=/contacts endpoint=contacts.contacts status=200 queries=4 db_ms=1.84 total_ms=6.10
+    socketio event=/chat:message queries=3 db_ms=2.02 total_ms=4.75
+
+Statements run outside a request or event (CLI commands, seeding) are not
+counted.
+"""
+import logging
+import time
+from functools import wraps
+
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from . import db_
+from .metrics import observe_pool_timeout, observe_socket_event
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    """ Statements executed and seconds spent in the database so far """
+    __slots__ = ('queries', 'db_time', 'started')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.started = time.perf_counter()
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def current_stats():
+    """ Returns the QueryStats of the current request or event, or None """
+    return g.get('query_stats') if has_app_context() else None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    stats = current_stats()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+
+def _handle_error(exception_context):
+    started = exception_context.connection.info.get('query_started') \
+        if exception_context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def _start_request():
+    g.query_stats = QueryStats()
+
+def _finish_request(response):
+    stats = current_stats()
+    if stats is None:
+        return response
+    db_ms, total_ms = stats.db_time * 1000, stats.elapsed() * 1000
+    response.headers.add('Server-Timing',
+                         f'db;dur={db_ms:.2f};desc="{stats.queries} queries", total;dur={total_ms:.2f}')
+    logger.log(current_app.extensions['request_log_level'],
+               f"http method={request.method} path={request.path} endpoint={request.endpoint} "
+               f"status={response.status_code} queries={stats.queries} "
+               f"db_ms={db_ms:.2f} total_ms={total_ms:.2f}")
+    return response
+
+
+def track_event(name, namespace='/chat'):
+    """
+        Decorator for Socket.IO handlers, placed below @socketio.on. Counts
+        the handler's queries and logs them like an HTTP request, and counts
+        the event in the metrics.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            g.query_stats = stats = QueryStats()
+            observe_socket_event(name)
+            try:
+                return f(*args, **kwargs)
+            except PoolTimeoutError:
+                observe_pool_timeout()
+                raise
+            finally:
+                logger.log(current_app.extensions['request_log_level'],
+                           f"socketio event={namespace}:{name} queries={stats.queries} "
+                           f"db_ms={stats.db_time * 1000:.2f} total_ms={stats.elapsed() * 1000:.2f}")
+        return wrapper
+    return decorator
+
+
+def init_app(app):
+    """ Attaches the listeners to every engine (primary and replicas) and the request hooks """
+    with app.app_context():
+        engines = list(db_.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(engine, 'handle_error', _handle_error)
+
+    app.extensions['request_log_level'] = logging.getLevelName(
+        app.config.get('REQUEST_LOG_LEVEL', 'INFO').upper())
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
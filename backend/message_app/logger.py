@@ -4,6 +4,11 @@ import sys
 from logging.handlers import RotatingFileHandler
 
 
+def log_dir(app):
+    """Returns the folder for log files: LOG_DIR, else logs/ next to the instance folder."""
+    return app.config.get('LOG_DIR') or os.path.join(app.instance_path, '..', 'logs')
+
+
 def setup_logging(app):
     """Configure logging for the Flask application."""
     log_level = app.config.get('LOG_LEVEL', 'INFO')
@@ -11,7 +16,7 @@ def setup_logging(app):
     formatter = logging.Formatter(log_format)
 
     # Set up logs directory
-    logs_dir = os.path.join(app.instance_path, '..', 'logs')
+    logs_dir = log_dir(app)
     os.makedirs(logs_dir, exist_ok=True)
     log_file = os.path.join(logs_dir, 'app.log')
 
@@ -43,6 +48,37 @@ def setup_logging(app):
     app.logger.info(f"Log file: {log_file}")
 
 
+def setup_slow_query_logging(app):
+    """
+    Send the 'message_app.slow_query_log' logger to its own rotating file.
+
+    Each record is one JSON object per line (see slow_query.py). The records
+    do not propagate to the application log.
+
+    Returns the path of the log file.
+    """
+    log_file = app.config.get('SLOW_QUERY_LOG_FILE') or \
+        os.path.join(log_dir(app), 'slow_queries.log')
+    os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+
+    file_handler = RotatingFileHandler(
+        log_file,
+        maxBytes=app.config.get('SLOW_QUERY_LOG_MAX_BYTES', 1024 * 1024),
+        backupCount=app.config.get('SLOW_QUERY_LOG_BACKUPS', 10)
+    )
+    file_handler.setFormatter(logging.Formatter('%(message)s'))
+
+    slow_logger = logging.getLogger('message_app.slow_query_log')
+    # create_app may run more than once per process; keep a single handler
+    for handler in list(slow_logger.handlers):
+        slow_logger.removeHandler(handler)
+        handler.close()
+    slow_logger.addHandler(file_handler)
+    slow_logger.setLevel(logging.INFO)
+    slow_logger.propagate = False
+    return log_file
+
+
 def get_logger(name):
     """Get a logger with the specified name."""
     return logging.getLogger(name)
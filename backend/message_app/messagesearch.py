@@ -0,0 +1,76 @@
+from flask import Blueprint, request, jsonify, abort, current_app
+from flask_login import login_required, current_user
+from .db import get_conversation
+from .decorators import get_room_contact
+from .search import search_messages
+
+bp = Blueprint('messagesearch', __name__)
+
+@bp.route('/messages/search', methods=['GET'])
+@login_required
+def messagesearch():
+    """
+        Searches the text of the client's own messages (sent and received).
+        
+        Query parameters:
+            q: words to search for, all of which must appear
+            room_id: optional, restricts the search to one conversation
+            before: optional message id, returns results older than it
+            limit: page size, capped at MESSAGE_SEARCH_MAX_PAGE_SIZE
+    
+    Returns JSON object:
+        {
+         'results':
+            [
+                {
+                    'id': Message.id,
+                    'room_id': Conversation.room_id,
+                    'snippet': HTML-escaped text with matches wrapped in <mark></mark>,
+                    'sender': {'uuid': User.uuid, 'username': User.user_name},
+                    'recipient': {'uuid': User.uuid, 'username': User.user_name},
+                    'timestamp': Message.created_at.isoformat()
+                },
+                ...
+            ],
+         'next_cursor': Message.id to pass as ?before=, or None on the last page
+        }
+    """
+    search_term = request.args.get('q', '')
+    try:
+        before = int(request.args['before']) if 'before' in request.args else None
+        limit = int(request.args.get('limit', current_app.config['MESSAGE_SEARCH_PAGE_SIZE']))
+    except ValueError:
+        abort(400)
+    if limit < 1:
+        abort(400)
+    limit = min(limit, current_app.config['MESSAGE_SEARCH_MAX_PAGE_SIZE'])
+
+    conversation_id = None
+    if 'room_id' in request.args:
+        contact = get_room_contact(request.args['room_id'])
+        conversation = get_conversation(current_user, contact) if contact else None
+        if conversation is None:
+            abort(404)
+        conversation_id = conversation.id
+
+    results, has_more = search_messages(current_user, search_term, conversation_id=conversation_id,
+                                        before=before, limit=limit)
+    formatted_results = []
+    for message, snippet, sender, recipient in results:
+        formatted_results.append({
+            'id': message.id,
+            'room_id': str(message.conversation_id),
+            'snippet': snippet,
+            'sender': {
+                'uuid': sender.uuid,
+                'username': sender.user_name
+            },
+            'recipient': {
+                'uuid': recipient.uuid,
+                'username': recipient.user_name
+            },
+            'timestamp': message.created_at.isoformat()
+        })
+
+    next_cursor = formatted_results[-1]['id'] if has_more else None
+    return jsonify({'results': formatted_results, 'next_cursor': next_cursor}), 200
@@ -0,0 +1,318 @@
+"""
+In-process metrics, exposed at GET /metrics in the Prometheus text format.
+
+    http_requests_total{blueprint,route,method,status}       counter
+    http_request_duration_seconds{blueprint,route,method}    histogram
+    socketio_events_total{event}                             counter
+    socketio_connected_sockets, socketio_rooms               gauges
+    chat_message_insert_seconds                              histogram
+    db_pool_checkout_wait_seconds                            histogram
+    db_pool_connection_hold_seconds                          histogram
+    db_pool_checkout_timeouts_total                          counter
+    db_pool_checked_out_connections                          gauge
+    db_pool_size, db_pool_idle_connections,
+    db_pool_overflow_connections                             gauges
+    cache_hits_total{cache}, cache_misses_total{cache}       counters
+
+Routes are labelled with their URL rule (/chat/<room_id>), never the raw
+path, so the number of series stays bounded. Recording a sample is a dict
+lookup, a bisect and two additions under a lock; the gauges are computed
+only when /metrics is scraped.
+
+Every worker process keeps its own numbers; scrape each worker.
+
+Metrics are off unless METRICS_ENABLED is set. With METRICS_TOKEN set, a
+scrape must send "Authorization: Bearer <token>"; otherwise keep the
+endpoint private at the load balancer.
+"""
+import bisect
+import hmac
+import threading
+import time
+
+from flask import Blueprint, Response, abort, current_app, g, got_request_exception, request
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from . import db_, socketio
+from .pool import pool_stats
+
+bp = Blueprint('metrics', __name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        """
+        Parameters
+            name: metric name
+            documentation: HELP text
+            labelnames: label names; samples pass values for all of them
+            callback: optional function returning {label values tuple: value},
+                      called at scrape time instead of recording samples
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labelnames)
+
+    def samples(self):
+        """ Yields (suffix, label values, extra labels, value) """
+        values = self.callback() if self.callback else dict(self._values)
+        for key, value in sorted(values.items(), key=lambda item: str(item[0])):
+            yield '', key, (), value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for suffix, key, extra, value in self.samples():
+            labels = _format_labels(list(zip(self.labelnames, key)) + list(extra))
+            lines.append(f'{self.name}{suffix}{labels} {_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # per-bucket counts (last one is +Inf), sum, count
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total, count)
+                      for key, (counts, total, count) in self._values.items()}
+        for key, (counts, total, count) in sorted(values.items(), key=lambda item: str(item[0])):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                yield '_bucket', key, (('le', _format_value(float(bound))),), cumulative
+            yield '_sum', key, (), total
+            yield '_count', key, (), count
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """ Returns the exposition text for every registered metric """
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+
+class AppMetrics:
+    """ The metrics of one app, kept in app.extensions['metrics'] """
+    def __init__(self, app):
+        self.registry = registry = Registry()
+        self.http_requests = registry.register(Counter(
+            'http_requests_total', 'HTTP requests handled.',
+            ('blueprint', 'route', 'method', 'status')))
+        self.http_latency = registry.register(Histogram(
+            'http_request_duration_seconds', 'HTTP request latency.',
+            ('blueprint', 'route', 'method')))
+        self.socket_events = registry.register(Counter(
+            'socketio_events_total', 'Socket.IO events handled on /chat.', ('event',)))
+        registry.register(Gauge(
+            'socketio_connected_sockets', 'Sockets connected to /chat in this worker.',
+            callback=lambda: {(): _socket_counts()[0]}))
+        registry.register(Gauge(
+            'socketio_rooms', 'Conversation rooms with members in this worker.',
+            callback=lambda: {(): _socket_counts()[1]}))
+        self.message_insert = registry.register(Histogram(
+            'chat_message_insert_seconds', 'Time to store and commit a chat message.'))
+        self.pool_wait = registry.register(Histogram(
+            'db_pool_checkout_wait_seconds',
+            'Time to get a connection from the pool, waiting for a free one included.'))
+        self.pool_hold = registry.register(Histogram(
+            'db_pool_connection_hold_seconds', 'Time a connection stays checked out of the pool.'))
+        self.pool_timeouts = registry.register(Counter(
+            'db_pool_checkout_timeouts_total', 'Checkouts that gave up after DB_POOL_TIMEOUT.'))
+        for name, stat, documentation in (
+                ('db_pool_checked_out_connections', 'checked_out',
+                 'Connections currently checked out of the pool.'),
+                ('db_pool_size', 'size', 'Connections the pool keeps open.'),
+                ('db_pool_idle_connections', 'checked_in', 'Open connections waiting in the pool.'),
+                ('db_pool_overflow_connections', 'overflow',
+                 'Connections open beyond the pool size (negative until the pool is full).')):
+            registry.register(Gauge(name, documentation,
+                                    callback=lambda stat=stat: _pool_stat(app, stat)))
+        registry.register(Counter(
+            'cache_hits_total', 'In-process cache hits.', ('cache',),
+            callback=lambda: _cache_stats(app, 'hits')))
+        registry.register(Counter(
+            'cache_misses_total', 'In-process cache misses.', ('cache',),
+            callback=lambda: _cache_stats(app, 'misses')))
+
+
+def _socket_counts():
+    """ Returns (connected sockets, rooms) in the /chat namespace """
+    if socketio.server is None:
+        return 0, 0
+    rooms = dict(socketio.server.manager.rooms.get('/chat', {}))
+    sockets = rooms.pop(None, {})
+    # Every socket also sits in a room named after its sid
+    return len(sockets), len([room for room in rooms if room not in sockets])
+
+def _pool_stat(app, stat):
+    """ Returns {(): value} of one pool_stats field, or {} if the pool lacks it """
+    with app.app_context():
+        stats = pool_stats(db_.engine)
+    return {(): stats[stat]} if stat in stats else {}
+
+def _cache_stats(app, field):
+    stats = {}
+    for name in ('identity_cache', 'contact_graph'):
+        cache = app.extensions.get(name)
+        if cache is not None:
+            stats[(name,)] = cache.stats()[field]
+    return stats
+
+
+def get_metrics(app):
+    """ Returns the app's AppMetrics, or None when metrics are off """
+    return app.extensions.get('metrics')
+
+def observe_socket_event(name):
+    metrics = get_metrics(current_app)
+    if metrics is not None:
+        metrics.socket_events.inc(event=name)
+
+def observe_message_insert(seconds):
+    metrics = get_metrics(current_app)
+    if metrics is not None:
+        metrics.message_insert.observe(seconds)
+
+def observe_pool_timeout():
+    metrics = get_metrics(current_app)
+    if metrics is not None:
+        metrics.pool_timeouts.inc()
+
+
+def _start_timer():
+    g.metrics_started = time.perf_counter()
+
+def _record_request(response):
+    started = g.pop('metrics_started', None)
+    if started is None or request.endpoint == 'metrics.metrics':
+        return response
+    metrics = get_metrics(current_app)
+    rule = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    blueprint = request.blueprint or ''
+    metrics.http_latency.observe(time.perf_counter() - started,
+                                 blueprint=blueprint, route=rule, method=request.method)
+    metrics.http_requests.inc(blueprint=blueprint, route=rule, method=request.method,
+                              status=response.status_code)
+    return response
+
+
+def _count_pool_timeout(sender, exception, **extra):
+    """ got_request_exception receiver: counts requests that found the pool exhausted """
+    if isinstance(exception, PoolTimeoutError):
+        observe_pool_timeout()
+
+
+def _listen_to_pool(engine, app_metrics):
+    """
+        Records the checkout waits noted by pool.TimedQueuePool (engines with
+        another pool class report none) and times how long each connection
+        stays checked out of engine's pool
+    """
+    def engine_connect(connection):
+        wait = connection.info.pop('pool_wait', None)
+        if wait is not None:
+            app_metrics.pool_wait.observe(wait)
+
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info['metrics_checked_out'] = time.perf_counter()
+
+    def checkin(dbapi_connection, connection_record):
+        started = connection_record.info.pop('metrics_checked_out', None)
+        if started is not None:
+            app_metrics.pool_hold.observe(time.perf_counter() - started)
+
+    # Listeners on the engine carry over to the new pool after dispose()
+    event.listen(engine, 'engine_connect', engine_connect)
+    event.listen(engine, 'checkout', checkout)
+    event.listen(engine, 'checkin', checkin)
+
+
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    """ Prometheus scrape endpoint """
+    token = current_app.config.get('METRICS_TOKEN')
+    if token:
+        sent = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(sent.encode(), f'Bearer {token}'.encode()):
+            abort(401)
+    return Response(get_metrics(current_app).registry.render(),
+                    mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """ Creates the metrics and hooks when METRICS_ENABLED is set """
+    if not app.config.get('METRICS_ENABLED'):
+        return
+    app_metrics = app.extensions['metrics'] = AppMetrics(app)
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
+    app.register_blueprint(bp)
+    got_request_exception.connect(_count_pool_timeout, app)
+
+    with app.app_context():
+        engines = list(db_.engines.values())
+    for engine in engines:
+        _listen_to_pool(engine, app_metrics)
@@ -0,0 +1,120 @@
+"""
+Connection pool settings for server databases (PostgreSQL).
+
+Each worker process keeps its own pool of DB_POOL_SIZE connections. Up to
+DB_MAX_OVERFLOW more are opened under load and closed again when they are
+returned. A request or Socket.IO event that finds every connection in use
+waits up to DB_POOL_TIMEOUT seconds, then fails with a TimeoutError instead
+of queueing forever. Connections are replaced after DB_POOL_RECYCLE seconds
+and, with DB_POOL_PRE_PING, tested before use. Together these stop stale
+connections, e.g. ones dropped by a proxy or failover while idle, from
+reaching a request. DB_STATEMENT_TIMEOUT_MS makes the server cancel runaway
+statements.
+
+Sizing. A connection is held from a handler's first query until its app
+context ends, so the pool bounds how many handlers can use the database at
+once:
+    threading           one OS thread per connected socket. Only the
+                        handlers running at any moment need a connection,
+                        so DB_POOL_SIZE around the expected number of
+                        concurrent requests and events is enough.
+    gevent / eventlet   thousands of sockets, and any of them may run a
+                        handler. The pool is the concurrency limit for the
+                        database, so size it to what the database can run
+                        in parallel (about 2-4 x its CPU cores, split across
+                        workers), keep DB_MAX_OVERFLOW small and
+                        DB_POOL_TIMEOUT short. psycopg2 must be made
+                        cooperative with psycogreen (serve.py does this when
+                        it is installed), or every query blocks the whole
+                        worker.
+In every mode, workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW) must stay below
+the server's max_connections, with room left for migrations and admin.
+
+SQLite ignores these settings; see sqlite_tuning.py.
+
+Server databases and SQLite files get a TimedQueuePool, which notes how
+long every checkout took, waiting for a free connection included, so
+metrics.py can report pool starvation. An in-memory SQLite database keeps
+SQLAlchemy's own pool.
+"""
+import logging
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+from . import db_
+
+logger = logging.getLogger(__name__)
+
+
+class TimedQueuePool(QueuePool):
+    """ QueuePool that stores the seconds each connect() took in the connection's info['pool_wait'] """
+
+    def connect(self):
+        started = time.perf_counter()
+        connection = super().connect()
+        connection.info['pool_wait'] = time.perf_counter() - started
+        return connection
+
+
+def engine_options(config):
+    """
+        Returns SQLALCHEMY_ENGINE_OPTIONS for config's database: a
+        TimedQueuePool with the pool settings, only the pool class for an
+        SQLite file, or {} for an in-memory SQLite database
+    """
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:') or url.query.get('mode') == 'memory':
+            return {}
+        # The pool SQLAlchemy picks for SQLite files anyway, with default sizes
+        return {'poolclass': TimedQueuePool}
+    return {
+        'poolclass': TimedQueuePool,
+        'pool_size': config.get('DB_POOL_SIZE', 10),
+        'max_overflow': config.get('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': config.get('DB_POOL_TIMEOUT', 10),
+        'pool_recycle': config.get('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': config.get('DB_POOL_PRE_PING', True),
+    }
+
+
+def pool_stats(engine):
+    """
+        Returns dict: size (configured connections), checked_out, checked_in
+        (idle) and overflow (connections beyond size; negative while the pool
+        has not opened all of size yet). Pools without these counters report
+        only checked_out, or nothing.
+    """
+    pool = engine.pool
+    stats = {}
+    for name, method in (('size', 'size'), ('checked_out', 'checkedout'),
+                         ('checked_in', 'checkedin'), ('overflow', 'overflow')):
+        if hasattr(pool, method):
+            stats[name] = getattr(pool, method)()
+    return stats
+
+
+def _set_statement_timeout(timeout):
+    def set_statement_timeout(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f'SET statement_timeout = {int(timeout)}')
+        cursor.close()
+        # Outside autocommit the SET opened a transaction; a rollback would undo it
+        dbapi_connection.commit()
+    return set_statement_timeout
+
+
+def init_app(app):
+    """ Sets the statement timeout on every new connection of the app's PostgreSQL engines """
+    timeout = app.config.get('DB_STATEMENT_TIMEOUT_MS')
+    if not timeout:
+        return
+    with app.app_context():
+        engines = [engine for engine in db_.engines.values() if engine.dialect.name == 'postgresql']
+    for engine in engines:
+        event.listen(engine, 'connect', _set_statement_timeout(timeout))
+    if engines:
+        logger.info(f"PostgreSQL statement timeout {int(timeout)} ms")
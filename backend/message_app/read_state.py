@@ -0,0 +1,100 @@
+"""
+Coalesced read watermarks.
+
+A client reports how far it has read with the 'read' Socket.IO event (see
+chat.on_read), typically many times a second while the user scrolls. Each
+report only raises an in-memory watermark for (user, conversation). Every
+READ_WATERMARK_FLUSH_MS the highest pending watermarks are written in one
+transaction, one UPDATE per conversation that moved (see
+db.advance_read_watermark), and each move is broadcast to the conversation's
+room as a read receipt:
+    'read' {'room': Conversation.room_id, 'user': User.uuid, 'up_to': Message.id}
+
+Pending watermarks live in this worker process, so a crash loses at most one
+interval of read state; the client reports it again on its next scroll.
+With READ_WATERMARK_FLUSH_MS = 0 every report is written straight away.
+"""
+import logging
+import threading
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import db_, socketio
+from .data_classes import Conversation
+from .db import advance_read_watermark
+
+logger = logging.getLogger(__name__)
+
+
+class ReadWatermarks:
+    def __init__(self, app, interval):
+        """
+        Parameters
+            app: the Flask app, for the app context the flush runs in
+            interval: seconds pending watermarks are held before they are written
+        """
+        self.app = app
+        self.interval = interval
+        self._lock = threading.Lock()
+        # (user id, conversation id) -> (highest message id reported, user uuid)
+        self._pending = {}
+        self._scheduled = False
+
+    def advance(self, user, conversation_id, message_id):
+        """ Records that user has read conversation_id up to message_id """
+        key = (user.id, conversation_id)
+        with self._lock:
+            current = self._pending.get(key)
+            if current is None or message_id > current[0]:
+                self._pending[key] = (message_id, user.uuid)
+            schedule = not self._scheduled
+            self._scheduled = True
+        if not self.interval:
+            self.flush()
+        elif schedule:
+            socketio.start_background_task(self._flush_later)
+
+    def pending(self):
+        """ Returns the number of watermarks waiting to be written """
+        with self._lock:
+            return len(self._pending)
+
+    def _flush_later(self):
+        socketio.sleep(self.interval)
+        with self.app.app_context():
+            self.flush()
+
+    def flush(self):
+        """
+            Writes the pending watermarks in one transaction and broadcasts
+            the ones that moved. Needs an app context.
+
+        Returns the number of watermarks that moved
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._scheduled = False
+        if not pending:
+            return 0
+        try:
+            moved = [(key, value) for key, value in pending.items()
+                     if advance_read_watermark(key[0], key[1], value[0])]
+            db_.session.commit()
+        except SQLAlchemyError as e:
+            db_.session.rollback()
+            logger.error(f"Failed to write {len(pending)} read watermarks: {e}")
+            return 0
+        for (user_id, conversation_id), (message_id, user_uuid) in moved:
+            room = Conversation.room_id_for(conversation_id)
+            socketio.emit('read', {'room': room, 'user': user_uuid, 'up_to': message_id},
+                          namespace='/chat', to=room)
+        return len(moved)
+
+
+def get_watermarks(app):
+    """ Returns the app's ReadWatermarks """
+    return app.extensions['read_watermarks']
+
+def init_app(app):
+    app.extensions['read_watermarks'] = ReadWatermarks(
+        app, interval=app.config.get('READ_WATERMARK_FLUSH_MS', 1000) / 1000)
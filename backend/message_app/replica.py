@@ -0,0 +1,159 @@
+"""
+Read-replica routing.
+
+With SQLALCHEMY_REPLICA_URLS set, every replica becomes a Flask-SQLAlchemy
+bind ('replica0', 'replica1', ...). Views decorated with @replica_read send
+their SELECTs to a replica picked at random. Everything else goes to the
+primary: writes, reads in other views and socket events, and reads after a
+write in the same request.
+
+Read-your-writes: once a user commits a write (a message, a new contact, a
+conversation marked read), their reads go to the primary for
+READ_YOUR_WRITES_WINDOW seconds. Something they just did can therefore
+never be missing because a replica is behind; keep the window above the
+replicas' usual lag. An UPDATE or DELETE that matches no row is not a
+write. A batch stored by group commit (group_commit.py) counts for every
+sender in it, not only for the handler that wrote it. The window is tracked
+per worker process. With sticky sessions (which long-polling needs anyway)
+that is the worker serving the user.
+
+Statements that fill the process-wide caches (identity_cache.py,
+contact_graph.py) are marked with
+.execution_options(read_from_primary=True). A lagging replica could
+otherwise be cached for a whole TTL.
+"""
+import random
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+BIND_PREFIX = 'replica'
+
+
+def replica_binds(urls):
+    """ Returns SQLALCHEMY_BINDS entries for the replica URLs """
+    return {f'{BIND_PREFIX}{i}': url.replace('postgres://', 'postgresql://', 1)
+            for i, url in enumerate(urls)}
+
+
+class RecentWriters:
+    """ Users who committed a write in the last window seconds, at most max_size of them """
+    def __init__(self, window, max_size=100000):
+        self.window = window
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._written_at = OrderedDict()
+
+    def note(self, user_id):
+        with self._lock:
+            self._written_at[user_id] = time.monotonic()
+            self._written_at.move_to_end(user_id)
+            while len(self._written_at) > self.max_size:
+                self._written_at.popitem(last=False)
+
+    def is_recent(self, user_id):
+        with self._lock:
+            written_at = self._written_at.get(user_id)
+        return written_at is not None and time.monotonic() - written_at < self.window
+
+
+class ReplicaRouter:
+    """ The replica binds of one app and its recent writers, kept in app.extensions['replica'] """
+    def __init__(self, bind_keys, window):
+        self.bind_keys = list(bind_keys)
+        self.recent_writers = RecentWriters(window)
+
+    def choose(self):
+        return random.choice(self.bind_keys)
+
+
+def get_router(app):
+    """ Returns the app's ReplicaRouter, or None when no replica is configured """
+    return app.extensions.get('replica')
+
+
+def _request_user_id():
+    """ The logged-in user's id, if Flask-Login has already loaded them """
+    user = g.get('_login_user')
+    return getattr(user, 'id', None) if user is not None else None
+
+
+class RoutingSession(Session):
+    """ db_.session: sends the SELECTs of @replica_read views to a replica """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            if self._flushing:
+                self.info['wrote'] = True
+            elif getattr(clause, 'is_select', False) and self._may_use_replica(clause):
+                return self._db.engines[get_router(current_app).choose()]
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+    def _may_use_replica(self, clause):
+        if not has_request_context() or not g.get('read_replica') or self.info.get('wrote'):
+            return False
+        if clause.get_execution_options().get('read_from_primary'):
+            return False
+        router = get_router(current_app)
+        if router is None:
+            return False
+        user_id = _request_user_id()
+        return user_id is None or not router.recent_writers.is_recent(user_id)
+
+
+def note_writers(app, user_ids):
+    """ Sends the reads of user_ids to the primary for the read-your-writes window """
+    router = get_router(app)
+    if router is not None:
+        for user_id in user_ids:
+            router.recent_writers.note(user_id)
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _note_statement_write(orm_execute_state):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update
+            or orm_execute_state.is_delete):
+        return None
+    result = orm_execute_state.invoke_statement()
+    # e.g. mark_conversation_read on a conversation that is already read;
+    # rowcount is -1 where the driver cannot tell, which counts as a write
+    if orm_execute_state.is_insert or result.rowcount != 0:
+        orm_execute_state.session.info['wrote'] = True
+    return result
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _note_writer(session):
+    if not session.info.pop('wrote', False) or not has_request_context():
+        return
+    user_id = _request_user_id()
+    if user_id is not None:
+        note_writers(current_app, [user_id])
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _forget_write(session):
+    session.info.pop('wrote', None)
+
+
+def replica_read(f):
+    """ Lets the view's GET requests read from a replica (see module docstring) """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.read_replica = request.method in ('GET', 'HEAD')
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def init_app(app):
+    """ Creates the router when replicas are configured (see replica_binds) """
+    bind_keys = [key for key in app.config.get('SQLALCHEMY_BINDS') or {}
+                 if isinstance(key, str) and key.startswith(BIND_PREFIX)]
+    if bind_keys:
+        app.extensions['replica'] = ReplicaRouter(
+            bind_keys, window=app.config.get('READ_YOUR_WRITES_WINDOW', 5))
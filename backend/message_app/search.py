@@ -0,0 +1,244 @@
+"""
+Database-specific search indexes.
+
+Usernames are searched in two stages: a case-insensitive prefix match served
+by the btree index on lower(user_name), then (for terms of three or more
+characters) a substring match served by a trigram index:
+    - SQLite: an FTS5 table with the trigram tokenizer, kept in sync with
+      user_data by triggers
+    - PostgreSQL: a pg_trgm GIN index on lower(user_name)
+Other databases fall back to an unindexed LIKE for the substring stage.
+
+Message text is searched by word:
+    - SQLite: an FTS5 table over message_data whose 'participants' column
+      holds a token per participant, so scoping a search to the caller's own
+      conversations is part of the full-text match itself
+    - PostgreSQL: a GIN index on to_tsvector('simple', text)
+Both indexes are maintained by the database on every insert, including the
+Core insert in chat.on_message.
+
+db.init_db attaches the DDL to the tables (register_ddl) before it drops and
+creates them, so the indexes are created and dropped together with them.
+"""
+import logging
+from contextlib import contextmanager
+
+from markupsafe import escape
+from sqlalchemy import DDL, event, select, func, text, not_, and_, table, column, literal_column
+from sqlalchemy.orm import aliased
+
+from . import db_
+from .data_classes import ConversationSummary, Message, User
+
+logger = logging.getLogger(__name__)
+
+# Trigram indexes cannot match anything shorter than one trigram
+MIN_SUBSTRING_LENGTH = 3
+
+# Private-use characters stand in for <mark></mark> in the database's
+# snippet until the message text around them has been escaped
+_MARK_START, _MARK_END = '\ue000', '\ue001'
+
+_SQLITE_USER_SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS user_search USING fts5("
+    "user_name, content='user_data', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS user_search_ai AFTER INSERT ON user_data BEGIN "
+    "INSERT INTO user_search(rowid, user_name) VALUES (new.id, new.user_name); END",
+    "CREATE TRIGGER IF NOT EXISTS user_search_ad AFTER DELETE ON user_data BEGIN "
+    "INSERT INTO user_search(user_search, rowid, user_name) VALUES ('delete', old.id, old.user_name); END",
+    "CREATE TRIGGER IF NOT EXISTS user_search_au AFTER UPDATE OF user_name ON user_data BEGIN "
+    "INSERT INTO user_search(user_search, rowid, user_name) VALUES ('delete', old.id, old.user_name); "
+    "INSERT INTO user_search(rowid, user_name) VALUES (new.id, new.user_name); END",
+]
+
+_POSTGRES_USER_SEARCH_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_user_data_user_name_trgm "
+    "ON user_data USING gin (lower(user_name) gin_trgm_ops)",
+]
+
+# The FTS table reads snippets back through this view, which derives the
+# participant tokens ('u<id>') from message_data
+_SQLITE_MESSAGE_SEARCH_DDL = [
+    "CREATE VIEW IF NOT EXISTS message_search_content AS SELECT id, text, "
+    "'u' || user_from || ' u' || user_to AS participants FROM message_data",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS message_search USING fts5("
+    "text, participants, content='message_search_content', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS message_search_ai AFTER INSERT ON message_data BEGIN "
+    "INSERT INTO message_search(rowid, text, participants) "
+    "VALUES (new.id, new.text, 'u' || new.user_from || ' u' || new.user_to); END",
+    "CREATE TRIGGER IF NOT EXISTS message_search_ad AFTER DELETE ON message_data BEGIN "
+    "INSERT INTO message_search(message_search, rowid, text, participants) "
+    "VALUES ('delete', old.id, old.text, 'u' || old.user_from || ' u' || old.user_to); END",
+]
+
+_POSTGRES_MESSAGE_SEARCH_DDL = [
+    "CREATE INDEX IF NOT EXISTS ix_message_data_text_tsv "
+    "ON message_data USING gin (to_tsvector('simple', text))",
+]
+
+# Lightweight handle on the FTS table; it is not part of the ORM metadata
+message_search = table('message_search', column('rowid'), column('message_search'))
+
+_ddl_registered = False
+
+def register_ddl():
+    """ Attaches the search index DDL to the user_data and message_data tables, once """
+    global _ddl_registered
+    if _ddl_registered:
+        return
+    _ddl_registered = True
+    for statement in _SQLITE_USER_SEARCH_DDL:
+        event.listen(User.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+    event.listen(User.__table__, 'before_drop',
+                 DDL("DROP TABLE IF EXISTS user_search").execute_if(dialect='sqlite'))
+    for statement in _POSTGRES_USER_SEARCH_DDL:
+        event.listen(User.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+    for statement in _SQLITE_MESSAGE_SEARCH_DDL:
+        event.listen(Message.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+    for statement in ("DROP TABLE IF EXISTS message_search", "DROP VIEW IF EXISTS message_search_content"):
+        event.listen(Message.__table__, 'before_drop', DDL(statement).execute_if(dialect='sqlite'))
+    for statement in _POSTGRES_MESSAGE_SEARCH_DDL:
+        event.listen(Message.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+
+
+@contextmanager
+def message_search_deferred():
+    """
+        Stops updating the message search index row by row for a bulk load
+        into message_data, and rebuilds it in one pass when the block ends.
+        Commits before and after.
+    """
+    dialect = db_.engine.dialect.name
+    if dialect == 'sqlite':
+        db_.session.execute(text("DROP TRIGGER IF EXISTS message_search_ai"))
+    elif dialect == 'postgresql':
+        db_.session.execute(text("DROP INDEX IF EXISTS ix_message_data_text_tsv"))
+    db_.session.commit()
+    try:
+        yield
+    finally:
+        if dialect == 'sqlite':
+            db_.session.execute(text(_SQLITE_MESSAGE_SEARCH_DDL[2]))
+            db_.session.execute(text("INSERT INTO message_search(message_search) VALUES ('rebuild')"))
+        elif dialect == 'postgresql':
+            db_.session.execute(text(_POSTGRES_MESSAGE_SEARCH_DDL[0]))
+        db_.session.commit()
+
+
+def _prefix_upper_bound(term):
+    """ Smallest string greater than every string starting with term """
+    return term[:-1] + chr(ord(term[-1]) + 1)
+
+def _fts_phrase(term):
+    """ Quotes term as an FTS5 string so it is matched literally """
+    return '"' + term.replace('"', '""') + '"'
+
+def search_users(search_term, limit, offset=0):
+    """
+        Ranked, bounded username search. Prefix matches come first in
+        alphabetical order (so an exact match leads), then substring matches
+        by relevance. An empty term matches nothing.
+    
+    Returns tuple: (list of User, whether more results exist after this page)
+    """
+    term = search_term.strip().lower()
+    if not term:
+        return [], False
+
+    # Fetch one extra row to learn whether another page exists
+    wanted = offset + limit + 1
+    name = func.lower(User.user_name)
+    is_prefix = and_(name >= term, name < _prefix_upper_bound(term))
+
+    results = db_.session.scalars(
+        select(User).where(is_prefix).order_by(name).limit(wanted)
+    ).all()
+
+    if len(results) < wanted and len(term) >= MIN_SUBSTRING_LENGTH:
+        dialect = db_.session.get_bind().dialect.name
+        query = select(User).where(not_(is_prefix)).limit(wanted - len(results))
+        if dialect == 'sqlite':
+            matches = text("SELECT rowid, rank FROM user_search WHERE user_search MATCH :phrase") \
+                .bindparams(phrase=_fts_phrase(term)) \
+                .columns(rowid=db_.Integer, rank=db_.Float) \
+                .subquery()
+            query = query.join(matches, matches.c.rowid == User.id).order_by(matches.c.rank, name)
+        elif dialect == 'postgresql':
+            query = query.where(name.contains(term, autoescape=True)) \
+                .order_by(func.similarity(name, term).desc(), name)
+        else:
+            query = query.where(name.contains(term, autoescape=True)).order_by(name)
+        results += db_.session.scalars(query).all()
+
+    return results[offset:offset + limit], len(results) > offset + limit
+
+
+def search_messages(user, search_term, conversation_id=None, before=None, limit=20):
+    """
+        Word search over the messages user has sent or received, newest
+        first. Every word of search_term must appear. The returned snippet is
+        HTML: the message text escaped, with the matches wrapped in
+        <mark></mark>.
+        
+        Pagination is keyset-based on message id: pass the id of the last
+        result as before= to get the next page.
+    
+    Returns tuple: (list of (Message, snippet, sender User, recipient User),
+                    whether more results exist after this page)
+    """
+    words = search_term.split()
+    if not words:
+        return [], False
+
+    sender = aliased(User)
+    recipient = aliased(User)
+    dialect = db_.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        phrases = ' AND '.join(f'text : {_fts_phrase(word)}' for word in words)
+        snippet = func.snippet(literal_column('message_search'), 0, _MARK_START, _MARK_END, '…', 16)
+        query = (
+            select(Message, snippet, sender, recipient)
+            .select_from(message_search)
+            .join(Message, Message.id == message_search.c.rowid)
+            .where(message_search.c.message_search.op('MATCH')(
+                f'{phrases} AND participants : "u{user.id}"'))
+            .order_by(message_search.c.rowid.desc())
+        )
+        if before is not None:
+            query = query.where(message_search.c.rowid < before)
+    else:
+        # Restrict to the user's conversations through their inbox entries
+        own_conversations = select(ConversationSummary.conversation_id) \
+            .where(ConversationSummary.user_id == user.id)
+        if dialect == 'postgresql':
+            ts_query = func.plainto_tsquery('simple', search_term)
+            snippet = func.ts_headline('simple', Message.text, ts_query,
+                                       f'StartSel="{_MARK_START}", StopSel="{_MARK_END}", MaxWords=16')
+            matches = func.to_tsvector('simple', Message.text).op('@@')(ts_query)
+        else:
+            snippet = Message.text
+            matches = and_(*(Message.text.contains(word, autoescape=True) for word in words))
+        query = (
+            select(Message, snippet, sender, recipient)
+            .where(matches, Message.conversation_id.in_(own_conversations))
+            .order_by(Message.id.desc())
+        )
+        if before is not None:
+            query = query.where(Message.id < before)
+
+    if conversation_id is not None:
+        query = query.where(Message.conversation_id == conversation_id)
+    query = query.join(sender, Message.user_from == sender.id) \
+        .join(recipient, Message.user_to == recipient.id)
+
+    # Fetch one extra row to learn whether another page exists
+    results = db_.session.execute(query.limit(limit + 1)).all()
+    return [(message, _highlight(snippet), sender_row, recipient_row)
+            for message, snippet, sender_row, recipient_row in results[:limit]], \
+        len(results) > limit
+
+
+def _highlight(snippet):
+    """ Returns snippet as HTML: the text escaped, the match markers turned into <mark></mark> """
+    return str(escape(snippet)).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
@@ -4,19 +4,33 @@ Demo data seeding using Faker for realistic test data.
 Usage:
     flask seed-demo          # Add demo data to existing DB
     flask seed-demo --reset  # Reset DB and add demo data
+
+Scale mode generates synthetic data at production size for benchmarks:
+    flask seed-demo --reset --users 100000 --contacts-per-user 20 --messages 50000000
+
+Rows are bulk-inserted with Core statements in batches. Contact counts and
+conversation activity are heavy-tailed, messages are spread over --days with
+ids in time order, and every user shares one password hash (password
+"demo123"). The same --seed always produces the same data.
 """
+import itertools
 import logging
 import random
+import time
+import uuid
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
 
 import click
 from faker import Faker
 from flask.cli import with_appcontext
+from sqlalchemy import func, insert, select, text
 from werkzeug.security import generate_password_hash
 
 from . import db_
-from .data_classes import User, Message, Contact
-from .db import init_db
+from .data_classes import User, Message, Contact, Conversation
+from .db import init_db, get_conversation, rebuild_conversation_summaries
+from .search import message_search_deferred
 
 # Suppress faker's verbose logging
 logging.getLogger('faker').setLevel(logging.WARNING)
@@ -151,6 +165,8 @@ def generate_conversation(user1, user2, relationship_type):
     message_count = random.randint(min_msgs, max_msgs)
     timespan = timedelta(days=template['timespan_days'])
 
+    conversation = get_conversation(user1, user2, create=True)
+
     # Start time is timespan days ago
     start_time = datetime.now(timezone.utc) - timespan
 
@@ -181,6 +197,7 @@ def generate_conversation(user1, user2, relationship_type):
             ])
 
         msg = Message(
+            conversation_id=conversation.id,
             user_from=current_sender.id,
             user_to=current_receiver.id,
             text=text,
@@ -227,15 +244,255 @@ def create_messages(users):
     logger.info(f"Created {total_messages} total messages")
 
 
+# Scale mode
+
+SCALE_PASSWORD = 'demo123'
+SCALE_BATCH_SIZE = 20_000
+# Share of added contacts that the other user adds back
+RECIPROCAL_SHARE = 0.8
+# Pareto shape of per-user activity; smaller is more skewed
+ACTIVITY_SHAPE = 1.5
+# Messages end at this time unless --until is given, so runs are reproducible
+SCALE_UNTIL = datetime(2025, 1, 1, tzinfo=timezone.utc)
+SCALE_WORDS = [
+    'hello', 'coffee', 'meeting', 'tomorrow', 'thanks', 'project', 'weekend', 'dinner',
+    'call', 'later', 'sounds', 'good', 'review', 'deploy', 'bug', 'game', 'trip', 'see',
+    'you', 'soon', 'ok', 'sure', 'what', 'time', 'lunch', 'today', 'maybe', 'great',
+]
+SHORT_REPLIES = ["👍", "Sounds good!", "Ok", "Sure thing", "Thanks!", "Got it"]
+
+
+def _activity(rng, count):
+    """ Returns count heavy-tailed weights with mean 1 (a few users do most of the talking) """
+    weights = [rng.paretovariate(ACTIVITY_SHAPE) for _ in range(count)]
+    mean = sum(weights) / count
+    return [weight / mean for weight in weights]
+
+
+def _text_pool(rng, size=4096):
+    """ Returns message texts to draw from: template topics, short replies and word salad """
+    fake_month = rng.choice(['January', 'April', 'July', 'October'])
+    pool = [topic.format(month=fake_month)
+            for template in CONVERSATION_TEMPLATES.values() for topic in template['topics']]
+    pool += SHORT_REPLIES
+    while len(pool) < size:
+        pool.append(' '.join(rng.choice(SCALE_WORDS) for _ in range(rng.randint(3, 15))))
+    return pool
+
+
+def generate_scale_users(rng, count, first_id, password_hash, created_at):
+    """
+        Returns user rows with ids first_id .. first_id+count-1. Names are
+        Faker first/last names plus the id, so they are unique and searchable.
+    """
+    fake_names = Faker()
+    fake_names.seed_instance(rng.random())
+    first_names = sorted({fake_names.first_name().lower() for _ in range(1000)})
+    last_names = sorted({fake_names.last_name().lower() for _ in range(1000)})
+    return [{'id': user_id,
+             'uuid': str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+             'user_name': f'{rng.choice(first_names)}_{rng.choice(last_names)}{user_id}',
+             'user_pwd': password_hash() if callable(password_hash) else password_hash,
+             'created_at': created_at, 'modified_at': created_at}
+            for user_id in range(first_id, first_id + count)]
+
+
+def generate_scale_contacts(rng, user_ids, activity, contacts_per_user):
+    """
+        Picks contacts so that the average user has about contacts_per_user
+        of them. Active users add more contacts and are added more often;
+        RECIPROCAL_SHARE of the additions are mutual.
+
+    Returns list of (user, contact) id pairs
+    """
+    cum_weights = list(itertools.accumulate(activity))
+    initiated = contacts_per_user / (1 + RECIPROCAL_SHARE)
+    contacts = set()
+    for index, user_id in enumerate(user_ids):
+        wanted = min(len(user_ids) - 1, int(initiated * activity[index] + rng.random()))
+        if not wanted:
+            continue
+        picks = rng.choices(user_ids, cum_weights=cum_weights, k=wanted * 2)
+        added = 0
+        for contact_id in picks:
+            if contact_id == user_id or (user_id, contact_id) in contacts:
+                continue
+            contacts.add((user_id, contact_id))
+            if rng.random() < RECIPROCAL_SHARE:
+                contacts.add((contact_id, user_id))
+            added += 1
+            if added == wanted:
+                break
+    return sorted(contacts)
+
+
+def generate_scale_messages(rng, conversations, weights, count, start, end, texts, batch_size):
+    """
+        Yields batches of message rows. Conversations are picked by weight,
+        the sender is either side, and created_at grows from start to end
+        with the row order, as it would for live traffic.
+    """
+    cum_weights = list(itertools.accumulate(weights))
+    step = (end - start).total_seconds() / max(count, 1)
+    for batch_start in range(0, count, batch_size):
+        size = min(batch_size, count - batch_start)
+        picks = rng.choices(conversations, cum_weights=cum_weights, k=size)
+        rows = []
+        for offset, (conversation_id, low_user, high_user) in enumerate(picks):
+            if rng.random() < 0.5:
+                low_user, high_user = high_user, low_user
+            rows.append({
+                'conversation_id': conversation_id, 'user_from': low_user, 'user_to': high_user,
+                'text': rng.choice(texts),
+                'created_at': start + timedelta(seconds=step * (batch_start + offset + rng.random())),
+            })
+        yield rows
+
+
+def _insert_batches(model, rows, batch_size):
+    # Plain Core inserts on the table skip the ORM bulk-insert bookkeeping
+    for batch_start in range(0, len(rows), batch_size):
+        db_.session.execute(insert(model.__table__), rows[batch_start:batch_start + batch_size])
+
+
+def _advance_id_sequences(*models):
+    """ Moves PostgreSQL's id sequences past ids that were inserted explicitly """
+    if db_.session.get_bind().dialect.name != 'postgresql':
+        # SQLite hands out max(rowid) + 1, so explicit ids need no follow-up
+        return
+    for model in models:
+        table = model.__table__.name
+        db_.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+            f"(SELECT max(id) FROM {table}))"))
+
+
+@contextmanager
+def _message_indexes_deferred():
+    """ Drops the message_data indexes for a bulk load and builds them once afterwards """
+    with message_search_deferred():
+        indexes = list(Message.__table__.indexes)
+        for index in indexes:
+            index.drop(db_.session.connection())
+        db_.session.commit()
+        try:
+            yield
+        finally:
+            for index in indexes:
+                index.create(db_.session.connection())
+            db_.session.commit()
+
+
+def seed_scale(users, contacts_per_user, messages, seed=0, days=365, until=SCALE_UNTIL,
+               hash_each_password=False, batch_size=SCALE_BATCH_SIZE, progress=None):
+    """
+        Adds users, contacts, one conversation per pair of contacts, and
+        messages with bulk inserts, then rebuilds the inbox summaries.
+        Existing rows are kept; new ids continue after the current maximum.
+        progress, if given, is called with a line of text after each stage.
+
+    Returns dict: rows added per table
+    """
+    rng = random.Random(seed)
+    report = progress or (lambda line: None)
+    started = time.perf_counter()
+
+    def done(what):
+        report(f'{what} ({time.perf_counter() - started:.1f}s)')
+
+    start = until - timedelta(days=days)
+    if hash_each_password:
+        password_hash = lambda: generate_password_hash(SCALE_PASSWORD)
+    else:
+        password_hash = generate_password_hash(SCALE_PASSWORD)
+    first_user_id = (db_.session.scalar(select(func.max(User.id))) or 0) + 1
+    first_conversation_id = (db_.session.scalar(select(func.max(Conversation.id))) or 0) + 1
+
+    user_rows = generate_scale_users(rng, users, first_user_id, password_hash, start)
+    _insert_batches(User, user_rows, batch_size)
+    user_ids = [row['id'] for row in user_rows]
+    del user_rows
+    done(f'{users:,} users')
+
+    activity = _activity(rng, users)
+    contacts = generate_scale_contacts(rng, user_ids, activity, contacts_per_user)
+    _insert_batches(Contact, [{'user': user_id, 'contact': contact_id}
+                              for user_id, contact_id in contacts], batch_size)
+    done(f'{len(contacts):,} contacts')
+
+    by_id = dict(zip(user_ids, activity))
+    pairs = sorted({Conversation.key(user_id, contact_id) for user_id, contact_id in contacts})
+    conversations = [(conversation_id, low_user, high_user) for conversation_id, (low_user, high_user)
+                     in enumerate(pairs, start=first_conversation_id)]
+    _insert_batches(Conversation, [{'id': conversation_id, 'low_user': low_user,
+                                    'high_user': high_user, 'created_at': start}
+                                   for conversation_id, low_user, high_user in conversations],
+                    batch_size)
+    _advance_id_sequences(User, Conversation)
+    db_.session.commit()
+    done(f'{len(conversations):,} conversations')
+
+    if messages and not conversations:
+        raise click.UsageError('No conversations to put messages in; add more contacts per user.')
+    # A conversation is as busy as its two users, times its own spread
+    weights = [by_id[low_user] * by_id[high_user] * rng.lognormvariate(0, 1)
+               for _, low_user, high_user in conversations]
+    texts = _text_pool(rng)
+    inserted = 0
+    with _message_indexes_deferred():
+        for rows in generate_scale_messages(rng, conversations, weights, messages, start, until,
+                                            texts, batch_size):
+            db_.session.execute(insert(Message.__table__), rows)
+            db_.session.commit()
+            inserted += len(rows)
+            if inserted % (batch_size * 50) == 0 or inserted == messages:
+                done(f'{inserted:,} messages')
+    done('message indexes')
+
+    rebuild_conversation_summaries()
+    db_.session.commit()
+    done('inbox summaries')
+    return {'users': users, 'contacts': len(contacts),
+            'conversations': len(conversations), 'messages': inserted}
+
+
 @click.command('seed-demo')
 @click.option('--reset', is_flag=True, help='Reset database before seeding')
+@click.option('--users', type=click.IntRange(min=2),
+              help='Scale mode: number of synthetic users to add')
+@click.option('--contacts-per-user', type=click.IntRange(min=1), default=20, show_default=True,
+              help='Scale mode: average contacts per user')
+@click.option('--messages', type=click.IntRange(min=0), default=0, show_default=True,
+              help='Scale mode: number of messages to add')
+@click.option('--days', type=click.IntRange(min=1), default=365, show_default=True,
+              help='Scale mode: messages are spread over this many days')
+@click.option('--until', type=click.DateTime(), help='Scale mode: time of the last message (UTC)')
+@click.option('--seed', type=int, default=0, show_default=True,
+              help='Scale mode: random seed; the same seed gives the same data')
+@click.option('--batch-size', type=click.IntRange(min=1), default=SCALE_BATCH_SIZE,
+              show_default=True, help='Scale mode: rows per insert statement')
+@click.option('--hash-each-password', is_flag=True,
+              help='Scale mode: hash every password separately (slow) instead of sharing one hash')
 @with_appcontext
-def seed_demo_command(reset):
+def seed_demo_command(reset, users, contacts_per_user, messages, days, until, seed,
+                      batch_size, hash_each_password):
     """Seed the database with demo data using Faker."""
     if reset:
         click.echo('Resetting database...')
         init_db()
 
+    if users is not None:
+        click.echo(f'Generating {users:,} users and {messages:,} messages (seed {seed})...')
+        counts = seed_scale(
+            users, contacts_per_user, messages, seed=seed, days=days,
+            until=until.replace(tzinfo=timezone.utc) if until else SCALE_UNTIL,
+            hash_each_password=hash_each_password, batch_size=batch_size,
+            progress=lambda line: click.echo(f'  {line}'))
+        click.echo('')
+        click.echo('✓ Added ' + ', '.join(f'{count:,} {table}' for table, count in counts.items()))
+        click.echo(f'All passwords are "{SCALE_PASSWORD}".')
+        return
+
     click.echo('Creating demo users...')
     users = create_demo_users()
 
@@ -244,6 +501,8 @@ def seed_demo_command(reset):
 
     click.echo('Generating message history...')
     create_messages(users)
+    db_.session.flush()
+    rebuild_conversation_summaries()
 
     db_.session.commit()
 
@@ -0,0 +1,216 @@
+"""
+Slow-query log.
+
+Every statement that takes at least SLOW_QUERY_THRESHOLD_MS is recorded as
+one JSON line in a separate rotating log (logs/slow_queries.log by default,
+see logger.setup_slow_query_logging):
+
+    {"time": ..., "duration_ms": 212.4, "statement": "SELECT ...",
+     "parameters": [42, "'a long message...'... (120 chars)"],
+     "call_site": "message_app/chat.py:215 in get_message_page",
+     "plan": ["SEARCH message_data USING INDEX ix_message_data_conversation_created (...)"]}
+
+Parameters are normalized so the log stays small and does not leak message
+text: strings are cut to SLOW_QUERY_PARAM_LENGTH characters and long lists
+are summarized. The call site is the innermost frame in message_app.
+
+With SLOW_QUERY_EXPLAIN on, the plan is captured right away by running
+EXPLAIN QUERY PLAN (SQLite) or EXPLAIN (PostgreSQL) for the statement with
+the same parameters; neither executes the statement. A one-line warning
+also goes to the application log.
+
+    flask --app message_app slow-queries --top 10
+
+summarizes the log, grouping statements by text, by total time.
+"""
+import glob
+import json
+import logging
+import os
+import re
+import time
+import traceback
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event
+
+from . import db_
+from .logger import setup_slow_query_logging
+
+logger = logging.getLogger(__name__)
+slow_query_log = logging.getLogger('message_app.slow_query_log')
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+EXPLAIN_PREFIX = {'sqlite': 'EXPLAIN QUERY PLAN ', 'postgresql': 'EXPLAIN '}
+EXPLAINABLE = re.compile(r'\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b', re.IGNORECASE)
+
+
+def normalize_statement(statement):
+    """ Collapses whitespace so the same statement always groups together """
+    return re.sub(r'\s+', ' ', statement).strip()
+
+def normalize_parameter(value, max_length):
+    if isinstance(value, str):
+        if len(value) <= max_length:
+            return value
+        return f'{value[:max_length]!r}... ({len(value)} chars)'
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f'<{len(value)} bytes>'
+    if isinstance(value, (list, tuple)):
+        if len(value) > 10:
+            return f'<{len(value)} values>'
+        return [normalize_parameter(v, max_length) for v in value]
+    if isinstance(value, dict):
+        return {k: normalize_parameter(v, max_length) for k, v in value.items()}
+    if value is None or isinstance(value, (int, float, bool)):
+        return value
+    return str(value)
+
+def call_site():
+    """ Returns 'file:line in function' of the innermost message_app frame """
+    for frame in reversed(traceback.extract_stack()):
+        if frame.filename.startswith(PACKAGE_DIR) and frame.filename != __file__:
+            path = os.path.relpath(frame.filename, os.path.dirname(PACKAGE_DIR))
+            return f'{path}:{frame.lineno} in {frame.name}'
+    return None
+
+def explain(connection, statement, parameters):
+    """ Returns the query plan as a list of lines, or None if unsupported """
+    prefix = EXPLAIN_PREFIX.get(connection.dialect.name)
+    if prefix is None or not EXPLAINABLE.match(statement):
+        return None
+    postgres = connection.dialect.name == 'postgresql'
+    cursor = connection.connection.dbapi_connection.cursor()
+    try:
+        # A failed statement aborts a PostgreSQL transaction; the savepoint
+        # keeps a failed EXPLAIN from taking the caller's transaction with it
+        if postgres:
+            cursor.execute('SAVEPOINT slow_query_explain')
+        try:
+            cursor.execute(prefix + statement, parameters)
+            rows = cursor.fetchall()
+        except Exception as e:
+            if postgres:
+                cursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+            return [f'EXPLAIN failed: {e}']
+        if postgres:
+            cursor.execute('RELEASE SAVEPOINT slow_query_explain')
+    finally:
+        cursor.close()
+    if connection.dialect.name == 'sqlite':
+        # (id, parent, notused, detail)
+        return [row[3] for row in rows]
+    return [row[0] for row in rows]
+
+
+class SlowQueryRecorder:
+    def __init__(self, threshold, capture_explain, param_length):
+        """
+        Parameters
+            threshold: seconds at or above which a statement is logged
+            capture_explain: run EXPLAIN for logged statements
+            param_length: longest string parameter kept as is
+        """
+        self.threshold = threshold
+        self.capture_explain = capture_explain
+        self.param_length = param_length
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('slow_query_started', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['slow_query_started'].pop()
+        if elapsed >= self.threshold:
+            self.record(conn, statement, parameters, executemany, elapsed)
+
+    def handle_error(self, exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get('slow_query_started'):
+            connection.info['slow_query_started'].pop()
+
+    def record(self, conn, statement, parameters, executemany, elapsed):
+        site = call_site()
+        entry = {
+            'time': datetime.now(timezone.utc).isoformat(),
+            'duration_ms': round(elapsed * 1000, 2),
+            'statement': normalize_statement(statement),
+            'parameters': normalize_parameter(parameters, self.param_length),
+            'call_site': site,
+        }
+        # Plans of multi-row DML add nothing and EXPLAIN takes one parameter set
+        if self.capture_explain and not executemany:
+            entry['plan'] = explain(conn, statement, parameters)
+        slow_query_log.info(json.dumps(entry, default=str))
+        logger.warning(f"Slow query ({entry['duration_ms']} ms) at {site}: {entry['statement'][:200]}")
+
+
+def read_entries(log_file):
+    """ Yields the entries of the slow-query log and its rotated backups """
+    for path in sorted(glob.glob(log_file + '*')):
+        with open(path) as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+def summarize(entries, top):
+    """
+        Groups entries by statement.
+
+    Returns list of dicts sorted by total time, longest first:
+        {'statement', 'count', 'total_ms', 'max_ms', 'call_sites'}
+    """
+    groups = defaultdict(lambda: {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'call_sites': set()})
+    for entry in entries:
+        group = groups[entry['statement']]
+        group['count'] += 1
+        group['total_ms'] += entry['duration_ms']
+        group['max_ms'] = max(group['max_ms'], entry['duration_ms'])
+        if entry.get('call_site'):
+            group['call_sites'].add(entry['call_site'])
+    ranked = sorted(groups.items(), key=lambda item: item[1]['total_ms'], reverse=True)
+    return [dict(group, statement=statement, call_sites=sorted(group['call_sites']))
+            for statement, group in ranked[:top]]
+
+
+@click.command('slow-queries')
+@click.option('--top', default=10, show_default=True, help='Number of statements to show')
+@with_appcontext
+def slow_queries_command(top):
+    """Summarize the slow-query log by total time per statement."""
+    log_file = current_app.extensions['slow_query_log_file']
+    summary = summarize(read_entries(log_file), top)
+    if not summary:
+        click.echo(f'No slow queries in {log_file}')
+        return
+    for rank, group in enumerate(summary, 1):
+        click.echo(f"{rank}. total {group['total_ms']:.1f} ms, {group['count']} calls, "
+                   f"max {group['max_ms']:.1f} ms")
+        click.echo(f"   {group['statement'][:300]}")
+        for site in group['call_sites']:
+            click.echo(f"   at {site}")
+
+
+def init_app(app):
+    """ Attaches the recorder to the app's engines and registers the CLI command """
+    app.extensions['slow_query_log_file'] = setup_slow_query_logging(app)
+    app.cli.add_command(slow_queries_command)
+    threshold = app.config.get('SLOW_QUERY_THRESHOLD_MS')
+    if threshold is None:
+        return
+    recorder = SlowQueryRecorder(
+        threshold=threshold / 1000,
+        capture_explain=app.config.get('SLOW_QUERY_EXPLAIN', True),
+        param_length=app.config.get('SLOW_QUERY_PARAM_LENGTH', 40)
+    )
+    with app.app_context():
+        engines = list(db_.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', recorder.before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', recorder.after_cursor_execute)
+        event.listen(engine, 'handle_error', recorder.handle_error)
@@ -0,0 +1,133 @@
+"""
+SQLite performance profile.
+
+With SQLITE_PROFILE = 'performance' (the default) every new SQLite connection
+is set up with:
+
+    journal_mode = WAL         readers and the writer no longer block each other
+    synchronous = NORMAL       fsync at checkpoints instead of every commit; a
+                               power cut can lose the last commits, never the file
+    busy_timeout               writers queue for the lock for up to
+                               SQLITE_BUSY_TIMEOUT_MS instead of failing with
+                               "database is locked"
+    cache_size                 SQLITE_CACHE_SIZE_KB of page cache per connection
+    mmap_size                  SQLITE_MMAP_SIZE bytes of the file read through mmap
+    temp_store = MEMORY        sorts and temporary indexes stay in memory
+
+'default' keeps SQLite's stock settings (rollback journal, synchronous=FULL).
+Other databases are not affected.
+
+In WAL mode commits go to the write-ahead log, and a checkpoint copies them
+back into the database. SQLite checkpoints on its own, but those checkpoints
+never wait for readers, so under steady traffic the log keeps growing.
+run_maintenance() runs PRAGMA optimize to refresh the query planner's
+statistics and truncates the log. serve.py runs it every
+SQLITE_MAINTENANCE_INTERVAL seconds; `flask sqlite-maintenance` runs it once.
+"""
+import logging
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import db_, socketio
+
+logger = logging.getLogger(__name__)
+
+PROFILES = ('performance', 'default')
+
+
+def connection_pragmas(config):
+    """ Returns the PRAGMA statements run on every new connection for config's profile """
+    profile = config.get('SQLITE_PROFILE', 'performance')
+    if profile not in PROFILES:
+        raise ValueError(f"SQLITE_PROFILE must be one of {', '.join(PROFILES)}, not {profile!r}")
+    if profile == 'default':
+        return []
+    return [
+        'PRAGMA journal_mode = WAL',
+        'PRAGMA synchronous = NORMAL',
+        f"PRAGMA busy_timeout = {int(config.get('SQLITE_BUSY_TIMEOUT_MS', 5000))}",
+        # A negative cache_size is in KiB rather than pages
+        f"PRAGMA cache_size = {-int(config.get('SQLITE_CACHE_SIZE_KB', 65536))}",
+        f"PRAGMA mmap_size = {int(config.get('SQLITE_MMAP_SIZE', 268435456))}",
+        'PRAGMA temp_store = MEMORY',
+    ]
+
+
+def run_maintenance(engine):
+    """
+        Lets SQLite refresh planner statistics where they are stale, then
+        checkpoints and truncates the write-ahead log.
+
+    Returns dict: busy (1 if readers kept the checkpoint from finishing),
+    log_pages and checkpointed_pages (-1 when not in WAL mode)
+    """
+    with engine.connect() as connection:
+        # optimize may write new statistics, so it goes before the checkpoint
+        connection.exec_driver_sql('PRAGMA optimize')
+        busy, log_pages, checkpointed = connection.exec_driver_sql(
+            'PRAGMA wal_checkpoint(TRUNCATE)').one()
+    return {'busy': busy, 'log_pages': log_pages, 'checkpointed_pages': checkpointed}
+
+
+def start_maintenance(app):
+    """
+        Starts a background task running run_maintenance every
+        SQLITE_MAINTENANCE_INTERVAL seconds, on the Socket.IO async mode's
+        threads or greenlets.
+
+    Returns the task, or None when the app is not on SQLite in WAL mode or
+    the interval is 0
+    """
+    interval = app.config.get('SQLITE_MAINTENANCE_INTERVAL', 300)
+    with app.app_context():
+        engine = db_.engine
+    if engine.dialect.name != 'sqlite' or not interval or not connection_pragmas(app.config):
+        return None
+
+    def maintain():
+        while True:
+            socketio.sleep(interval)
+            try:
+                result = run_maintenance(engine)
+            except SQLAlchemyError as e:
+                logger.error(f"SQLite maintenance failed: {e}")
+            else:
+                logger.debug(f"SQLite maintenance: {result}")
+
+    logger.info(f"SQLite maintenance every {interval}s")
+    return socketio.start_background_task(maintain)
+
+
+@click.command('sqlite-maintenance')
+@with_appcontext
+def sqlite_maintenance_command():
+    """Checkpoint the SQLite write-ahead log and run PRAGMA optimize."""
+    if db_.engine.dialect.name != 'sqlite':
+        raise click.UsageError('The database is not SQLite.')
+    result = run_maintenance(db_.engine)
+    click.echo(f"Checkpointed {result['checkpointed_pages']} of {result['log_pages']} WAL pages"
+               + (' (busy: readers are still active)' if result['busy'] else ''))
+
+
+def _apply_profile(pragmas):
+    def apply_profile(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+    return apply_profile
+
+
+def init_app(app):
+    """ Applies the SQLite profile to every new connection of the app's SQLite engines """
+    app.cli.add_command(sqlite_maintenance_command)
+    pragmas = connection_pragmas(app.config)
+    if not pragmas:
+        return
+    with app.app_context():
+        engines = [engine for engine in db_.engines.values() if engine.dialect.name == 'sqlite']
+    for engine in engines:
+        event.listen(engine, 'connect', _apply_profile(pragmas))
@@ -0,0 +1,114 @@
+from flask import Blueprint, request, jsonify, abort, current_app
+from flask_login import login_required, current_user
+from sqlalchemy import select, and_
+
+from .data_classes import Contact, Conversation, ConversationSummary
+from .db import get_conversation, get_user, has_contact, get_messages_after, count_messages_after
+from .decorators import get_room_contact
+from .chat import message_json
+from .replica import replica_read
+
+bp = Blueprint('sync', __name__)
+
+@bp.route('/sync', methods=['GET'])
+@login_required
+@replica_read
+def sync():
+    """
+        Delta sync for reconnecting clients: the messages after the client's
+        high-water mark (the largest message id it has seen), oldest first.
+
+        Query parameters:
+            after: message id, required
+            room_id: optional, restricts the sync to one conversation;
+                     otherwise every conversation with one of the client's
+                     contacts is included
+            limit: page size, capped at SYNC_MAX_PAGE_SIZE
+
+        While 'has_more' is true the client calls again with
+        ?after=<high_water_mark>. A client more than SYNC_MAX_BEHIND messages
+        behind gets 'resync': true and no messages; it should reload its
+        conversations through GET /chat/<room_id> instead of paging through
+        the backlog.
+
+        The high-water mark assumes ids are committed in order. That holds on
+        SQLite, which runs one writer at a time. On PostgreSQL a message can
+        commit after a larger id was returned and is then only delivered
+        live; joining with last_seen (see chat.replay_missed_messages) does
+        not depend on the order.
+
+    Returns JSON object:
+        {
+         'messages':
+            [
+                {
+                    'id': Message.id,
+                    'room_id': Conversation.room_id,
+                    'text': Message.text,
+                    'sender': {'uuid': User.uuid, 'username': User.user_name},
+                    'recipient': {'uuid': User.uuid, 'username': User.user_name},
+                    'timestamp': Message.created_at.isoformat()
+                },
+                ...
+            ],
+         'high_water_mark': largest Message.id returned, else 'after',
+         'has_more': bool,
+         'resync': bool
+        }
+    """
+    try:
+        after = int(request.args['after'])
+        limit = int(request.args.get('limit', current_app.config['SYNC_PAGE_SIZE']))
+    except (KeyError, ValueError):
+        abort(400)
+    if after < 0 or limit < 1:
+        abort(400)
+    limit = min(limit, current_app.config['SYNC_MAX_PAGE_SIZE'])
+
+    if 'room_id' in request.args:
+        contact = get_room_contact(request.args['room_id'])
+        if contact is None:
+            abort(404)
+        # Same rule as the chat page (see contact_required)
+        if not has_contact(current_user, contact):
+            abort(403)
+        conversation = get_conversation(current_user, contact)
+        conversation_ids = [conversation.id] if conversation else []
+    else:
+        conversation_ids = changed_conversations(current_user.id, after)
+
+    messages, has_more = get_messages_after(conversation_ids, after, limit)
+    if has_more and count_messages_after(conversation_ids, after,
+                                         current_app.config['SYNC_MAX_BEHIND']) \
+            > current_app.config['SYNC_MAX_BEHIND']:
+        return jsonify({'messages': [], 'high_water_mark': after,
+                        'has_more': False, 'resync': True}), 200
+
+    users = {}
+    formatted_messages = []
+    for message in messages:
+        for user_id in (message.user_from, message.user_to):
+            if user_id not in users:
+                users[user_id] = get_user(user_id)
+        formatted = message_json(message, users[message.user_from], users[message.user_to])
+        formatted['room_id'] = Conversation.room_id_for(message.conversation_id)
+        formatted_messages.append(formatted)
+
+    high_water_mark = messages[-1].id if messages else after
+    return jsonify({'messages': formatted_messages, 'high_water_mark': high_water_mark,
+                    'has_more': has_more, 'resync': False}), 200
+
+def changed_conversations(user_id, after):
+    """
+        Returns a subquery of the ids of user_id's conversations with a contact
+        whose latest message is newer than message id after. Answered from the
+        inbox summaries, so quiet conversations cost nothing.
+    """
+    return select(ConversationSummary.conversation_id).join(
+        Contact,
+        and_(Contact.user == ConversationSummary.user_id,
+             Contact.contact == ConversationSummary.contact_id)
+    ).where(
+        (ConversationSummary.user_id == user_id) &
+        (ConversationSummary.last_message_id > after)
+    )
@@ -1,26 +1,39 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, abort, current_app
 from flask_login import login_required
-from message_app import db_
-from .data_classes import User
-from sqlalchemy import select
+from .search import search_users
+from .replica import replica_read
 
 bp = Blueprint('usersearch', __name__)
 
 @bp.route('/users/search', methods=['GET'])
 @login_required
+@replica_read
 def usersearch():
+    """
+        Searches usernames for the 'username' query parameter. Results are
+        ranked (see search.search_users) and paginated with ?limit= and
+        ?offset=; 'next_offset' is null on the last page. Each user is
+        returned as {'uuid', 'user_name'}.
+    """
     # extract params from URL
     search_term = request.args.get('username', '')
-    # print("search term is ", search_term)
-    # query db for usernames
-    # TO DO: add to db.py then import and call; should also be error handling here
-    # since interacting with the database
-    results = db_.session.scalars(select(User).where(User.user_name.ilike(f"%{search_term}%"))).all()
-    results = [r.to_dict() for r in results]
+    try:
+        limit = int(request.args.get('limit', current_app.config['USER_SEARCH_PAGE_SIZE']))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        abort(400)
+    if limit < 1 or offset < 0:
+        abort(400)
+    limit = min(limit, current_app.config['USER_SEARCH_MAX_PAGE_SIZE'])
+
+    results, has_more = search_users(search_term, limit, offset)
+    # Only public fields; the row also holds the password hash
+    results = [{'uuid': r.uuid, 'user_name': r.user_name} for r in results]
     data = {}
     data['users'] = results
+    data['next_offset'] = offset + limit if has_more else None
     if results:
         data['message'] = 'success'
     else:
         data['message'] = 'no results found'
-    return jsonify(data), 200
\ No newline at end of file
+    return jsonify(data), 200
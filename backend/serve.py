@@ -0,0 +1,105 @@
+"""
+Production entry point for the backend.
+
+Serves HTTP and Socket.IO with the chosen async mode:
+    threading  one OS thread per connection (Werkzeug); no extra packages
+    gevent     one greenlet per connection; pip install gevent
+    eventlet   one green thread per connection; pip install eventlet
+
+gevent and eventlet only work if the standard library is monkey-patched
+before anything else is imported, so this script parses its arguments,
+patches, and only then imports message_app.
+
+Usage (from the backend folder):
+    python serve.py --async-mode gevent
+    python serve.py --async-mode gevent --workers 4 --port 8000
+
+With --workers N the workers listen on ports port .. port+N-1 and must sit
+behind a load balancer. Several workers need SOCKETIO_MESSAGE_QUEUE and, for
+long-polling clients, sticky sessions (see README.md).
+
+The Flask config comes from --config (default: FLASK_ENV or 'production');
+SOCKETIO_PING_INTERVAL / SOCKETIO_PING_TIMEOUT and the other settings in
+message_app/config.py are read from the environment as usual.
+"""
+import argparse
+import importlib
+import os
+import subprocess
+import sys
+
+ASYNC_MODES = ('threading', 'gevent', 'eventlet')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--async-mode', choices=ASYNC_MODES,
+                        default=os.environ.get('SOCKETIO_ASYNC_MODE', 'threading'))
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5000)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WORKERS', 1)))
+    parser.add_argument('--config', default=os.environ.get('FLASK_ENV', 'production'))
+    return parser.parse_args(argv)
+
+
+def monkey_patch(async_mode):
+    """ Makes blocking stdlib calls cooperative; must run before other imports """
+    if async_mode == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+    elif async_mode == 'eventlet':
+        import eventlet
+        eventlet.monkey_patch()
+    else:
+        return
+    # psycopg2 waits for PostgreSQL in C, out of reach of the patching above;
+    # psycogreen hands those waits to the event loop (pip install psycogreen)
+    try:
+        psycogreen = importlib.import_module(f'psycogreen.{async_mode}')
+    except ImportError:
+        return
+    psycogreen.patch_psycopg()
+
+
+def spawn_workers(args):
+    """ Runs one single-worker copy of this script per port and waits on them """
+    if not os.environ.get('SOCKETIO_MESSAGE_QUEUE'):
+        sys.exit("--workers > 1 needs SOCKETIO_MESSAGE_QUEUE so rooms span the workers")
+    workers = [
+        subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                          '--async-mode', args.async_mode, '--host', args.host,
+                          '--port', str(args.port + i), '--workers', '1',
+                          '--config', args.config])
+        for i in range(args.workers)
+    ]
+    try:
+        for worker in workers:
+            worker.wait()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+
+
+def serve(args):
+    monkey_patch(args.async_mode)
+    # The app reads the mode from its config when creating the Socket.IO server
+    os.environ['SOCKETIO_ASYNC_MODE'] = args.async_mode
+
+    from message_app import create_app, socketio, sqlite_tuning
+
+    app = create_app(config_name=args.config)
+    sqlite_tuning.start_maintenance(app)
+    app.logger.info(f"Serving on {args.host}:{args.port} in {socketio.async_mode} mode")
+    # Werkzeug is the only server available in threading mode; gevent and
+    # eventlet use their own WSGI servers
+    socketio.run(app, host=args.host, port=args.port, debug=False,
+                 use_reloader=False, log_output=False,
+                 allow_unsafe_werkzeug=args.async_mode == 'threading')
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.workers > 1:
+        spawn_workers(args)
+    else:
+        serve(args)
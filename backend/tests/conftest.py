@@ -1,14 +1,21 @@
 import os
 import tempfile
+from contextlib import contextmanager
 
 import pytest
+from sqlalchemy import event, select
 
 # add parent directory to module search path
 import sys
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from message_app import create_app
-from message_app.db import init_db
+# Apps built from the non-testing configs (test_factory) log here too, not
+# into the source tree; Config reads LOG_DIR when message_app is imported
+os.environ.setdefault('LOG_DIR', os.path.join(tempfile.gettempdir(), 'message_app_test_logs'))
+
+from message_app import create_app, db_
+from message_app.data_classes import Message
+from message_app.db import init_db, get_user, get_conversation, insert_messages
 from test_data import insert_test_data
 
 """
@@ -16,11 +23,18 @@ The fixtures like app, auth, client are used as arguments for test functions.
 """
 
 @pytest.fixture
-def app():
+def app_config():
+    """ Extra config for the app fixture; override it in a test module """
+    return {}
+
+@pytest.fixture
+def app(tmp_path, app_config):
     db_fd, db_path = tempfile.mkstemp()
 
     app = create_app(test_config={
         'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+        'LOG_DIR': str(tmp_path / 'logs'),
+        **app_config,
     })
 
     with app.app_context():
@@ -33,6 +47,9 @@ def app():
     # everything after yield will run after the test completes
     # the code below closes the file; so each test gets a new copy of the testing database
 
+    # Closing the connections also removes SQLite's -wal and -shm files
+    with app.app_context():
+        db_.engine.dispose()
     os.close(db_fd)
     os.unlink(db_path)
 
@@ -61,3 +78,68 @@ class AuthActions(object):
 def auth(client):
     return AuthActions(client)
 
+
+@pytest.fixture
+def query_budget(app):
+    """
+        Fails the test if the block runs more SQL statements than budget:
+            with query_budget(4):
+                client.get('/contacts')
+        The block gets the list of statements it ran. Without a budget the
+        statements are only recorded.
+    """
+    @contextmanager
+    def check(budget=None):
+        statements = []
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        with app.app_context():
+            engine = db_.engine
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+        assert budget is None or len(statements) <= budget, \
+            f"{len(statements)} queries over a budget of {budget}:\n" + "\n".join(statements)
+    return check
+
+
+@pytest.fixture
+def socket_clients(app, client, auth):
+    """ Socket.IO clients of 'test' and 'test2', both in their conversation's room """
+    auth.login()
+    client2 = app.test_client()
+    AuthActions(client2).login(username='test2', password='test2')
+    sockets = [app.extensions['socketio'].test_client(app, namespace='/chat', flask_test_client=c)
+               for c in (client, client2)]
+    for socket in sockets:
+        socket.emit('join', {'room': '1'}, namespace='/chat')
+        socket.get_received(namespace='/chat')
+    yield sockets
+    for socket in sockets:
+        socket.disconnect(namespace='/chat')
+
+
+def send(app, user_from, user_to, count):
+    """ Stores count messages from user_from to user_to; returns their ids """
+    with app.app_context():
+        sender, recipient = get_user(user_from), get_user(user_to)
+        conversation = get_conversation(sender, recipient, create=True)
+        rows = insert_messages([{'conversation_id': conversation.id, 'user_from': user_from,
+                                 'user_to': user_to, 'text': f'missed {i}'} for i in range(count)])
+        db_.session.commit()
+        return [row.id for row in rows]
+
+
+def latest_id(app):
+    with app.app_context():
+        return db_.session.scalar(select(Message.id).order_by(Message.id.desc()).limit(1))
+
+
+def sample(text, name):
+    """ Returns the value of the sample line starting with name, or None """
+    for line in text.splitlines():
+        if line.startswith(name + ' '):
+            return float(line.rsplit(' ', 1)[1])
+    return None
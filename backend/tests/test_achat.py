@@ -1,8 +1,9 @@
+import pytest
 from sqlalchemy import select
 from message_app import db_
-from message_app.data_classes import User, Message
+from message_app.data_classes import User, Message, Conversation, ConversationSummary
 from datetime import datetime, timezone
-from conftest import AuthActions
+from conftest import AuthActions, send
 from flask_login import current_user
 
 def create_room_name(user_uuid, contact_uuid):
@@ -230,6 +231,113 @@ def test_load_chat_history(app, client, auth):
         assert messages[1]['text'] == "Hello back from test2!"
         assert messages[2]['text'] == "long message"*20
 
+def test_chat_history_pagination(app, client, auth):
+    auth.login()
+    with app.app_context():
+        test_uuid = db_.session.scalar(select(User.uuid).filter(User.user_name=='test'))
+        contact_uuid = db_.session.scalar(select(User.uuid).filter(User.user_name=='test2'))
+    room_id = create_room_name(test_uuid, contact_uuid)
+
+    # Most recent page, oldest first
+    page = client.get(f'/chat/{room_id}?limit=2').get_json()
+    assert [m['text'] for m in page['messages']] == ["Hello back from test2!", "long message"*20]
+    assert page['next_cursor'] is None
+    assert page['prev_cursor'] == page['messages'][0]['id']
+    assert page['is_mutual'] == True
+
+    # Older page reaches the start of the conversation
+    older = client.get(f"/chat/{room_id}?limit=2&before={page['prev_cursor']}").get_json()
+    assert [m['text'] for m in older['messages']] == ["Hello from test user!"]
+    assert older['prev_cursor'] is None
+    assert older['next_cursor'] == older['messages'][0]['id']
+
+    # Paging forward again returns the newer messages without overlap
+    newer = client.get(f"/chat/{room_id}?limit=1&after={older['next_cursor']}").get_json()
+    assert [m['text'] for m in newer['messages']] == ["Hello back from test2!"]
+    assert newer['next_cursor'] == newer['messages'][0]['id']
+
+    # Page size is capped by config
+    app.config['CHAT_MAX_PAGE_SIZE'] = 1
+    capped = client.get(f'/chat/{room_id}?limit=100').get_json()
+    assert len(capped['messages']) == 1
+
+def test_chat_history_query_count(app, client, auth, query_budget):
+    """ Loading history costs the same number of queries however long it is """
+    auth.login()
+    with app.app_context():
+        test_user = db_.session.scalar(select(User).filter(User.user_name=='test'))
+        test2 = db_.session.scalar(select(User).filter(User.user_name=='test2'))
+    room_id = create_room_name(test_user.uuid, test2.uuid)
+    # Warm the identity cache so both measurements are steady-state
+    client.get(f'/chat/{room_id}')
+
+    with query_budget() as short_history:
+        response = client.get(f'/chat/{room_id}?limit=200')
+    assert len(response.get_json()['messages']) == 3
+
+    with app.app_context():
+        db_.session.add_all([
+            Message(conversation_id=1,
+                    user_from=test_user.id if i % 2 else test2.id,
+                    user_to=test2.id if i % 2 else test_user.id,
+                    text=f'message {i}',
+                    created_at=create_test_datetime(year=2025, month=2, minute=i % 60))
+            for i in range(100)
+        ])
+        db_.session.commit()
+
+    with query_budget() as long_history:
+        response = client.get(f'/chat/{room_id}?limit=200')
+    assert len(response.get_json()['messages']) == 103
+    assert len(long_history) == len(short_history)
+
+def test_chat_short_room_id(app, client, auth):
+    auth.login()
+    with app.app_context():
+        test_uuid = db_.session.scalar(select(User.uuid).filter(User.user_name=='test'))
+        contact_uuid = db_.session.scalar(select(User.uuid).filter(User.user_name=='test2'))
+    legacy = client.get(f'/chat/{create_room_name(test_uuid, contact_uuid)}').get_json()
+    assert legacy['room_id'] == '1'
+
+    # The conversation's short room id serves the same history
+    short = client.get(f"/chat/{legacy['room_id']}").get_json()
+    assert short == legacy
+
+    # A conversation the user is not part of is not found
+    with app.app_context():
+        db_.session.add(Conversation(low_user=2, high_user=3))
+        db_.session.commit()
+    assert client.get('/chat/3').status_code == 404
+
+@pytest.mark.parametrize('query', ('limit=0', 'limit=x', 'before=x', 'before=1&after=2'))
+def test_chat_history_pagination_bad_args(app, client, auth, query):
+    auth.login()
+    with app.app_context():
+        test_uuid = db_.session.scalar(select(User.uuid).filter(User.user_name=='test'))
+        contact_uuid = db_.session.scalar(select(User.uuid).filter(User.user_name=='test2'))
+    room_id = create_room_name(test_uuid, contact_uuid)
+    response = client.get(f'/chat/{room_id}?{query}')
+    assert response.status_code == 400
+
+def test_chat_history_bad_cursor_keeps_unread(app, client, auth):
+    auth.login()
+    send(app, 2, 1, 2)
+    with app.app_context():
+        other = db_.session.scalar(select(Message.id).where(Message.conversation_id != 1))
+        missing = db_.session.scalar(select(db_.func.max(Message.id))) + 100
+    for cursor in (other, missing):
+        assert client.get(f'/chat/1?after={cursor}').status_code == 400
+        assert client.get(f'/chat/1?before={cursor}').status_code == 400
+    with app.app_context():
+        assert db_.session.get(ConversationSummary, (1, 2)).unread_count > 0
+
+    # A valid cursor at the end of the conversation still marks it read
+    with app.app_context():
+        latest = db_.session.scalar(select(db_.func.max(Message.id)).where(Message.conversation_id == 1))
+    assert client.get(f'/chat/1?after={latest}').get_json()['messages'] == []
+    with app.app_context():
+        assert db_.session.get(ConversationSummary, (1, 2)).unread_count == 0
+
 #------------------------------------------------------------------------------
 # Commented-out code in this section are the handler tests broken up into
 # different test functions. They will pass when run individually but not when
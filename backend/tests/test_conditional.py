@@ -0,0 +1,78 @@
+import pytest
+
+from conftest import send
+
+
+def revalidate(client, url):
+    """ Fetches url, then fetches it again with its ETag; returns both responses """
+    first = client.get(url)
+    return first, client.get(url, headers={'If-None-Match': first.headers['ETag']})
+
+
+@pytest.mark.parametrize('url', ['/contacts', '/chat/1', '/chat/1?before=5&limit=2'])
+def test_not_modified(client, auth, url):
+    auth.login()
+    first, second = revalidate(client, url)
+    assert first.status_code == 200
+    assert first.headers['Cache-Control'] == 'private, no-cache'
+    assert not first.headers['ETag'].startswith('W/')
+    assert second.status_code == 304
+    assert second.data == b''
+    assert second.headers['ETag'] == first.headers['ETag']
+
+
+def test_etag_differs_per_page_and_user(app, client, auth):
+    auth.login()
+    etags = {client.get(url).headers['ETag'] for url in ('/chat/1', '/chat/1?limit=2', '/chat/2')}
+    assert len(etags) == 3
+    other = app.test_client()
+    other.post('/auth/login', json={'username': 'test2', 'password': 'test2'})
+    assert other.get('/chat/1').headers['ETag'] not in etags
+
+
+def test_new_message_changes_etags(app, client, auth):
+    auth.login()
+    chat, contacts = client.get('/chat/1'), client.get('/contacts')
+    send(app, 2, 1, 1)
+    for url, response in (('/chat/1', chat), ('/contacts', contacts)):
+        fresh = client.get(url, headers={'If-None-Match': response.headers['ETag']})
+        assert fresh.status_code == 200
+        assert fresh.headers['ETag'] != response.headers['ETag']
+    # A message in another conversation leaves this one's ETag alone
+    chat = client.get('/chat/1')
+    send(app, 3, 1, 1)
+    assert client.get('/chat/1', headers={'If-None-Match': chat.headers['ETag']}).status_code == 304
+
+
+def test_sending_writes_no_user_rows(app, query_budget):
+    # The contacts ETag is derived from the inbox entries the send already updates
+    with query_budget() as statements:
+        send(app, 2, 1, 1)
+    assert not [s for s in statements if s.lstrip().upper().startswith('UPDATE USER_DATA')]
+
+
+def test_read_and_contact_changes_change_contacts_etag(app, client, auth):
+    auth.login()
+    send(app, 2, 1, 1)
+    contacts = client.get('/contacts')
+    assert contacts.json['inbox'][0]['unread_count'] == 1
+    # Opening the conversation clears the unread count shown by /contacts
+    client.get('/chat/1')
+    fresh = client.get('/contacts', headers={'If-None-Match': contacts.headers['ETag']})
+    assert fresh.status_code == 200
+    assert fresh.json['inbox'][0]['unread_count'] == 0
+
+    client.post('/contacts', json={'username': 'island'})
+    newer = client.get('/contacts', headers={'If-None-Match': fresh.headers['ETag']})
+    assert newer.status_code == 200
+    assert 'island' in [c['contact_name'] for c in newer.json['contacts_data']]
+
+
+def test_other_users_changes_keep_etag(app, client, auth):
+    auth.login()
+    contacts = client.get('/contacts')
+    # test2 and test3 are not in a conversation with each other; nothing test sees changes
+    other = app.test_client()
+    other.post('/auth/login', json={'username': 'test2', 'password': 'test2'})
+    other.post('/contacts', json={'username': 'island'})
+    assert client.get('/contacts', headers={'If-None-Match': contacts.headers['ETag']}).status_code == 304
@@ -0,0 +1,72 @@
+from sqlalchemy import event
+
+from message_app import db_
+from message_app.contact_graph import get_graph
+from message_app.data_classes import Contact
+from message_app.db import get_user_by_name
+from conftest import AuthActions
+
+
+def test_checks_are_served_from_memory(app):
+    with app.app_context():
+        graph = get_graph(app)
+        assert graph.has_contact(1, 2)
+        assert graph.is_mutual(1, 2)
+        assert not graph.has_contact(2, 3)
+        assert not graph.is_mutual(2, 3)
+
+        statements = []
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(db_.engine, 'before_cursor_execute', record)
+        try:
+            assert graph.has_contact(1, 3)
+            assert graph.is_mutual(1, 3)
+            assert not graph.is_mutual(1, 4)
+            assert not graph.is_mutual(2, 3)
+        finally:
+            event.remove(db_.engine, 'before_cursor_execute', record)
+        assert statements == []
+
+
+def test_add_contact_updates_index(app, client):
+    AuthActions(client).login(username='island', password='island')
+    with app.app_context():
+        graph = get_graph(app)
+        assert not graph.has_contact(4, 1)
+        assert not graph.is_mutual(1, 4)
+    response = client.post('/contacts', json={'username': 'test'})
+    assert response.get_json()['message'] == 'success'
+    with app.app_context():
+        misses = graph.stats()['misses']
+        assert graph.has_contact(4, 1)
+        assert 4 in graph._entries[1][2]
+        assert graph.stats()['misses'] == misses
+
+
+def test_contact_added_elsewhere_is_found(app):
+    """ A contact added by another process is picked up on the first "no" """
+    with app.app_context():
+        graph = get_graph(app)
+        assert not graph.has_contact(2, 3)
+        db_.session.add(Contact(user=2, contact=3))
+        db_.session.commit()
+        assert graph.has_contact(2, 3)
+
+
+def test_join_requires_contact(app, client):
+    AuthActions(client).login(username='test2', password='test2')
+    with app.app_context():
+        test2 = get_user_by_name('test2')
+        test3 = get_user_by_name('test3')
+        room = min(test2.uuid + test3.uuid, test3.uuid + test2.uuid)
+
+    socketio_client = app.extensions['socketio'].test_client(
+        app, namespace='/chat', flask_test_client=client)
+    try:
+        socketio_client.emit('join', {'room': room}, namespace='/chat')
+        received = socketio_client.get_received('/chat')
+        assert [event['name'] for event in received] == ['error']
+        assert received[0]['args'][0] == {'message': 'Not allowed to join this room.'}
+    finally:
+        socketio_client.disconnect(namespace='/chat')
@@ -1,7 +1,9 @@
 import pytest
 from datetime import datetime
 from http import HTTPStatus
-from message_app.db import get_db, has_contact, get_user_by_name
+from message_app import db_
+from message_app.data_classes import Message
+from message_app.db import get_db, has_contact, get_user_by_name, get_conversation, update_conversation_summary
 
 # parse date string
 def pds(date_str):
@@ -31,6 +33,57 @@ def test_contacts(client, auth):
     for i in range(len(messages)):
         assert messages[i]['user_from_name'] in [contact1['contact_name'], contact2['contact_name']] or messages[i]['user_to_name'] in [contact1['contact_name'], contact2['contact_name']]
 
+def test_contacts_inbox(app, client, auth):
+    auth.login()
+    inbox = client.get('/contacts').json['inbox']
+
+    # Sorted by most recent message
+    assert [entry['contact_name'] for entry in inbox] == ['test2', 'test3']
+    assert inbox[0]['last_message']['text'] == ("long message" * 20)[:100]
+    assert inbox[1]['last_message']['text'] == "Hello back from test3 to test!"
+    assert inbox[0]['room_id'] == '1'
+    assert all(entry['unread_count'] == 0 for entry in inbox)
+
+    # A new message from test3 moves it to the top and counts as unread
+    with app.app_context():
+        test = get_user_by_name('test')
+        test3 = get_user_by_name('test3')
+        conversation = get_conversation(test3, test)
+        msg = Message(conversation_id=conversation.id, user_from=test3.id,
+                      user_to=test.id, text='Are you there?')
+        db_.session.add(msg)
+        db_.session.flush()
+        update_conversation_summary(msg)
+        db_.session.commit()
+        room_id = conversation.room_id
+
+    inbox = client.get('/contacts').json['inbox']
+    assert inbox[0]['contact_name'] == 'test3'
+    assert inbox[0]['last_message']['text'] == 'Are you there?'
+    assert inbox[0]['unread_count'] == 1
+
+    # Opening the conversation clears the unread count
+    client.get(f'/chat/{room_id}')
+    inbox = client.get('/contacts').json['inbox']
+    assert inbox[0]['unread_count'] == 0
+
+def test_contacts_inbox_pages(client, auth):
+    auth.login()
+    first = client.get('/contacts?limit=1').json
+    assert [entry['contact_name'] for entry in first['inbox']] == ['test2']
+    assert first['inbox_has_more']
+    # The first page still carries every contact and the recent messages
+    assert [contact['contact_name'] for contact in first['contacts_data']] == ['test2', 'test3']
+    assert len(first['message_data']) == 3
+
+    second = client.get(f"/contacts?limit=1&before={first['inbox'][0]['room_id']}").json
+    assert [entry['contact_name'] for entry in second['inbox']] == ['test3']
+    assert not second['inbox_has_more']
+    assert 'contacts_data' not in second
+
+    assert client.get('/contacts?before=x').status_code == 400
+    assert client.get('/contacts?limit=0').status_code == 400
+
 def test_contacts_no_login(client):
     response = client.get('/contacts')
     
@@ -1,5 +1,5 @@
-from message_app.data_classes import User, Contact, Message
-from message_app.db import get_db
+from message_app.data_classes import User, Contact, Conversation, Message
+from message_app.db import get_db, rebuild_conversation_summaries
 from werkzeug.security import generate_password_hash
 from datetime import datetime, timezone
 
@@ -70,8 +70,20 @@ def insert_contact_data():
     db.session.add(test_user2_contact)
     db.session.commit()
     
+def insert_conversation_data():
+    """
+    test_user has a conversation with other_user and one with test_user2.
+    """
+    db = get_db()
+    db.session.add_all([
+        Conversation(low_user = 1, high_user = 2),
+        Conversation(low_user = 1, high_user = 3)
+    ])
+    db.session.commit()
+
 def insert_message_data():
     tm1 = Message(
+        conversation_id = 1,
         user_from = 1,
         user_to = 2,
         text = "Hello from test user!",
@@ -79,6 +91,7 @@ def insert_message_data():
     )
     
     tm2 = Message(
+        conversation_id = 1,
         user_from = 2,
         user_to = 1,
         text = "Hello back from test2!",
@@ -86,6 +99,7 @@ def insert_message_data():
     )
     
     tm3 = Message(
+        conversation_id = 2,
         user_from = 1,
         user_to = 3,
         text = "Hello from test user to test3!",
@@ -93,6 +107,7 @@ def insert_message_data():
     )
     
     tm4 = Message(
+        conversation_id = 2,
         user_from = 3,
         user_to = 1,
         text = "Hello back from test3 to test!",
@@ -101,6 +116,7 @@ def insert_message_data():
     
     # Long message
     tm5 = Message(
+        conversation_id = 1,
         user_from = 1,
         user_to = 2,
         text = "long message" * 20,
@@ -111,7 +127,12 @@ def insert_message_data():
     db.session.add_all([tm1, tm2, tm3, tm4, tm5])
     db.session.commit()
     
+    # Messages added directly bypass chat.on_message, so fill the inbox here
+    rebuild_conversation_summaries()
+    db.session.commit()
+    
 def insert_test_data():
     insert_user_data()
     insert_contact_data()
+    insert_conversation_data()
     insert_message_data()
\ No newline at end of file
@@ -1,4 +1,6 @@
-from message_app.db import get_db
+from sqlalchemy import select, text
+from message_app.db import get_db, get_conversation, get_user_by_name
+from message_app.data_classes import Message
 from message_app import db_
 
 def test_get_close_db(app):
@@ -19,3 +21,28 @@ def test_init_db_command(runner, monkeypatch):
     result = runner.invoke(args=['init-db'])
     assert 'Initialized' in result.output
     assert Recorder.called
+
+
+def test_get_conversation(app):
+    with app.app_context():
+        test = get_user_by_name('test')
+        test2 = get_user_by_name('test2')
+        island = get_user_by_name('island')
+
+        # Both directions share one canonical conversation
+        assert get_conversation(test, test2).id == get_conversation(test2, test).id
+        assert get_conversation(island, test) is None
+
+        conversation = get_conversation(island, test, create=True)
+        db_.session.commit()
+        assert (conversation.low_user, conversation.high_user) == (test.id, island.id)
+        assert get_conversation(test, island, create=True).id == conversation.id
+
+
+def test_history_query_uses_conversation_index(app):
+    with app.app_context():
+        query = (select(Message).where(Message.conversation_id == 1)
+                 .order_by(Message.created_at.desc(), Message.id.desc()).limit(50))
+        compiled = query.compile(db_.engine, compile_kwargs={'literal_binds': True})
+        plan = db_.session.execute(text(f'EXPLAIN QUERY PLAN {compiled}')).all()
+        assert any('ix_message_data_conversation_created' in row[-1] for row in plan)
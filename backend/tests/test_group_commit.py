@@ -0,0 +1,109 @@
+import threading
+
+import pytest
+from sqlalchemy import select
+
+from message_app import db_, group_commit
+from message_app.data_classes import ConversationSummary, Message
+from message_app.group_commit import GroupCommitWriter, get_writer
+
+def test_group_commit_disabled_by_default(app):
+    assert get_writer(app) is None
+
+def test_group_commit_enabled(app):
+    app.config['MESSAGE_GROUP_COMMIT'] = True
+    group_commit.init_app(app)
+    assert isinstance(get_writer(app), GroupCommitWriter)
+
+def test_group_commit_batches_and_keeps_order(app, monkeypatch):
+    batch_sizes = []
+    insert_messages = group_commit.insert_messages
+    def recording_insert(rows):
+        batch_sizes.append(len(rows))
+        return insert_messages(rows)
+    monkeypatch.setattr(group_commit, 'insert_messages', recording_insert)
+
+    writer = GroupCommitWriter(window=0.05, max_size=8)
+    senders, per_sender = 4, 5
+    results = {}
+    start = threading.Barrier(senders)
+
+    def send_all(sender):
+        with app.app_context():
+            start.wait()
+            results[sender] = [
+                writer.submit({'conversation_id': 1, 'user_from': 1, 'user_to': 2,
+                               'text': f'{sender}-{i}'})
+                for i in range(per_sender)
+            ]
+
+    threads = [threading.Thread(target=send_all, args=(s,)) for s in range(senders)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # Every message was written, in fewer transactions than messages
+    assert sum(batch_sizes) == senders * per_sender
+    assert len(batch_sizes) < senders * per_sender
+    assert max(batch_sizes) <= 8
+
+    # Each sender got back its own rows, ids increasing in send order
+    for sender, rows in results.items():
+        assert [row.text for row in rows] == [f'{sender}-{i}' for i in range(per_sender)]
+        assert [row.id for row in rows] == sorted(row.id for row in rows)
+
+    with app.app_context():
+        stored = db_.session.scalars(select(Message.text).where(Message.text.contains('-'))).all()
+        assert len(stored) == senders * per_sender
+        summary = db_.session.get(ConversationSummary, (2, 1))
+        assert summary.unread_count == senders * per_sender
+
+def test_group_commit_leader_steps_down_after_own_message(app, monkeypatch):
+    # The first batch is held until two more messages are queued behind it
+    release = threading.Event()
+    written = []
+    insert_messages = group_commit.insert_messages
+    def recording_insert(rows):
+        release.wait(timeout=5)
+        written.append((rows[0]['text'], threading.current_thread().name))
+        return insert_messages(rows)
+    monkeypatch.setattr(group_commit, 'insert_messages', recording_insert)
+
+    writer = GroupCommitWriter(window=0, max_size=1)
+
+    def send(text):
+        with app.app_context():
+            writer.submit({'conversation_id': 1, 'user_from': 1, 'user_to': 2, 'text': text})
+
+    threads = {text: threading.Thread(target=send, args=(text,), name=text) for text in 'abc'}
+    threads['a'].start()
+    while not writer._has_leader:
+        threading.Event().wait(0.001)
+    threads['b'].start()
+    threads['c'].start()
+    while len(writer._pending) < 2:
+        threading.Event().wait(0.001)
+    release.set()
+    for t in threads.values():
+        t.join(timeout=5)
+
+    # Every message was written once, and the last batch each handler wrote
+    # held its own message: none kept writing after its own ack was ready
+    assert [text for text, _ in written] == ['a', 'b', 'c']
+    last_written = {thread: text for text, thread in written}
+    assert all(thread == text for thread, text in last_written.items())
+
+def test_group_commit_failure_reaches_every_sender(app, monkeypatch):
+    def failing_insert(rows):
+        raise RuntimeError('Database connection lost')
+    monkeypatch.setattr(group_commit, 'insert_messages', failing_insert)
+
+    writer = GroupCommitWriter(window=0, max_size=8)
+    with app.app_context():
+        with pytest.raises(RuntimeError):
+            writer.submit({'conversation_id': 1, 'user_from': 1, 'user_to': 2, 'text': 'lost'})
+        # The writer is usable again after a failed batch
+        monkeypatch.undo()
+        row = writer.submit({'conversation_id': 1, 'user_from': 1, 'user_to': 2, 'text': 'kept'})
+        assert row.text == 'kept'
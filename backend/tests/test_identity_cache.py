@@ -0,0 +1,85 @@
+import time
+
+from sqlalchemy import event
+
+from message_app import db_
+from message_app.data_classes import User
+from message_app.db import get_user, get_user_by_name, get_user_by_uuid
+from message_app.identity_cache import IdentityCache, UserRecord, get_cache
+
+
+def test_lookups_share_one_record(app):
+    with app.app_context():
+        cache = get_cache(app)
+        user = get_user_by_name('test')
+        assert isinstance(user, UserRecord)
+        assert get_user(user.id) is user
+        assert get_user_by_uuid(user.uuid) is user
+        assert get_user_by_name('nobody') is None
+        assert cache.stats() == {'hits': 2, 'misses': 2, 'size': 1}
+
+
+def test_lru_eviction_and_ttl(app, monkeypatch):
+    with app.app_context():
+        cache = IdentityCache(max_size=2, ttl=60)
+        for user_id in (1, 2, 3):
+            cache.put(UserRecord(user_id, f'uuid{user_id}', f'user{user_id}'))
+        assert cache.stats()['size'] == 2
+        assert cache.get('user_name', 'user3').id == 3
+        assert cache.stats()['misses'] == 0
+
+        # user1 was evicted, so it is read from user_data
+        assert cache.get('id', 1).user_name == 'test'
+        assert cache.stats()['misses'] == 1
+
+        now = time.monotonic()
+        monkeypatch.setattr('message_app.identity_cache.time.monotonic', lambda: now + 61)
+        assert cache.get('id', 1).user_name == 'test'
+        assert cache.stats()['misses'] == 2
+
+
+def test_profile_change_invalidates(app):
+    with app.app_context():
+        user = get_user_by_name('test')
+        db_.session.get(User, user.id).user_name = 'renamed'
+        # Not visible to the cache until the change is committed
+        assert get_user_by_name('test') is user
+        db_.session.commit()
+        assert get_user_by_name('test') is None
+        assert get_user(user.id).user_name == 'renamed'
+
+
+def test_registration_invalidates(app, client):
+    with app.app_context():
+        cache = get_cache(app)
+        # A stale record still holding the name of a since-deleted user
+        cache.put(UserRecord(999, 'stale-uuid', 'newcomer'))
+    client.post('/auth/register', json={'username': 'newcomer', 'password': 'pw'})
+    with app.app_context():
+        assert get_user_by_name('newcomer').id != 999
+
+
+def test_no_user_reads_per_message(app, client, auth):
+    """ Steady-state chat traffic reads user_data zero times per message """
+    auth.login()
+    app_socketio = app.extensions['socketio']
+    socketio_client = app_socketio.test_client(app, namespace='/chat', flask_test_client=client)
+    assert socketio_client.is_connected(namespace='/chat')
+    message = [{'recipient_user_name': 'test2', 'message': 'hello'}]
+    socketio_client.emit('message', message, namespace='/chat')
+
+    with app.app_context():
+        engine = db_.engine
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        for _ in range(3):
+            socketio_client.emit('message', message, namespace='/chat')
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+        socketio_client.disconnect(namespace='/chat')
+
+    assert any('INSERT INTO message_data' in statement for statement in statements)
+    assert not [statement for statement in statements if 'FROM user_data' in statement]
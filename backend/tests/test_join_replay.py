@@ -0,0 +1,111 @@
+import pytest
+
+from message_app import chat, db_
+from message_app.data_classes import Message
+from conftest import send, latest_id
+
+
+@pytest.fixture
+def socket_client(app, client, auth):
+    auth.login()
+    socketio_client = app.extensions['socketio'].test_client(
+        app, namespace='/chat', flask_test_client=client)
+    yield socketio_client
+    socketio_client.disconnect(namespace='/chat')
+
+
+def replayed_ids(received):
+    return [m['id'] for event in received if event['name'] == 'missed_messages'
+            for m in event['args'][0]['messages']]
+
+
+def test_join_replays_missed_messages(app, socket_client):
+    app.config['SYNC_PAGE_SIZE'] = 2
+    mark = latest_id(app)
+    ids = send(app, 2, 1, 5)
+    socket_client.emit('join', {'room': '1', 'last_seen': mark}, namespace='/chat')
+    received = socket_client.get_received(namespace='/chat')
+
+    assert [event['name'] for event in received] == ['missed_messages'] * 3 + ['room_joined']
+    assert all(len(event['args'][0]['messages']) <= 2 for event in received[:-1])
+    assert replayed_ids(received) == ids
+    message = received[0]['args'][0]['messages'][0]
+    assert message['sender']['username'] == 'test2'
+    assert message['conversation_id'] == 1
+    assert received[-1]['args'][0] == {'room': '1', 'high_water_mark': ids[-1], 'resync': False}
+
+    # Live traffic follows the replay
+    socket_client.send([{'recipient_user_name': 'test2', 'message': 'live'}], namespace='/chat')
+    received = socket_client.get_received(namespace='/chat')
+    assert [event['name'] for event in received] == ['message']
+    assert received[0]['args']['id'] > ids[-1]
+
+
+def test_join_replay_has_no_gap(app, socket_client, monkeypatch):
+    # A message committed after the backlog was read but before the socket
+    # entered the room is sent once, in the replay
+    mark = latest_id(app)
+    ids = send(app, 2, 1, 2)
+    join_room = chat.join_room
+
+    def join_room_late(room):
+        ids.extend(send(app, 2, 1, 1))
+        join_room(room)
+    monkeypatch.setattr(chat, 'join_room', join_room_late)
+
+    socket_client.emit('join', {'room': '1', 'last_seen': mark}, namespace='/chat')
+    received = socket_client.get_received(namespace='/chat')
+    assert replayed_ids(received) == ids
+    assert received[-1]['args'][0]['high_water_mark'] == ids[-1]
+
+
+def test_join_replay_sends_late_commits_below_the_mark(app, socket_client, monkeypatch):
+    # On PostgreSQL a message can commit after a larger id was read. Stand
+    # in for that by taking the middle message out until the join
+    mark = latest_id(app)
+    ids = send(app, 2, 1, 3)
+    with app.app_context():
+        late = db_.session.get(Message, ids[1])
+        row = {column: getattr(late, column) for column in
+               ('id', 'conversation_id', 'user_from', 'user_to', 'text', 'created_at')}
+        db_.session.delete(late)
+        db_.session.commit()
+    join_room = chat.join_room
+
+    def join_room_late(room):
+        with app.app_context():
+            db_.session.add(Message(**row))
+            db_.session.commit()
+        join_room(room)
+    monkeypatch.setattr(chat, 'join_room', join_room_late)
+
+    socket_client.emit('join', {'room': '1', 'last_seen': mark}, namespace='/chat')
+    received = socket_client.get_received(namespace='/chat')
+    assert replayed_ids(received) == [ids[0], ids[2], ids[1]]
+    assert received[-1]['args'][0]['high_water_mark'] == ids[2]
+
+
+def test_join_without_missed_messages(app, socket_client):
+    mark = latest_id(app)
+    socket_client.emit('join', {'room': '1', 'last_seen': mark}, namespace='/chat')
+    received = socket_client.get_received(namespace='/chat')
+    assert [event['name'] for event in received] == ['room_joined']
+    assert received[0]['args'][0]['high_water_mark'] == mark
+
+
+def test_join_too_far_behind(app, socket_client):
+    app.config['SYNC_PAGE_SIZE'] = 2
+    app.config['SYNC_MAX_BEHIND'] = 3
+    mark = latest_id(app)
+    send(app, 2, 1, 4)
+    socket_client.emit('join', {'room': '1', 'last_seen': mark}, namespace='/chat')
+    received = socket_client.get_received(namespace='/chat')
+    assert [event['name'] for event in received] == ['room_joined']
+    assert received[0]['args'][0] == {'room': '1', 'high_water_mark': mark, 'resync': True}
+
+
+@pytest.mark.parametrize('last_seen', ['5', -1, 1.5, True])
+def test_join_bad_last_seen(socket_client, last_seen):
+    socket_client.emit('join', {'room': '1', 'last_seen': last_seen}, namespace='/chat')
+    received = socket_client.get_received(namespace='/chat')
+    assert [event['name'] for event in received] == ['error']
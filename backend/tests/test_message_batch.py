@@ -0,0 +1,90 @@
+import unittest.mock
+
+import pytest
+from sqlalchemy import select
+
+from message_app import db_
+from message_app.data_classes import Message
+
+
+def send_batch(socket, messages, recipient='test2'):
+    return socket.emit('message_batch', {'recipient_user_name': recipient, 'messages': messages},
+                       namespace='/chat', callback=True)
+
+
+def test_message_batch(app, socket_clients):
+    sender, receiver = socket_clients
+    statements = []
+    with app.app_context():
+        engine = db_.engine
+    record = lambda conn, cursor, statement, *args: statements.append(statement)
+    db_.event.listen(engine, 'before_cursor_execute', record)
+    try:
+        ack = send_batch(sender, ['one', '', 'two', 3, 'three'])
+    finally:
+        db_.event.remove(engine, 'before_cursor_execute', record)
+
+    assert [result['ok'] for result in ack['results']] == [True, False, True, False, True]
+    ids = [result['id'] for result in ack['results'] if result['ok']]
+    assert ids == sorted(ids)
+    assert ack['results'][1]['error'] == 'message must be a non-empty string'
+    # One statement stores every message
+    assert sum(statement.lstrip().upper().startswith('INSERT INTO MESSAGE_DATA')
+               for statement in statements) == 1
+
+    for socket in (sender, receiver):
+        received = socket.get_received(namespace='/chat')
+        assert [event['name'] for event in received] == ['message_batch']
+        payloads = received[0]['args'][0]
+        assert [p['text'] for p in payloads] == ['one', 'two', 'three']
+        assert [p['id'] for p in payloads] == ids
+        assert payloads[0]['sender']['username'] == 'test'
+        assert payloads[0]['conversation_id'] == 1
+
+    with app.app_context():
+        texts = db_.session.scalars(select(Message.text).where(Message.id.in_(ids))
+                                    .order_by(Message.id)).all()
+    assert texts == ['one', 'two', 'three']
+
+
+def test_message_batch_unknown_recipient(socket_clients):
+    sender, _ = socket_clients
+    ack = send_batch(sender, ['hi'], recipient='nobody')
+    assert ack == {'results': [{'ok': False, 'error': 'recipient not found'}]}
+    assert [event['name'] for event in sender.get_received(namespace='/chat')] == ['error']
+
+
+@pytest.mark.parametrize('payload', [
+    ['hi'], 'hi', None,
+    {'recipient_user_name': 'test2', 'messages': 'hi'},
+    {'recipient_user_name': ['test2'], 'messages': ['hi']},
+    {'messages': ['hi']},
+])
+def test_message_batch_malformed(socket_clients, payload):
+    sender, receiver = socket_clients
+    ack = sender.emit('message_batch', payload, namespace='/chat', callback=True)
+    assert not ack
+    received = sender.get_received(namespace='/chat')
+    assert [event['name'] for event in received] == ['error']
+    assert receiver.get_received(namespace='/chat') == []
+
+
+def test_message_batch_too_large(app, socket_clients):
+    app.config['MESSAGE_BATCH_EVENT_MAX_SIZE'] = 2
+    sender, _ = socket_clients
+    ack = send_batch(sender, ['a', 'b', 'c'])
+    assert [result['ok'] for result in ack['results']] == [False] * 3
+    assert sender.get_received(namespace='/chat') == []
+
+
+def test_message_batch_db_failure(app, socket_clients):
+    sender, receiver = socket_clients
+    with app.app_context():
+        count = db_.session.scalar(select(db_.func.count()).select_from(Message))
+        with unittest.mock.patch.object(db_.session, 'commit', side_effect=Exception('lost')):
+            ack = send_batch(sender, ['a', ''])
+        assert db_.session.scalar(select(db_.func.count()).select_from(Message)) == count
+    assert ack['results'] == [{'ok': False, 'error': 'database error'},
+                              {'ok': False, 'error': 'message must be a non-empty string'}]
+    assert [event['name'] for event in sender.get_received(namespace='/chat')] == ['error']
+    assert receiver.get_received(namespace='/chat') == []
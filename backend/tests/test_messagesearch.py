@@ -0,0 +1,71 @@
+import pytest
+
+def test_messagesearch_login_required(client):
+    response = client.get('/messages/search?q=hello')
+    assert response.status_code == 302
+    assert 'auth/login' in response.location
+
+@pytest.mark.parametrize(
+        ('username', 'search_term', 'ids'), (
+            # newest first, matches from every conversation the user is part of
+            ('test', 'hello', [4, 3, 2, 1]),
+            ('test', 'HELLO back', [4, 2]),
+            ('test2', 'hello', [2, 1]),
+            ('test3', 'test2', []),
+            ('island', 'hello', []),
+            ('test', '', []))
+        )
+def test_messagesearch_scope(client, auth, username, search_term, ids):
+    auth.login(username, username)
+    response = client.get(f'/messages/search?q={search_term}')
+    assert response.status_code == 200
+    assert [r['id'] for r in response.json['results']] == ids
+
+def test_messagesearch_result(client, auth):
+    auth.login()
+    result = client.get('/messages/search?q=back&room_id=1').json['results']
+    assert len(result) == 1
+    assert result[0]['snippet'] == 'Hello <mark>back</mark> from test2!'
+    assert result[0]['room_id'] == '1'
+    assert result[0]['sender']['username'] == 'test2'
+    assert result[0]['recipient']['username'] == 'test'
+
+    # test2 and test3 have no conversation together
+    auth.login('test2', 'test2')
+    assert client.get('/messages/search?q=hello&room_id=2').status_code == 404
+
+def test_messagesearch_escapes_message_text(app, client, auth):
+    from message_app import db_
+    from message_app.db import insert_messages
+    with app.app_context():
+        insert_messages([{'conversation_id': 1, 'user_from': 2, 'user_to': 1,
+                          'text': '<script>alert(1)</script> <img src=x onerror=alert(2)> hello'}])
+        db_.session.commit()
+    auth.login()
+    result = client.get('/messages/search?q=alert').json['results'][0]
+    assert result['snippet'] == ('&lt;script&gt;<mark>alert</mark>(1)&lt;/script&gt; '
+                                 '&lt;img src=x onerror=<mark>alert</mark>(2)&gt; hello')
+
+def test_messagesearch_pagination(client, auth):
+    auth.login()
+    page = client.get('/messages/search?q=hello&limit=3').json
+    assert [r['id'] for r in page['results']] == [4, 3, 2]
+    assert page['next_cursor'] == 2
+
+    page = client.get(f"/messages/search?q=hello&limit=3&before={page['next_cursor']}").json
+    assert [r['id'] for r in page['results']] == [1]
+    assert page['next_cursor'] is None
+
+def test_messagesearch_indexes_core_inserts(app, client, auth):
+    """ chat.on_message inserts with Core; the index must pick those up too """
+    from sqlalchemy import insert
+    from message_app import db_
+    from message_app.data_classes import Message
+
+    with app.app_context():
+        db_.session.execute(insert(Message).values(conversation_id=1, user_from=2, user_to=1,
+                                                   text='pineapple pizza?'))
+        db_.session.commit()
+    auth.login()
+    results = client.get('/messages/search?q=pineapple').json['results']
+    assert [r['snippet'] for r in results] == ['<mark>pineapple</mark> pizza?']
@@ -0,0 +1,79 @@
+import pytest
+
+from message_app.metrics import Histogram
+from conftest import sample
+
+
+@pytest.fixture
+def app_config():
+    return {'METRICS_ENABLED': True}
+
+
+def test_http_metrics(client, auth):
+    auth.login()
+    client.get('/contacts')
+    client.get('/chat/1')
+    text = client.get('/metrics').get_data(as_text=True)
+
+    assert sample(text, 'http_requests_total{blueprint="contacts",route="/contacts",'
+                        'method="GET",status="200"}') == 1
+    assert sample(text, 'http_requests_total{blueprint="chat",route="/chat/<room_id>",'
+                        'method="GET",status="200"}') == 1
+    assert sample(text, 'http_request_duration_seconds_count{blueprint="chat",'
+                        'route="/chat/<room_id>",method="GET"}') == 1
+    assert sample(text, 'http_request_duration_seconds_bucket{blueprint="chat",'
+                        'route="/chat/<room_id>",method="GET",le="+Inf"}') == 1
+    assert sample(text, 'db_pool_checkout_wait_seconds_count') > 0
+    assert sample(text, 'db_pool_connection_hold_seconds_count') > 0
+    assert sample(text, 'db_pool_checked_out_connections') == 0
+    assert '/metrics' not in text
+
+
+@pytest.mark.parametrize('app_config', [{}])
+def test_metrics_off_by_default(client):
+    assert client.get('/metrics').status_code == 404
+
+
+@pytest.mark.parametrize('app_config', [{'METRICS_ENABLED': True, 'METRICS_TOKEN': 's3cret'}])
+def test_metrics_token(client):
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    response = client.get('/metrics', headers={'Authorization': 'Bearer s3cret'})
+    assert response.status_code == 200
+    assert 'http_requests_total' in response.get_data(as_text=True)
+
+
+def test_socketio_metrics(app, client, auth):
+    auth.login()
+    socketio_client = app.extensions['socketio'].test_client(
+        app, namespace='/chat', flask_test_client=client)
+    try:
+        socketio_client.emit('join', {'room': '1'}, namespace='/chat')
+        socketio_client.emit('message', [{'recipient_user_name': 'test2', 'message': 'hi'}],
+                             namespace='/chat')
+        text = client.get('/metrics').get_data(as_text=True)
+    finally:
+        socketio_client.disconnect(namespace='/chat')
+
+    assert sample(text, 'socketio_events_total{event="connect"}') == 1
+    assert sample(text, 'socketio_events_total{event="join"}') == 1
+    assert sample(text, 'socketio_events_total{event="message"}') == 1
+    assert sample(text, 'socketio_connected_sockets') == 1
+    assert sample(text, 'socketio_rooms') == 1
+    assert sample(text, 'chat_message_insert_seconds_count') == 1
+    assert sample(text, 'cache_hits_total{cache="identity_cache"}') > 0
+
+
+def test_histogram_exposition():
+    histogram = Histogram('latency_seconds', 'Latency.', ('route',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3):
+        histogram.observe(value, route='/a')
+    assert histogram.render().splitlines() == [
+        '# HELP latency_seconds Latency.',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{route="/a",le="0.1"} 1',
+        'latency_seconds_bucket{route="/a",le="1.0"} 3',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 4',
+        'latency_seconds_sum{route="/a"} 4.05',
+        'latency_seconds_count{route="/a"} 4',
+    ]
@@ -0,0 +1,103 @@
+import os
+import tempfile
+import threading
+import time
+
+import pytest
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from message_app import create_app, db_
+from message_app.pool import TimedQueuePool, engine_options, pool_stats
+from conftest import sample
+
+
+@pytest.fixture
+def app_config():
+    return {'METRICS_ENABLED': True}
+
+
+def test_engine_options_for_postgres():
+    options = engine_options({
+        'SQLALCHEMY_DATABASE_URI': 'postgresql://app@db/messenger',
+        'DB_POOL_SIZE': 4, 'DB_MAX_OVERFLOW': 2, 'DB_POOL_TIMEOUT': 1.5,
+        'DB_POOL_RECYCLE': 600, 'DB_POOL_PRE_PING': False,
+    })
+    assert options == {'poolclass': TimedQueuePool, 'pool_size': 4, 'max_overflow': 2, 'pool_timeout': 1.5,
+                       'pool_recycle': 600, 'pool_pre_ping': False}
+
+
+def test_sqlite_pool_class(app):
+    # Only the class changes: SQLAlchemy uses a QueuePool for SQLite files anyway
+    assert app.config['SQLALCHEMY_ENGINE_OPTIONS'] == {'poolclass': TimedQueuePool}
+    assert engine_options({'SQLALCHEMY_DATABASE_URI': 'sqlite://'}) == {}
+    assert engine_options({'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:'}) == {}
+
+
+def test_pool_stats(app, client):
+    with app.app_context():
+        with db_.engine.connect():
+            stats = pool_stats(db_.engine)
+            assert stats['checked_out'] == 1
+            assert stats['size'] == 5
+    text = client.get('/metrics').get_data(as_text=True)
+    assert sample(text, 'db_pool_size') == 5
+    assert sample(text, 'db_pool_checked_out_connections') == 0
+    assert sample(text, 'db_pool_idle_connections') >= 1
+
+
+def test_checkout_timeout_is_counted():
+    db_fd, db_path = tempfile.mkstemp()
+    app = create_app(test_config={
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+        'SQLALCHEMY_ENGINE_OPTIONS': {'poolclass': TimedQueuePool, 'pool_size': 1,
+                                      'max_overflow': 0, 'pool_timeout': 0.05},
+        'METRICS_ENABLED': True,
+    })
+    client = app.test_client()
+    try:
+        with app.app_context():
+            with db_.engine.connect():
+                with pytest.raises(PoolTimeoutError):
+                    client.post('/auth/login', json={'username': 'test', 'password': 'test'})
+            db_.engine.dispose()
+        text = client.get('/metrics').get_data(as_text=True)
+        assert sample(text, 'db_pool_checkout_timeouts_total') == 1
+        assert sample(text, 'db_pool_checkout_wait_seconds_count') >= 1
+        assert sample(text, 'db_pool_connection_hold_seconds_count') >= 1
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+
+
+def test_checkout_wait_is_timed():
+    db_fd, db_path = tempfile.mkstemp()
+    app = create_app(test_config={
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+        'SQLALCHEMY_ENGINE_OPTIONS': {'poolclass': TimedQueuePool, 'pool_size': 1,
+                                      'max_overflow': 0, 'pool_timeout': 5},
+        'METRICS_ENABLED': True,
+    })
+    held = threading.Event()
+
+    def hold_connection():
+        with app.app_context():
+            with db_.engine.connect():
+                held.set()
+                time.sleep(0.2)
+
+    try:
+        holder = threading.Thread(target=hold_connection)
+        holder.start()
+        held.wait()
+        with app.app_context():
+            # Waits for the holder to give the only connection back
+            with db_.engine.connect():
+                pass
+            holder.join()
+            db_.engine.dispose()
+        text = app.test_client().get('/metrics').get_data(as_text=True)
+        assert sample(text, 'db_pool_checkout_wait_seconds_count') >= 2
+        assert sample(text, 'db_pool_checkout_wait_seconds_sum') >= 0.1
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
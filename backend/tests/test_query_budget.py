@@ -0,0 +1,69 @@
+"""
+Query budgets per endpoint, measured in steady state (caches warm). Raising
+a budget should be a deliberate decision, not a side effect.
+"""
+import logging
+import re
+
+import pytest
+
+BUDGETS = [
+    ('/auth/current-user', 0),
+    # the contacts version for the ETag, the inbox page, the contact list
+    # and the recent messages
+    ('/contacts', 4),
+    ('/contacts?before=1', 2),
+    ('/chat/1', 4),
+    ('/chat/1?before=2', 3),
+    ('/users/search?username=te', 2),
+    ('/messages/search?q=hello', 1),
+]
+
+
+@pytest.mark.parametrize(('url', 'budget'), BUDGETS)
+def test_endpoint_query_budget(client, auth, query_budget, url, budget):
+    auth.login()
+    client.get(url)
+    with query_budget(budget):
+        response = client.get(url)
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize(('url', 'budget'), [
+    # the contacts version only
+    ('/contacts', 1),
+    # the room's conversation and the inbox entry with its latest message id
+    ('/chat/1', 2),
+])
+def test_not_modified_query_budget(client, auth, query_budget, url, budget):
+    auth.login()
+    etag = client.get(url).headers['ETag']
+    with query_budget(budget):
+        response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+
+def test_socket_message_query_budget(app, client, auth, query_budget):
+    auth.login()
+    socketio_client = app.extensions['socketio'].test_client(
+        app, namespace='/chat', flask_test_client=client)
+    message = [{'recipient_user_name': 'test2', 'message': 'hello'}]
+    try:
+        socketio_client.emit('message', message, namespace='/chat')
+        # conversation lookup, insert, summary update, contacts versions
+        with query_budget(4):
+            socketio_client.emit('message', message, namespace='/chat')
+    finally:
+        socketio_client.disconnect(namespace='/chat')
+
+
+def test_server_timing_header(client, auth, caplog):
+    auth.login()
+    with caplog.at_level(logging.INFO, logger='message_app.instrumentation'):
+        response = client.get('/contacts')
+    timing = response.headers['Server-Timing']
+    match = re.fullmatch(r'db;dur=[\d.]+;desc="(\d+) queries", total;dur=[\d.]+', timing)
+    assert match
+    line = caplog.records[-1].getMessage()
+    assert line.startswith('http method=GET path=/contacts endpoint=contacts.contacts status=200')
+    assert f'queries={match.group(1)} ' in line
@@ -0,0 +1,113 @@
+import pytest
+
+from message_app import db_, read_state
+from message_app.data_classes import ConversationSummary
+from message_app.db import advance_read_watermark
+from message_app.read_state import get_watermarks
+from conftest import send
+
+
+def summary(app, user_id=1, contact_id=2):
+    """ Returns (read watermark, unread count) of user_id's inbox entry for contact_id """
+    with app.app_context():
+        row = db_.session.get(ConversationSummary, (user_id, contact_id))
+        return row.last_read_message_id, row.unread_count
+
+
+@pytest.fixture
+def scheduled(monkeypatch):
+    """ Keeps flushes from running in the background; the list collects the scheduled tasks """
+    tasks = []
+    monkeypatch.setattr(read_state.socketio, 'start_background_task', tasks.append)
+    return tasks
+
+
+def test_advance_read_watermark(app):
+    ids = send(app, 2, 1, 3)
+    assert summary(app) == (ids[-1] - 3, 3)
+    with app.app_context():
+        assert advance_read_watermark(1, 1, ids[1])
+        db_.session.commit()
+    assert summary(app) == (ids[1], 1)
+
+    with app.app_context():
+        # Never backwards
+        assert not advance_read_watermark(1, 1, ids[0])
+        # Never past the latest message
+        assert advance_read_watermark(1, 1, ids[-1] + 100)
+        db_.session.commit()
+    assert summary(app) == (ids[-1], 0)
+
+
+def test_own_messages_are_not_unread(app):
+    ids = send(app, 1, 2, 2) + send(app, 2, 1, 1)
+    with app.app_context():
+        advance_read_watermark(1, 1, ids[1])
+        db_.session.commit()
+    assert summary(app) == (ids[1], 1)
+
+
+def test_read_event(app, socket_clients):
+    get_watermarks(app).interval = 0
+    reader, other = socket_clients
+    ids = send(app, 2, 1, 3)
+    reader.emit('read', {'room': '1', 'up_to': ids[1]}, namespace='/chat')
+    assert summary(app) == (ids[1], 1)
+
+    received = other.get_received(namespace='/chat')
+    assert [event['name'] for event in received] == ['read']
+    assert received[0]['args'][0]['up_to'] == ids[1]
+    assert received[0]['args'][0]['room'] == '1'
+
+    # The reader is in the room too
+    assert [event['name'] for event in reader.get_received(namespace='/chat')] == ['read']
+
+
+def test_read_events_are_coalesced(app, socket_clients, scheduled, query_budget):
+    reader, other = socket_clients
+    ids = send(app, 2, 1, 5)
+    # Reporting is free: nothing is written until the flush
+    with query_budget(0):
+        for message_id in ids:
+            reader.emit('read', {'room': '1', 'up_to': message_id}, namespace='/chat')
+    watermarks = get_watermarks(app)
+    assert watermarks.pending() == 1
+    assert len(scheduled) == 1
+    assert summary(app) == (ids[0] - 1, 5)
+
+    with app.app_context(), query_budget(2) as statements:
+        assert watermarks.flush() == 1
+    # One watermark write, plus the reader's contacts version
+    assert sum(statement.startswith('UPDATE conversation_summary') for statement in statements) == 1
+    assert summary(app) == (ids[-1], 0)
+    assert [event['name'] for event in other.get_received(namespace='/chat')] == ['read']
+
+
+def test_read_event_for_other_users_room(app, client, auth):
+    get_watermarks(app).interval = 0
+    auth.login('test2', 'test2')
+    socket = app.extensions['socketio'].test_client(app, namespace='/chat', flask_test_client=client)
+    before = summary(app, contact_id=3)
+    # Conversation 2 is between test and test3
+    socket.emit('read', {'room': '2', 'up_to': 100}, namespace='/chat')
+    assert summary(app, contact_id=3) == before
+    assert socket.get_received(namespace='/chat') == []
+    socket.disconnect(namespace='/chat')
+
+
+@pytest.mark.parametrize('data', [{'room': '1'}, {'room': '1', 'up_to': '5'},
+                                  {'room': '1', 'up_to': -1},
+                                  {'room': '1', 'up_to': True}, {'room': 'nope', 'up_to': 1}])
+def test_read_event_bad_data(socket_clients, data):
+    reader, _ = socket_clients
+    reader.emit('read', data, namespace='/chat')
+    assert [event['name'] for event in reader.get_received(namespace='/chat')] == ['error']
+
+
+def test_opening_chat_moves_watermark(app, client, auth):
+    ids = send(app, 2, 1, 2)
+    auth.login()
+    client.get('/chat/1')
+    assert summary(app) == (ids[-1], 0)
+    entry = client.get('/contacts').json['inbox'][0]
+    assert entry['last_read_message_id'] == entry['last_message']['id'] == ids[-1]
@@ -0,0 +1,124 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+import pytest
+
+from message_app import create_app, db_
+from message_app.db import init_db
+from message_app.group_commit import GroupCommitWriter
+from message_app.replica import RecentWriters, get_router, replica_binds
+from test_data import insert_test_data
+from conftest import AuthActions
+
+
+@pytest.fixture
+def replica_app(tmp_path):
+    """ An app on a primary SQLite file with a copy of it as replica; the copy's user 'test3' is renamed 'replica3' """
+    db_fd, db_path = tempfile.mkstemp()
+    setup_app = create_app(test_config={'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}'})
+    with setup_app.app_context():
+        init_db()
+        insert_test_data()
+        db_.engine.dispose()
+    replica_path = tmp_path / 'replica.db'
+    shutil.copyfile(db_path, replica_path)
+    with sqlite3.connect(replica_path) as connection:
+        connection.execute("UPDATE user_data SET user_name = 'replica3' WHERE user_name = 'test3'")
+    connection.close()
+
+    app = create_app(test_config={
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+        'SQLALCHEMY_REPLICA_URLS': [f'sqlite:///{replica_path}'],
+    })
+    yield app
+    with app.app_context():
+        for engine in db_.engines.values():
+            engine.dispose()
+    os.close(db_fd)
+    os.unlink(db_path)
+
+
+@pytest.fixture
+def replica_client(replica_app):
+    client = replica_app.test_client()
+    AuthActions(client).login()
+    return client
+
+
+def contact_names(client):
+    return [c['contact_name'] for c in client.get('/contacts').json['contacts_data']]
+
+
+def search_names(client, term):
+    return [u['user_name'] for u in client.get(f'/users/search?username={term}').json['users']]
+
+
+def test_replica_binds():
+    assert replica_binds(['postgres://a/db', 'postgresql://b/db']) == \
+        {'replica0': 'postgresql://a/db', 'replica1': 'postgresql://b/db'}
+
+
+def test_no_router_without_replicas(app):
+    assert get_router(app) is None
+
+
+def test_read_only_endpoints_use_replica(replica_client):
+    assert search_names(replica_client, 'replica3') == ['replica3']
+    assert search_names(replica_client, 'test3') == []
+
+
+def test_writes_use_primary(replica_client):
+    # The POST looks the user up on the primary, where 'replica3' does not exist
+    response = replica_client.post('/contacts', json={'username': 'replica3'})
+    assert response.json['message'] == 'user replica3 not found'
+
+
+def test_read_your_writes(replica_app, replica_client):
+    assert search_names(replica_client, 'replica3') == ['replica3']
+    response = replica_client.post('/contacts', json={'username': 'island'})
+    assert response.json['message'] == 'success'
+    # The user just wrote, so their reads stay on the primary for the window
+    assert search_names(replica_client, 'test3') == ['test3']
+    assert search_names(replica_client, 'replica3') == []
+
+    get_router(replica_app).recent_writers.window = 0
+    assert search_names(replica_client, 'replica3') == ['replica3']
+
+
+def test_update_matching_nothing_is_not_a_write(replica_app, replica_client):
+    router = get_router(replica_app)
+    replica_client.get('/chat/1')
+    router.recent_writers = RecentWriters(window=60)
+    # The conversation is already read, so marking it read changes no row
+    replica_client.get('/chat/1')
+    assert not router.recent_writers.is_recent(1)
+
+
+def test_group_commit_notes_every_sender(replica_app):
+    writer = GroupCommitWriter(window=0.2, max_size=2)
+    start = threading.Barrier(2)
+
+    def send(user_from, user_to):
+        with replica_app.app_context():
+            start.wait()
+            writer.submit({'conversation_id': 1, 'user_from': user_from, 'user_to': user_to,
+                           'text': 'batched'})
+
+    threads = [threading.Thread(target=send, args=pair) for pair in ((1, 2), (2, 1))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    writers = get_router(replica_app).recent_writers
+    assert writers.is_recent(1) and writers.is_recent(2)
+
+
+def test_recent_writers_is_bounded():
+    writers = RecentWriters(window=60, max_size=2)
+    for user_id in (1, 2, 3):
+        writers.note(user_id)
+    assert not writers.is_recent(1)
+    assert writers.is_recent(2) and writers.is_recent(3)
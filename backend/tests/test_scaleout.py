@@ -0,0 +1,183 @@
+"""
+Multi-process Socket.IO test.
+
+Two worker processes each serve the app against a shared database, with a
+local stand-in for the message queue broker. A message sent by a client
+connected to worker A must reach a room member connected to worker B.
+
+The Flask-SocketIO test client refuses to run with a message queue, so the
+workers are real servers and the clients speak Engine.IO long-polling
+through urllib.
+"""
+import http.cookiejar
+import json
+import multiprocessing
+import socket
+import socketserver
+import threading
+import time
+import urllib.request
+
+import socketio
+from sqlalchemy import select
+
+from message_app import create_app, db_
+from message_app.data_classes import User
+
+TIMEOUT = 10
+
+
+class _BrokerHandler(socketserver.StreamRequestHandler):
+    """ Relays every line a subscriber writes to all connected subscribers """
+    def handle(self):
+        with self.server.lock:
+            self.server.subscribers.append(self.wfile)
+        for line in self.rfile:
+            with self.server.lock:
+                for subscriber in self.server.subscribers:
+                    subscriber.write(line)
+                    subscriber.flush()
+
+
+class LocalBroker(socketserver.ThreadingTCPServer):
+    """ Minimal fan-out pub/sub broker standing in for Redis in tests """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _BrokerHandler)
+        self.lock = threading.Lock()
+        self.subscribers = []
+
+
+class LocalBrokerManager(socketio.PubSubManager):
+    """ Socket.IO client manager that publishes through a LocalBroker """
+    name = 'local-broker'
+
+    def __init__(self, port, channel='message_app', write_only=False):
+        super().__init__(channel=channel, write_only=write_only)
+        self.connection = socket.create_connection(('127.0.0.1', port))
+        self.reader = self.connection.makefile('r')
+        self.write_lock = threading.Lock()
+
+    def _publish(self, data):
+        with self.write_lock:
+            self.connection.sendall((json.dumps(data) + '\n').encode())
+
+    def _listen(self):
+        for line in self.reader:
+            yield line
+
+
+class PollingClient:
+    """ Just enough of a Socket.IO client (Engine.IO v4 long-polling) for /chat """
+    def __init__(self, port):
+        self.base_url = f'http://127.0.0.1:{port}'
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.sid = None
+
+    def _request(self, path, body=None, content_type='text/plain;charset=UTF-8'):
+        request = urllib.request.Request(self.base_url + path, data=body and body.encode(),
+                                         headers={'Content-Type': content_type})
+        with self.opener.open(request, timeout=TIMEOUT) as response:
+            return response.read().decode()
+
+    def _poll_url(self):
+        return f'/socket.io/?EIO=4&transport=polling&sid={self.sid}'
+
+    def login(self, username):
+        self._request('/auth/login', json.dumps({'username': username, 'password': username}),
+                      content_type='application/json')
+
+    def connect(self):
+        handshake = self._request('/socket.io/?EIO=4&transport=polling')
+        self.sid = json.loads(handshake[1:])['sid']
+        self._request(self._poll_url(), '40/chat,')
+        assert any(packet.startswith('40/chat,') for packet in self._poll())
+
+    def emit(self, event, data):
+        self._request(self._poll_url(), '42/chat,' + json.dumps([event, data]))
+
+    def _poll(self):
+        return self._request(self._poll_url()).split('\x1e')
+
+    def receive(self, event):
+        """ Returns the arguments of the next /chat event with this name """
+        deadline = time.monotonic() + TIMEOUT
+        while time.monotonic() < deadline:
+            for packet in self._poll():
+                if packet.startswith('42/chat,'):
+                    name, *args = json.loads(packet[len('42/chat,'):])
+                    if name == event:
+                        return args
+        raise TimeoutError(f'no {event!r} event received')
+
+
+def _serve(database_uri, broker_port, port):
+    app = create_app(test_config={
+        'SQLALCHEMY_DATABASE_URI': database_uri,
+        'SOCKETIO_CLIENT_MANAGER': LocalBrokerManager(broker_port),
+        'LOG_LEVEL': 'WARNING',
+    })
+    app.extensions['socketio'].run(app, host='127.0.0.1', port=port, use_reloader=False,
+                                   log_output=False, allow_unsafe_werkzeug=True)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_server(port):
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f'worker on port {port} did not start')
+
+
+def test_message_reaches_room_member_on_other_worker(app):
+    database_uri = app.config['SQLALCHEMY_DATABASE_URI']
+    with app.app_context():
+        test = db_.session.scalar(select(User).where(User.user_name == 'test'))
+        test2 = db_.session.scalar(select(User).where(User.user_name == 'test2'))
+        room = min(test.uuid + test2.uuid, test2.uuid + test.uuid)
+
+    broker = LocalBroker()
+    threading.Thread(target=broker.serve_forever, daemon=True).start()
+
+    context = multiprocessing.get_context('fork')
+    ports = [_free_port(), _free_port()]
+    workers = [context.Process(target=_serve, args=(database_uri, broker.server_address[1], port),
+                               daemon=True)
+               for port in ports]
+    try:
+        for worker, port in zip(workers, ports):
+            worker.start()
+            _wait_for_server(port)
+
+        receiver = PollingClient(ports[1])
+        receiver.login('test2')
+        receiver.connect()
+        receiver.emit('join', {'room': room})
+        assert receiver.receive('room_joined') == [{'room': room}]
+
+        sender = PollingClient(ports[0])
+        sender.login('test')
+        sender.connect()
+        sender.emit('message', [{'recipient_user_name': 'test2', 'message': 'across workers'}])
+
+        message = receiver.receive('message')[0]
+        assert message['text'] == 'across workers'
+        assert message['sender']['username'] == 'test'
+        assert message['recipient']['username'] == 'test2'
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.join(TIMEOUT)
+        broker.shutdown()
+        broker.server_close()
@@ -0,0 +1,83 @@
+from datetime import datetime
+
+from sqlalchemy import func, select, text
+
+from message_app import db_
+from message_app.data_classes import Contact, Conversation, ConversationSummary, Message, User
+from message_app.db import init_db
+from message_app.search import search_messages
+from message_app.seed_demo import seed_scale
+
+
+def dump():
+    """ Returns every generated row that the seed decides """
+    return (
+        db_.session.execute(select(User.id, User.uuid, User.user_name).order_by(User.id)).all(),
+        db_.session.execute(select(Contact.user, Contact.contact).order_by(Contact.id)).all(),
+        db_.session.execute(select(Message.conversation_id, Message.user_from, Message.user_to,
+                                   Message.text, Message.created_at).order_by(Message.id)).all(),
+    )
+
+
+def test_scale_mode_is_deterministic(app):
+    with app.app_context():
+        init_db()
+        seed_scale(100, 8, 1000, seed=7)
+        first = dump()
+        init_db()
+        seed_scale(100, 8, 1000, seed=7)
+        assert dump() == first
+        init_db()
+        seed_scale(100, 8, 1000, seed=8)
+        assert dump() != first
+
+
+def test_scale_mode_command(app, runner):
+    with app.app_context():
+        messages_before = db_.session.scalar(select(func.count()).select_from(Message))
+    result = runner.invoke(args=['seed-demo', '--users', '300', '--contacts-per-user', '10',
+                                 '--messages', '5000', '--days', '30', '--until', '2025-06-01',
+                                 '--batch-size', '700'])
+    assert result.exit_code == 0, result.output
+    assert '300 users' in result.output
+
+    with app.app_context():
+        # Added after the four test users
+        assert db_.session.scalar(select(func.count()).select_from(User)) == 304
+        assert db_.session.scalar(select(func.count()).select_from(Message)) == messages_before + 5000
+
+        # Heavy-tailed: the busiest users have many times the average number of contacts
+        degrees = db_.session.scalars(select(func.count()).select_from(Contact)
+                                      .where(Contact.user > 4).group_by(Contact.user)).all()
+        assert 6 <= sum(degrees) / 300 <= 14
+        assert max(degrees) > 3 * sum(degrees) / 300
+
+        # Messages go between contacts, in time order, within the window
+        first_new = db_.session.scalar(select(func.min(Message.id)).where(Message.user_from > 4))
+        rows = db_.session.execute(select(Message.created_at, Conversation.low_user,
+                                          Conversation.high_user, Message.user_from, Message.user_to)
+                                   .join(Conversation, Message.conversation_id == Conversation.id)
+                                   .where(Message.id >= first_new).order_by(Message.id)).all()
+        stamps = [row.created_at.replace(tzinfo=None) for row in rows]
+        assert stamps == sorted(stamps)
+        assert datetime(2025, 5, 2) <= stamps[0] < stamps[-1] <= datetime(2025, 6, 1)
+        assert all({row.user_from, row.user_to} == {row.low_user, row.high_user} for row in rows)
+
+        # Indexes are rebuilt and the inbox summaries are filled in
+        indexes = db_.session.scalars(text("SELECT name FROM sqlite_master WHERE type = 'index'")).all()
+        assert 'ix_message_data_conversation_created' in indexes
+        summaries = db_.session.scalar(select(func.count()).select_from(ConversationSummary)
+                                       .where(ConversationSummary.last_message_id.is_not(None)))
+        assert summaries > 0
+        sender = db_.session.get(User, rows[0].user_from)
+        words = [word for message in db_.session.scalars(select(Message.text)
+                                                         .where(Message.user_from == sender.id))
+                 for word in message.split() if word.isalpha()]
+        page, _ = search_messages(sender, words[0])
+        assert page
+        user_name = sender.user_name
+
+    # Every user shares one password hash
+    response = app.test_client().post('/auth/login',
+                                      json={'username': user_name, 'password': 'demo123'})
+    assert response.status_code == 200
@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from message_app import create_app, db_
+from message_app.slow_query import normalize_parameter, summarize
+
+
+@pytest.fixture
+def slow_app(app, tmp_path):
+    """ The test app with a zero threshold, so every statement counts as slow """
+    log_file = tmp_path / 'slow.log'
+    slow_app = create_app(test_config={
+        'SQLALCHEMY_DATABASE_URI': app.config['SQLALCHEMY_DATABASE_URI'],
+        'SLOW_QUERY_THRESHOLD_MS': 0,
+        'SLOW_QUERY_LOG_FILE': str(log_file),
+    })
+    slow_app.log_file = log_file
+    yield slow_app
+    with slow_app.app_context():
+        db_.engine.dispose()
+
+
+def read_log(log_file):
+    return [json.loads(line) for line in log_file.read_text().splitlines()]
+
+
+def test_slow_select_is_logged_with_plan(slow_app):
+    client = slow_app.test_client()
+    client.post('/auth/login', json={'username': 'test', 'password': 'test'})
+    client.get('/chat/1')
+
+    entries = read_log(slow_app.log_file)
+    page = [e for e in entries if e['call_site'] and 'get_message_page' in e['call_site']]
+    assert page
+    entry = page[0]
+    assert entry['statement'].startswith('SELECT message_data.id')
+    assert entry['call_site'].startswith('message_app/chat.py:')
+    assert any('ix_message_data_conversation_created' in line for line in entry['plan'])
+
+
+def test_parameters_are_normalized():
+    assert normalize_parameter(('short', 'x' * 100, b'\x00' * 8), 10) == \
+        ['short', "'xxxxxxxxxx'... (100 chars)", '<8 bytes>']
+    assert normalize_parameter(list(range(50)), 10) == '<50 values>'
+
+
+def test_summary_ranks_by_total_time(slow_app):
+    entries = [
+        {'statement': 'A', 'duration_ms': 150, 'call_site': 'x.py:1 in a'},
+        {'statement': 'B', 'duration_ms': 120, 'call_site': 'y.py:2 in b'},
+        {'statement': 'B', 'duration_ms': 110, 'call_site': 'y.py:2 in b'},
+    ]
+    summary = summarize(entries, top=5)
+    assert [(s['statement'], s['count'], s['total_ms']) for s in summary] == \
+        [('B', 2, 230), ('A', 1, 150)]
+
+    slow_app.log_file.write_text(''.join(json.dumps(e) + '\n' for e in entries))
+    result = slow_app.test_cli_runner().invoke(args=['slow-queries', '--top', '1'])
+    assert '1. total 230.0 ms, 2 calls, max 120.0 ms' in result.output
+    assert 'at y.py:2 in b' in result.output
+    assert 'A' not in result.output.split('\n', 1)[1]
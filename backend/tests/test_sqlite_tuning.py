@@ -0,0 +1,60 @@
+import os
+import tempfile
+
+import pytest
+from sqlalchemy import insert
+
+from message_app import create_app, db_
+from message_app.data_classes import Message
+from message_app.sqlite_tuning import connection_pragmas, run_maintenance
+
+
+def pragma(name):
+    return db_.session.connection().exec_driver_sql(f'PRAGMA {name}').scalar()
+
+
+def test_performance_profile(app):
+    with app.app_context():
+        assert pragma('journal_mode') == 'wal'
+        assert pragma('synchronous') == 1       # NORMAL
+        assert pragma('busy_timeout') == 5000
+        assert pragma('cache_size') == -65536
+        assert pragma('mmap_size') == 256 * 1024 * 1024
+        assert pragma('temp_store') == 2        # MEMORY
+
+
+def test_default_profile():
+    db_fd, db_path = tempfile.mkstemp()
+    app = create_app(test_config={'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+                                  'SQLITE_PROFILE': 'default'})
+    try:
+        with app.app_context():
+            assert pragma('journal_mode') == 'delete'
+            assert pragma('synchronous') == 2   # FULL
+            db_.engine.dispose()
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+
+
+def test_unknown_profile():
+    with pytest.raises(ValueError):
+        connection_pragmas({'SQLITE_PROFILE': 'fast'})
+
+
+def test_maintenance_truncates_wal(app, runner):
+    db_path = app.config['SQLALCHEMY_DATABASE_URI'][len('sqlite:///'):]
+    with app.app_context():
+        db_.session.execute(insert(Message), [
+            {'conversation_id': 1, 'user_from': 1, 'user_to': 2, 'text': f'message {i}'}
+            for i in range(500)])
+        db_.session.commit()
+        assert os.path.getsize(db_path + '-wal') > 0
+
+        result = run_maintenance(db_.engine)
+        assert result['busy'] == 0
+        assert result['checkpointed_pages'] == result['log_pages']
+        assert os.path.getsize(db_path + '-wal') == 0
+
+    result = runner.invoke(args=['sqlite-maintenance'])
+    assert 'Checkpointed' in result.output
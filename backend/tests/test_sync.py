@@ -0,0 +1,86 @@
+import pytest
+
+from conftest import send, latest_id
+
+
+def test_sync_all_conversations(app, client, auth):
+    auth.login()
+    mark = latest_id(app)
+    ids = send(app, 2, 1, 2) + send(app, 3, 1, 1) + send(app, 1, 2, 1)
+
+    response = client.get(f'/sync?after={mark}')
+    assert response.status_code == 200
+    data = response.json
+    assert [m['id'] for m in data['messages']] == ids
+    assert [m['room_id'] for m in data['messages']] == ['1', '1', '2', '1']
+    assert data['messages'][2]['sender']['username'] == 'test3'
+    assert data['high_water_mark'] == ids[-1]
+    assert not data['has_more'] and not data['resync']
+
+    # Nothing new: the mark stays where it was
+    data = client.get(f"/sync?after={data['high_water_mark']}").json
+    assert data['messages'] == [] and data['high_water_mark'] == ids[-1]
+
+
+def test_sync_one_conversation(app, client, auth):
+    auth.login()
+    mark = latest_id(app)
+    ids = send(app, 2, 1, 2)
+    send(app, 3, 1, 2)
+    data = client.get(f'/sync?after={mark}&room_id=1').json
+    assert [m['id'] for m in data['messages']] == ids
+
+
+def test_sync_pages_without_gaps(app, client, auth):
+    auth.login()
+    mark = latest_id(app)
+    ids = send(app, 2, 1, 5)
+    seen = []
+    while True:
+        data = client.get(f'/sync?after={mark}&limit=2').json
+        seen += [m['id'] for m in data['messages']]
+        mark = data['high_water_mark']
+        if not data['has_more']:
+            break
+    assert seen == ids
+
+
+def test_sync_too_far_behind(app, client, auth):
+    app.config['SYNC_MAX_BEHIND'] = 3
+    auth.login()
+    mark = latest_id(app)
+    send(app, 2, 1, 4)
+    data = client.get(f'/sync?after={mark}&limit=2').json
+    assert data == {'messages': [], 'high_water_mark': mark, 'has_more': False, 'resync': True}
+    # Behind, but within one page: no resync
+    data = client.get(f'/sync?after={mark + 1}&limit=5').json
+    assert len(data['messages']) == 3 and not data['resync']
+
+
+def test_sync_skips_strangers(app, client, auth):
+    # 'island' is not among test's contacts, so the conversation is left out
+    auth.login()
+    mark = latest_id(app)
+    send(app, 4, 1, 1)
+    assert client.get(f'/sync?after={mark}').json['messages'] == []
+
+
+def test_sync_other_users_room(app, client, auth):
+    auth.login('test2', 'test2')
+    assert client.get('/sync?after=0&room_id=2').status_code == 404
+
+
+@pytest.mark.parametrize('query', ['', 'after=x', 'after=-1', 'after=1&limit=0'])
+def test_sync_bad_args(client, auth, query):
+    auth.login()
+    assert client.get(f'/sync?{query}').status_code == 400
+
+
+def test_sync_query_count(app, client, auth, query_budget):
+    auth.login()
+    mark = latest_id(app)
+    send(app, 2, 1, 3)
+    client.get(f'/sync?after={mark}')
+    # Warm caches: the messages query alone
+    with query_budget(1):
+        assert len(client.get(f'/sync?after={mark}').json['messages']) == 3
@@ -16,4 +16,40 @@ def test_usersearch(client, auth, search_term, messages):
     response = client.get(f'/users/search?username={search_term}')
     assert response.status_code == 200
     for m in messages:
-        assert m in response.data
\ No newline at end of file
+        assert m in response.data
+
+@pytest.mark.parametrize(
+        ('search_term', 'usernames'), (
+            ('test', ['test', 'test2', 'test3']),
+            ('est', ['test', 'test2', 'test3']),
+            ('SLA', ['island']),
+            ('is', ['island']),
+            ('st', []),
+            ('', []))
+        )
+def test_usersearch_ranking(client, auth, search_term, usernames):
+    auth.login()
+    response = client.get(f'/users/search?username={search_term}')
+    assert [u['user_name'] for u in response.json['users']] == usernames
+
+
+def test_usersearch_pagination(client, auth):
+    auth.login()
+    page = client.get('/users/search?username=test&limit=2').json
+    assert [u['user_name'] for u in page['users']] == ['test', 'test2']
+    assert page['next_offset'] == 2
+    # No password hashes or other internal columns
+    assert all(set(u) == {'uuid', 'user_name'} for u in page['users'])
+
+    page = client.get('/users/search?username=test&limit=2&offset=2').json
+    assert [u['user_name'] for u in page['users']] == ['test3']
+    assert page['next_offset'] is None
+
+    assert client.get('/users/search?username=test&limit=0').status_code == 400
+
+
+def test_usersearch_index_tracks_new_users(client, auth):
+    client.post('/auth/register', json={'username': 'zebra', 'password': 'z'})
+    auth.login()
+    response = client.get('/users/search?username=ebr')
+    assert [u['user_name'] for u in response.json['users']] == ['zebra']